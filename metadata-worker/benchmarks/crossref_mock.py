@@ -0,0 +1,351 @@
+"""
+Local stand-in for the crossref works endpoint.
+
+Serves a synthetic result set through deep cursors, like
+https://api.crossref.org/works, so the crossref downloader can be measured
+without the network and without load on crossref:
+
+- records: size of the result set of every filter, the DOIs depend on the
+  filter without its dates, so different filters get different records
+- from-/until-<x>-date filters select the records of a date window, the
+  records are spread over days from 2020-01-01 with most of them late
+- latency: seconds before every response, plus latency_per_row for every
+  requested row
+- max_rows: larger pages are answered with status 400 like crossref does,
+  pages larger than overload_rows with status 503
+- error injection: error_rate of the calls fail with status 500,
+  throttle_rate with status 429 and a Retry-After header and timeout_rate
+  are answered after hang seconds
+- rate limit: the X-Rate-Limit-Limit and X-Rate-Limit-Interval headers
+  announce rate_limit requests per second, with enforce_rate_limit faster
+  calls are answered with status 429
+- cursor_ttl: cursors not used for this many seconds return no items
+
+Execute with
+    poetry run python -m benchmarks.crossref_mock [--port 8080]
+        [--records N] [--latency S] [--error-rate P] ...
+and download with the base_url printed.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from worker.tasks.download.crossref_downloader_util import parse_date
+
+FIRST_DAY = date(2020, 1, 1)
+DEFAULTS = {
+    "records": 10_000,
+    "days": 1000,
+    "padding": 200,
+    "latency": 0.01,
+    "latency_per_row": 0.0,
+    "max_rows": 1000,
+    "overload_rows": None,
+    "error_rate": 0.0,
+    "throttle_rate": 0.0,
+    "timeout_rate": 0.0,
+    "hang": 5.0,
+    "retry_after": 1,
+    "rate_limit": 50,
+    "enforce_rate_limit": False,
+    "cursor_ttl": None,
+    "seed": 0,
+}
+
+
+class CrossrefMock:
+    """
+    Serves the synthetic works endpoint from a thread, see the module
+    docstring for the settings.
+
+    Methods
+    -------
+    start()
+        Starts the server and returns its base_url
+    stop()
+        Stops the server
+    stats()
+        Returns the number of requests, records served and responses per
+        status
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, **settings):
+        unknown = set(settings) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown settings {sorted(unknown)}")
+        self.settings = {**DEFAULTS, **settings}
+        self.address = (host, port)
+        self.server = None
+        self.random = random.Random(self.settings["seed"])
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.served = 0
+        self.statuses = {}
+        # cursor -> last use
+        self.cursors = {}
+        self.serial = 0
+        self.tokens = self.settings["rate_limit"]
+        self.refilled = time.monotonic()
+
+    def start(self):
+        self.server = ThreadingHTTPServer(self.address, Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "records_served": self.served,
+                "statuses": dict(self.statuses),
+            }
+
+    def count(self, status, records=0):
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.served += records
+
+    def draw(self):
+        """
+        The injected failure of the next call: "error", "throttle",
+        "timeout" or None
+        """
+        s = self.settings
+        with self.lock:
+            self.requests += 1
+            p = self.random.random()
+        for failure, rate in (
+            ("error", s["error_rate"]),
+            ("throttle", s["throttle_rate"]),
+            ("timeout", s["timeout_rate"]),
+        ):
+            if p < rate:
+                return failure
+            p -= rate
+        return None
+
+    def over_limit(self):
+        if not self.settings["enforce_rate_limit"]:
+            return False
+        rate = self.settings["rate_limit"]
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                rate, self.tokens + (now - self.refilled) * rate
+            )
+            self.refilled = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def day(self, i):
+        """
+        The update date of record i, more records on later days
+        """
+        s = self.settings
+        return FIRST_DAY + timedelta(
+            days=int(s["days"] * (i / s["records"]) ** 0.5)
+        )
+
+    def window(self, filter):
+        """
+        The indices of the records selected by the date filters
+        """
+        records = range(self.settings["records"])
+        start, end = 0, len(records)
+        for key, value in filter.items():
+            if not key.endswith("-date"):
+                continue
+            if key.startswith("from-"):
+                start = max(start, bisect_left(
+                    records, parse_date(value), key=self.day
+                ))
+            elif key.startswith("until-"):
+                end = min(end, bisect_right(
+                    records, parse_date(value, last=True), key=self.day
+                ))
+        return start, max(start, end)
+
+    def new_cursor(self, offset):
+        with self.lock:
+            self.serial += 1
+            cursor = f"DXF1ZXF1mock{self.serial}/{offset}"
+            self.cursors[cursor] = time.monotonic()
+        return cursor
+
+    def offset(self, cursor):
+        """
+        The offset of a cursor, None if it expired or is unknown
+        """
+        if cursor == "*":
+            return 0
+        ttl = self.settings["cursor_ttl"]
+        now = time.monotonic()
+        with self.lock:
+            used = self.cursors.get(cursor)
+            if used is None or ttl and now - used > ttl:
+                return None
+            # cursors can be used again, e.g. after a timeout
+            self.cursors[cursor] = now
+        return int(cursor.rsplit("/", 1)[1])
+
+    def record(self, prefix, i):
+        day = self.day(i)
+        return {
+            "DOI": f"10.5555/{prefix}.{i}",
+            "type": "journal-article",
+            "title": [f"Synthetic work {i}"],
+            "abstract": "x" * self.settings["padding"],
+            "container-title": ["Journal of Benchmarks"],
+            "author": [{"given": "Ada", "family": f"Author {i % 97}"}],
+            "indexed": {
+                "date-parts": [[day.year, day.month, day.day]],
+                "date-time": f"{day.isoformat()}T10:00:00Z",
+                "timestamp": int(time.mktime(day.timetuple())) * 1000,
+            },
+            "reference": [
+                {"key": f"ref{r}", "DOI": f"10.5555/{prefix}.{r}"}
+                for r in range(max(0, i - 3), i)
+            ],
+        }
+
+    def works(self, params):
+        """
+        Returns the status, headers, body and number of records of a call
+        of the works endpoint
+        """
+        s = self.settings
+        failure = self.draw()
+        if failure == "timeout":
+            time.sleep(s["hang"])
+        if failure == "error":
+            return 500, {}, b"Internal Server Error", 0
+        retry = {"Retry-After": str(s["retry_after"])}
+        if failure == "throttle" or self.over_limit():
+            return 429, retry, b"Too Many Requests", 0
+
+        rows = int(params.get("rows", 20))
+        if rows > s["max_rows"]:
+            return 400, {}, b"rows must be at most 1000", 0
+        if s["overload_rows"] and rows > s["overload_rows"]:
+            return 503, {}, b"Service Unavailable", 0
+        filter = dict(
+            f.split(":", 1) for f in params.get("filter", "").split(",") if f
+        )
+        start, end = self.window(filter)
+        total = end - start
+        time.sleep(s["latency"] + s["latency_per_row"] * rows)
+
+        offset = self.offset(params.get("cursor", "*"))
+        if offset is None:
+            # crossref answers expired cursors with an empty page
+            offset, n = total, 0
+        else:
+            n = max(0, min(rows, total - offset))
+        prefix = zlib.crc32(json.dumps(
+            {k: v for k, v in filter.items() if not k.endswith("-date")},
+            sort_keys=True,
+        ).encode())
+        message = {
+            "facets": {},
+            "total-results": total,
+            "items": [
+                self.record(prefix, start + offset + i) for i in range(n)
+            ],
+            "items-per-page": rows,
+            "query": {"start-index": 0, "search-terms": None},
+        }
+        if "cursor" in params:
+            message["next-cursor"] = self.new_cursor(offset + n)
+        body = json.dumps({
+            "status": "ok",
+            "message-type": "work-list",
+            "message-version": "1.0.0",
+            "message": message,
+        }).encode()
+        return 200, {
+            "Content-Type": "application/json",
+            "X-Rate-Limit-Limit": str(s["rate_limit"]),
+            "X-Rate-Limit-Interval": "1s",
+        }, body, n
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this every response
+    # on a kept alive connection waits for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        mock = self.server.mock
+        if url.path.rstrip("/") != "/works":
+            status, headers, body, records = 404, {}, b"Not Found", 0
+        else:
+            params = {
+                k: v[-1]
+                for k, v in urllib.parse.parse_qs(url.query).items()
+            }
+            status, headers, body, records = mock.works(params)
+        try:
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client timed out
+            status, records = "aborted", 0
+        mock.count(status, records)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    for name, default in DEFAULTS.items():
+        option = "--" + name.replace("_", "-")
+        if isinstance(default, bool):
+            parser.add_argument(option, action="store_true")
+        else:
+            parser.add_argument(
+                option, default=default,
+                type=float if isinstance(default, float) or default is None
+                else int,
+            )
+    args = vars(parser.parse_args())
+    mock = CrossrefMock(args.pop("host"), args.pop("port"), **args)
+    print(f"serving {mock.start()}works")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(mock.stats()))
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
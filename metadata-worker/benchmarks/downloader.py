@@ -0,0 +1,185 @@
+"""
+Benchmark of the crossref downloader against the local stand-in of the
+crossref API (benchmarks/crossref_mock.py).
+
+Measures records per second, pages and retries of the downloader task and
+the requests and statuses seen by the mock, and writes the results to a
+JSON file:
+
+- rows: fixed page sizes, with a latency growing with the page size
+- adaptive: adaptive page sizes, with a mock that fails large pages
+- format: parsed pages, compressed JSON lines and raw responses
+- errors: injected server errors, 429s and timeouts, with retries
+- rate_limit: a mock enforcing a lower rate than the downloader starts with
+- concurrency: several filters downloaded one by one and in parallel
+- shards: one filter downloaded with one cursor and in date windows
+
+Execute with
+    poetry run python -m benchmarks.downloader [--quick] [--output FILE]
+        [--compare FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from benchmarks.crossref_mock import CrossrefMock
+from benchmarks.runner import compare, git_revision, key
+from worker.tasks.download import crossref_downloader
+
+FILTER = {"issn": "0000-0000", "from-update-date": "2020-01-01"}
+# the latency of a page grows with its size, like crossref's
+LATENCY = {"latency": 0.02, "latency_per_row": 0.0002}
+
+
+def rows_cases():
+    for rows in (20, 100, 1000):
+        yield "rows", {"rows": rows}, LATENCY, {"rows": rows}, [FILTER]
+
+
+def adaptive_cases():
+    mock = {**LATENCY, "overload_rows": 400}
+    yield "adaptive", {"adaptive_rows": False}, mock, {"rows": 100}, [FILTER]
+    yield "adaptive", {"adaptive_rows": True}, mock, {
+        "adaptive_rows": True, "rows": 100
+    }, [FILTER]
+
+
+def format_cases():
+    mock = {**LATENCY, "padding": 2000}
+    for name, params in (
+        ("json", {}),
+        ("jsonl_gzip", {"jsonl": True, "compression": "gzip"}),
+        ("raw", {"raw": True}),
+    ):
+        yield "format", {"format": name}, mock, {
+            "rows": 1000, **params
+        }, [FILTER]
+
+
+def error_cases():
+    for rate in (0.0, 0.05, 0.1):
+        mock = {
+            **LATENCY,
+            "error_rate": rate,
+            "throttle_rate": rate,
+            "timeout_rate": rate / 2,
+            "hang": 2.0,
+        }
+        yield "errors", {"rate": rate}, mock, {
+            "rows": 50, "max_retries": 5, "timeout": 1
+        }, [FILTER]
+
+
+def rate_limit_cases():
+    for enforce in (False, True):
+        mock = {**LATENCY, "rate_limit": 5, "enforce_rate_limit": enforce}
+        yield "rate_limit", {"enforce": enforce}, mock, {
+            "rows": 100, "rate_limit": 50, "max_retries": 5
+        }, [FILTER]
+
+
+def concurrency_cases():
+    filters = [{**FILTER, "issn": f"0000-000{i}"} for i in range(4)]
+    for concurrency in (1, 4):
+        yield "concurrency", {"concurrency": concurrency}, LATENCY, {
+            "rows": 200, "concurrency": concurrency
+        }, filters
+
+
+def shard_cases():
+    for shards in (1, 4):
+        yield "shards", {"shards": shards}, LATENCY, {
+            "rows": 200, "shards": shards, "concurrency": shards
+        }, [FILTER]
+
+
+CASES = [
+    rows_cases, adaptive_cases, format_cases, error_cases, rate_limit_cases,
+    concurrency_cases, shard_cases,
+]
+
+
+def run_case(mock_settings, params, filters, directory):
+    mock = CrossrefMock(**mock_settings)
+    base_url = mock.start()
+    try:
+        start = time.perf_counter()
+        result = crossref_downloader.run({"params": {
+            "concurrency": 1,
+            # the rate limit announced by the mock applies
+            "rate_limit": 50,
+            **params,
+            "filter_list": filters,
+            "directory": directory,
+            "user_agent": "benchmark (mailto:nightwatch@suub.uni-bremen.de)",
+            "base_url": base_url,
+        }})
+        seconds = time.perf_counter() - start
+    finally:
+        mock.stop()
+    return seconds, result, mock.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--quick", action="store_true", help="smaller result sets"
+    )
+    parser.add_argument("--output", default="benchmark-downloader.json")
+    parser.add_argument("--compare", help="results of an earlier run")
+    args = parser.parse_args()
+    records = 2_000 if args.quick else 20_000
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["METADATA"] = tmp
+        for cases in CASES:
+            for name, params, mock, download, filters in cases():
+                seconds, result, served = run_case(
+                    {**mock, "records": records}, download, filters,
+                    f"{name}-{len(results)}",
+                )
+                metrics = result.metrics or {}
+                downloaded = metrics.get("downloaded_records", 0)
+                result = {
+                    "name": name,
+                    "params": params,
+                    "seconds": seconds,
+                    "records": downloaded,
+                    "records_per_second": downloaded / seconds,
+                    "pages": metrics.get("pages", 0),
+                    "retries": metrics.get("retries", 0),
+                    "failed_downloads": metrics.get("failed_downloads", 0),
+                    "requests": served["requests"],
+                    "statuses": served["statuses"],
+                    "logs": result.logs,
+                }
+                results.append(result)
+                print(
+                    f"{key(result):<40} {seconds:>8.3f} s "
+                    f"{result['records_per_second']:>10.1f} records/s "
+                    f"{result['retries']:>4} retries "
+                    f"{result['failed_downloads']:>2} failed"
+                )
+
+    with open(args.output, "w", encoding="utf8") as f:
+        json.dump({
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.time(),
+            "quick": args.quick,
+            "records": records,
+            "results": results,
+        }, f, indent=2)
+    print(f"wrote {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Measures the overhead of phase transitions in the pipeline runner.
+
+Runs pipelines with a growing number of phases that each consist of one
+no-op step and reports the wall time per phase. Phases are started as soon
+as the previous one is completed, so the time per phase should stay in the
+range of microseconds to a few milliseconds.
+
+Execute with
+    poetry run python -m benchmarks.phases
+"""
+
+import time
+from worker.nw.pipeline_runner import Pipeline
+
+PHASES = [1, 10, 100, 1000]
+
+
+def blueprint(phases):
+    return {
+        "phases": [
+            [{"id": "worker.tasks.examples.noop"}] for _ in range(phases)
+        ]
+    }
+
+
+def main():
+    print(f"{'phases':>8} {'total s':>10} {'ms/phase':>10}")
+    for phases in PHASES:
+        pipeline = Pipeline(blueprint(phases), {}, None)
+        start = time.perf_counter()
+        pipeline.run()
+        duration = time.perf_counter() - start
+        per_phase = duration / phases * 1000
+        print(f"{phases:>8} {duration:>10.3f} {per_phase:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
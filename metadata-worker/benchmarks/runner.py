@@ -0,0 +1,198 @@
+"""
+Benchmark suite for the pipeline runner.
+
+Runs synthetic workloads made of the example tasks (fan_out, noop,
+set_sentinel) and writes the results to a JSON file, so runs before and
+after a change of the runner can be compared:
+
+- dispatch: overhead per task unit for a no-op step, per executor
+- fan_out: one task creating 10^3 to 10^6 task units
+- payload: task units with payloads from bytes to megabytes, per transport
+- chain: task units passing through deep chains of steps, with and without
+  step fusion
+- phases: multi-phase pipelines handing on a sentinel
+
+Execute with
+    poetry run python -m benchmarks.runner [--quick] [--output FILE]
+        [--compare FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import time
+from worker.nw.executors import ASYNC, EXECUTOR_TYPES
+from worker.nw.pipeline_runner import Pipeline, TRANSPORTS
+
+FAN_OUT = "worker.tasks.examples.fan_out"
+NOOP = "worker.tasks.examples.noop"
+ASYNC_SLEEP = "worker.tasks.examples.async_sleep"
+SET_SENTINEL = "worker.tasks.examples.set_sentinel"
+
+
+def fan_out(items, next_steps, pass_sentinel=False, **params):
+    first = {"id": FAN_OUT, "params": {"items": items, **params}}
+    if pass_sentinel:
+        first["passSentinel"] = True
+    return [first] + [{"id": step} for step in next_steps]
+
+
+def dispatch_cases(quick):
+    units = 10_000 if quick else 100_000
+    for executor in EXECUTOR_TYPES:
+        steps = fan_out(units, [NOOP])
+        if executor == ASYNC:
+            steps[1] = {"id": ASYNC_SLEEP, "params": {"duration": 0}}
+        # fan_out returns a generator, it has to stay in the main process
+        steps[1]["executor"] = executor
+        blueprint = {"phases": [steps]}
+        yield "dispatch", {"executor": executor, "units": units}, (
+            blueprint
+        ), units
+
+
+def fan_out_cases(quick):
+    for exponent in range(3, 6 if quick else 7):
+        units = 10 ** exponent
+        yield "fan_out", {"units": units}, {
+            "phases": [fan_out(units, [NOOP])]
+        }, units
+
+
+def payload_cases(quick):
+    sizes = [1, 1024, 100 * 1024, 1024 ** 2]
+    if not quick:
+        sizes.append(10 * 1024 ** 2)
+    units = 20
+    for transport in TRANSPORTS:
+        for binary in (False, True):
+            for size in sizes:
+                blueprint = {
+                    "phases": [
+                        fan_out(units, [NOOP, NOOP], size=size, binary=binary)
+                    ],
+                    "options": {"transport": transport},
+                }
+                yield "payload", {
+                    "transport": transport,
+                    "binary": binary,
+                    "size": size,
+                    "units": units,
+                }, blueprint, units * 2
+
+
+def chain_cases(quick):
+    units = 100
+    for fuse in (False, True):
+        for depth in (10, 100) if quick else (10, 100, 1000):
+            yield "chain", {"fuse": fuse, "depth": depth, "units": units}, {
+                "phases": [fan_out(units, [NOOP] * depth)],
+                "options": {"fuse": fuse},
+            }, units * depth
+
+
+def phase_cases(quick):
+    units = 100
+    for phases in (10, 100) if quick else (10, 100, 1000):
+        # every phase gets the sentinel of the phase before
+        blueprint = {
+            "phases": [
+                fan_out(units, [SET_SENTINEL], pass_sentinel=True)
+                for _ in range(phases)
+            ]
+        }
+        yield "phases", {"phases": phases, "units": units}, blueprint, (
+            phases * (1 + units)
+        )
+
+
+CASES = [
+    dispatch_cases, fan_out_cases, payload_cases, chain_cases, phase_cases
+]
+
+
+def run_case(blueprint):
+    pipeline = Pipeline(blueprint, {}, None)
+    # the runner prints the id of every step it runs
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        pipeline.run()
+        return time.perf_counter() - start
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, path):
+    with open(path, "r", encoding="utf8") as f:
+        baseline = {
+            key(r): r for r in json.load(f)["results"]
+        }
+    print()
+    print(f"compared to {path}")
+    for result in results:
+        before = baseline.get(key(result))
+        if before:
+            change = result["seconds"] / before["seconds"] - 1
+            print(f"{key(result):<70} {change:>+8.1%}")
+
+
+def key(result):
+    params = ",".join(f"{k}={v}" for k, v in result["params"].items())
+    return f"{result['name']}[{params}]"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--quick", action="store_true", help="smaller workloads"
+    )
+    parser.add_argument("--output", default="benchmark-runner.json")
+    parser.add_argument("--compare", help="results of an earlier run")
+    args = parser.parse_args()
+
+    results = []
+    for cases in CASES:
+        for name, params, blueprint, task_units in cases(args.quick):
+            seconds = run_case(blueprint)
+            result = {
+                "name": name,
+                "params": params,
+                "seconds": seconds,
+                "task_units": task_units,
+                "task_units_per_second": task_units / seconds,
+                "us_per_task_unit": seconds / task_units * 1e6,
+            }
+            results.append(result)
+            print(
+                f"{key(result):<70} {seconds:>8.3f} s "
+                f"{result['us_per_task_unit']:>10.1f} us/unit"
+            )
+
+    with open(args.output, "w", encoding="utf8") as f:
+        json.dump({
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.time(),
+            "quick": args.quick,
+            "results": results,
+        }, f, indent=2)
+    print(f"wrote {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the json and local transport of the pipeline runner.
+
+Runs synthetic crossref pages through the crossref converter, once in the
+main process and once in a process pool, and reports per record:
+
+- queued: the bytes that cross the queue, the JSON strings with the json
+  transport and the payloads the queued task units refer to with the local
+  one (these are not copied)
+- pickled: the bytes sent to the process pool, with both transports
+- records per second and the peak memory traced in the main process
+
+Execute with
+    poetry run python -m benchmarks.transport
+"""
+
+import pickle
+import time
+import tracemalloc
+from worker.nw.pipeline_runner import Pipeline, TRANSPORTS
+from worker.nw.executors import INLINE, PROCESS
+from worker.nw.utils import payload_size
+
+PAGES = 500
+ITEMS = 20
+
+
+class CountingPipeline(Pipeline):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bytes_queued = 0
+        self.bytes_pickled = 0
+
+    def encode_msg(self, msg):
+        encoded = super().encode_msg(msg)
+        if type(encoded) == str:
+            self.bytes_queued += len(encoded.encode("utf-8"))
+        else:
+            self.bytes_queued += payload_size(msg.get("data"))
+        return encoded
+
+    def prepare_task(self, msg):
+        opts = super().prepare_task(msg)
+        if self.get_executor_type(msg["task"]) == PROCESS:
+            self.bytes_pickled += len(pickle.dumps(opts))
+        return opts
+
+
+def blueprint(executor):
+    return {
+        "phases": [
+            [
+                {
+                    "id": "worker.tasks.examples.crossref_pages",
+                    "params": {"pages": PAGES, "items": ITEMS},
+                },
+                {
+                    "id": "worker.tasks.converters.crossref_article_converter",
+                    "executor": executor,
+                },
+                {"id": "worker.tasks.examples.noop"},
+            ]
+        ]
+    }
+
+
+def main():
+    records = PAGES * ITEMS
+    print(f"{PAGES} pages, {records} records")
+    print(
+        f"{'transport':<10} {'converter':<10} {'queued B/rec':>13} "
+        f"{'pickled B/rec':>14} {'records/s':>10} {'peak MiB':>9}"
+    )
+    for executor in (INLINE, PROCESS):
+        for transport in TRANSPORTS:
+            pipeline = CountingPipeline(
+                blueprint(executor), {}, None, transport=transport
+            )
+            tracemalloc.start()
+            start = time.perf_counter()
+            pipeline.run()
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"{transport:<10} {executor:<10} "
+                f"{pipeline.bytes_queued / records:>13.1f} "
+                f"{pipeline.bytes_pickled / records:>14.1f} "
+                f"{records / seconds:>10.1f} {peak / 1024 ** 2:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -14,3 +14,6 @@ echo "Installing python libraries"
 # installing python packages
 poetry add httpx=0.24.0
 poetry add psycopg2-binary
+
+# needed for zstd compressed crossref downloads
+#poetry install --extras zstd
@@ -1,21 +1,38 @@
 from worker.nw.pipeline_runner import Pipeline
+from worker.nw.profiling import PROFILERS
 from datetime import datetime
+import argparse
 import os
 
-blueprint = {
-    "phases": [
-        [
-            {
-                "id": "worker.tasks.examples.sleep",
-                "name": "test",
-                "params": {"duration": 6}
-            }
-        ],
-    ]
-}
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile", choices=PROFILERS, help="profile every task call"
+    )
+    parser.add_argument(
+        "--profile-dir", default="profile", help="directory for the profiles"
+    )
+    args = parser.parse_args()
 
-working_dir = "test"
-variables = {}
+    blueprint = {
+        "phases": [
+            [
+                {
+                    "id": "worker.tasks.examples.sleep",
+                    "name": "test",
+                    "params": {"duration": 6}
+                }
+            ],
+        ]
+    }
 
-pipeline = Pipeline(blueprint, variables, working_dir)
-pipeline.run()
+    working_dir = "test"
+    variables = {}
+
+    options = {}
+    if args.profile:
+        options["profile"] = args.profile
+        options["profile_dir"] = args.profile_dir
+
+    pipeline = Pipeline(blueprint, variables, working_dir, **options)
+    pipeline.run()
@@ -0,0 +1,20 @@
+import pytest
+from tests.tasks import collect, counted, flaky, leaky, objects, side_effects
+
+
+@pytest.fixture(autouse=True)
+def reset_tasks():
+    """
+    Clears what the test task modules recorded, before and after every test
+    """
+    def reset():
+        collect.received.clear()
+        counted.calls.clear()
+        flaky.reset()
+        leaky.kept.clear()
+        objects.returned.clear()
+        side_effects.produced.clear()
+
+    reset()
+    yield
+    reset()
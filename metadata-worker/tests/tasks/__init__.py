@@ -0,0 +1,4 @@
+"""
+Task modules used by the tests, they record what they got in module level
+lists so a test can check it after the pipeline ran
+"""
@@ -0,0 +1,13 @@
+from worker.nw.utils import Result
+
+# the data of every call
+received = []
+
+
+def run(opts):
+    """
+    Records the data it gets, spooled data as bytes
+    """
+    data = opts.get("data")
+    received.append(bytes(data) if type(data) == memoryview else data)
+    return Result(data=opts.get("data"))
@@ -0,0 +1,23 @@
+import os
+from worker.nw.utils import Result
+
+# results can be taken from the result cache of the pipeline
+CACHEABLE = True
+
+# the data of every call
+calls = []
+
+
+def cache_key(opts):
+    # fails for missing files like a key made of the file's stat would
+    if opts.get("params", {}).get("path"):
+        os.stat(opts["params"]["path"])
+    return opts.get("data")
+
+
+def run(opts):
+    calls.append(opts.get("data"))
+    if opts.get("params", {}).get("path"):
+        with open(opts["params"]["path"], "r") as f:
+            return Result(data=f.read())
+    return Result(data=opts["data"] * 2)
@@ -0,0 +1,12 @@
+from worker.nw.utils import Result, Many
+
+
+def run(opts):
+    """
+    Returns params.items as Many, encoded to bytes if params.binary is set
+    """
+    params = opts.get("params", {})
+    items = params.get("items", [])
+    if params.get("binary"):
+        items = [item.encode("utf-8") for item in items]
+    return Result(data=Many(items))
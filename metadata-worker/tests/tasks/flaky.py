@@ -0,0 +1,33 @@
+from collections import Counter
+from worker.nw.utils import Result
+
+# calls per payload
+calls = Counter()
+# payloads of the successful calls
+received = []
+
+
+def run(opts):
+    """
+    Fails the first params.failures calls of every payload, or of the
+    payloads in params.only
+    """
+    params = opts.get("params", {})
+    data = opts["data"]
+    data = data.encode("utf-8") if type(data) == str else bytes(data)
+    calls[data] += 1
+    only = params.get("only")
+    fails = only is None or data.decode("utf-8") in only
+    if fails and calls[data] <= params.get("failures", 1):
+        raise ConnectionError(f"call {calls[data]} of {data!r} failed")
+    received.append(data)
+    return Result(data=data)
+
+
+def reset():
+    calls.clear()
+    received.clear()
+
+
+def failure_metrics(opts, error):
+    return {"failed": 1, "errors": {type(error).__name__: 1}}
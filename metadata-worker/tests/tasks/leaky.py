@@ -0,0 +1,12 @@
+from worker.nw.utils import Result
+
+# what the calls kept
+kept = []
+
+
+def run(opts):
+    """
+    Keeps params.bytes bytes per call
+    """
+    kept.append(b"x" * opts.get("params", {}).get("bytes", 1024 ** 2))
+    return Result(data=opts.get("data"))
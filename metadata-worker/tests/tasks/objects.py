@@ -0,0 +1,17 @@
+from datetime import datetime
+from worker.nw.utils import Result, Many
+
+# the objects returned by the last call
+returned = []
+
+
+def run(opts):
+    """
+    Returns a datetime, bytes and a dict as Many
+    """
+    returned[:] = [
+        datetime(2024, 5, 1, 12, 30),
+        b"\x00\xffbinary",
+        {"title": ["Synthetic work"], "year": 2024},
+    ]
+    return Result(data=Many(returned))
@@ -0,0 +1,25 @@
+from worker.nw.utils import Result, Many, Partial
+
+# items the generators of this task produced
+produced = []
+
+
+def run(opts):
+    """
+    Returns a generator recording every item it produces, wrapped as given
+    in params.wrap ("many", "partial" or none)
+    """
+    params = opts.get("params", {})
+    generator = produce(params.get("items", 3))
+    wrap = params.get("wrap")
+    if wrap == "many":
+        return Result(data=Many(generator))
+    if wrap == "partial":
+        return Result(data=Partial(generator))
+    return Result(data=generator)
+
+
+def produce(count):
+    for i in range(count):
+        produced.append(i)
+        yield i
@@ -0,0 +1,14 @@
+import os
+import threading
+from worker.nw.utils import Result
+
+
+def run(opts):
+    """
+    Returns the data with the process and thread the task ran in
+    """
+    return Result(data={
+        "item": opts.get("data"),
+        "pid": os.getpid(),
+        "thread": threading.current_thread().name,
+    })
@@ -0,0 +1,50 @@
+import time
+import pytest
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+ASYNC_SLEEP = "worker.tasks.examples.async_sleep"
+NOOP = "worker.tasks.examples.noop"
+ITEMS = [f"item {i}" for i in range(6)]
+
+
+def run(step, **options):
+    pipeline = Pipeline({"phases": [[
+        {"id": EMIT, "params": {"items": ITEMS}},
+        {"id": ASYNC_SLEEP, "params": {"duration": 0.1}, **step},
+    ]]}, {}, None, metrics=True, **options)
+    start = time.perf_counter()
+    pipeline.run()
+    seconds = time.perf_counter() - start
+    return seconds, pipeline.metrics.summary()["steps"][ASYNC_SLEEP]
+
+
+def test_async_task_units_wait_at_the_same_time():
+    seconds, step = run({}, max_workers=1)
+
+    assert step["calls"] == len(ITEMS)
+    assert step["metrics"] == {"slept": len(ITEMS)}
+    # one after the other would take 0.6 s
+    assert seconds < 0.4
+
+
+def test_concurrency_limits_the_task_units_of_a_step():
+    seconds, step = run({"concurrency": 2})
+
+    assert step["calls"] == len(ITEMS)
+    # three rounds of two task units
+    assert seconds >= 0.3
+
+
+def test_async_task_in_another_executor_gets_its_own_event_loop():
+    seconds, step = run({"executor": "inline"})
+
+    assert step["calls"] == len(ITEMS)
+    assert seconds >= 0.6
+
+
+def test_sync_task_can_not_use_the_async_executor():
+    with pytest.raises(ValueError, match="has no async run method"):
+        Pipeline(
+            {"phases": [[{"id": NOOP, "executor": "async"}]]}, {}, None
+        )
@@ -0,0 +1,70 @@
+import pytest
+from tests.tasks import collect
+from worker.nw.batching import BATCH, Batch
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+COLLECT = "tests.tasks.collect"
+ITEMS = [f"item {i:02d}" for i in range(25)]
+
+
+def run(items, params, **options):
+    Pipeline({"phases": [[
+        {"id": EMIT, "params": {"items": items}},
+        {"id": BATCH, "params": params},
+        {"id": COLLECT},
+    ]]}, {}, None, **options).run()
+    return collect.received
+
+
+def test_batch_is_full_at_max_records():
+    batch = Batch({"max_records": 3}, [], 0)
+
+    assert not batch.add("a")
+    assert batch.add(["b", "c"])
+    assert batch.take() == ["a", "b", "c"]
+    assert batch.take() == []
+
+
+def test_batch_is_full_at_max_bytes():
+    batch = Batch({"max_records": None, "max_bytes": 10}, [], 0)
+
+    # serialized with quotes, 6 bytes each
+    assert not batch.add("abcd")
+    assert batch.add("efgh")
+
+
+def test_batch_is_due_after_max_seconds():
+    batch = Batch({"max_seconds": 30}, [], 0)
+    assert not batch.is_due()
+
+    batch.add("a")
+    assert not batch.is_due()
+    batch.started -= 31
+    assert batch.is_due()
+
+
+@pytest.mark.parametrize("options", [
+    {}, {"transport": "local"}, {"fuse": True},
+])
+def test_items_are_handed_on_in_batches(options):
+    received = run(ITEMS, {"max_records": 10}, **options)
+
+    assert sorted(len(batch) for batch in received) == [5, 10, 10]
+    assert sorted(i for batch in received for i in batch) == ITEMS
+
+
+def test_lists_are_collected_item_by_item():
+    received = run([["a", "b"], ["c"], []], {"max_records": 100})
+
+    assert len(received) == 1
+    assert sorted(received[0]) == ["a", "b", "c"]
+
+
+def test_batches_are_handed_on_with_a_journal(tmp_path):
+    received = run(
+        ITEMS, {"max_records": 10}, journal=str(tmp_path / "journal")
+    )
+
+    assert sorted(i for batch in received for i in batch) == ITEMS
+    assert not (tmp_path / "journal").exists()
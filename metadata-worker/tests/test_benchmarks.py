@@ -0,0 +1,40 @@
+import json
+import pytest
+from benchmarks import runner
+from worker.nw.pipeline_runner import Pipeline
+
+CASES = [
+    case for cases in runner.CASES for case in cases(True)
+    # the larger cases take seconds
+    if case[3] <= 2_000
+]
+
+
+@pytest.mark.parametrize(
+    "name, params, blueprint, task_units", CASES,
+    ids=[runner.key({"name": c[0], "params": c[1]}) for c in CASES],
+)
+def test_cases_run_the_task_units_they_report(
+    name, params, blueprint, task_units
+):
+    pipeline = Pipeline(blueprint, {}, None, metrics=True)
+    pipeline.run()
+
+    steps = pipeline.metrics.summary()["steps"]
+    calls = sum(s["calls"] for s in steps.values())
+    # only the phases cases count the fan_out call of every phase
+    if name != "phases":
+        calls -= len(blueprint["phases"])
+    assert calls == task_units
+
+
+def test_runs_are_compared_by_name_and_params(tmp_path, capsys):
+    result = {"name": "chain", "params": {"fuse": True}, "seconds": 1.5}
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"results": [{**result, "seconds": 1.0}]}))
+
+    runner.compare([result], str(baseline))
+
+    out = capsys.readouterr().out
+    assert "chain[fuse=True]" in out
+    assert "+50.0%" in out
@@ -0,0 +1,108 @@
+from tests.tasks import counted
+from worker.nw.cache import ResultCache
+from worker.nw.pipeline_runner import Pipeline
+from worker.nw.utils import Many, Result
+
+EMIT = "tests.tasks.emit"
+COUNTED = "tests.tasks.counted"
+IMPORTER = "worker.tasks.importers.json"
+
+
+def run(tmp_path, step, items=("a", "b")):
+    pipeline = Pipeline(
+        {"phases": [[{"id": EMIT, "params": {"items": list(items)}}, step]]},
+        {}, None, cache=True, cache_dir=str(tmp_path), metrics=True,
+    )
+    pipeline.run()
+    return pipeline.metrics.summary()["steps"][step["id"]]
+
+
+def test_results_are_taken_from_the_cache(tmp_path):
+    first = run(tmp_path, {"id": COUNTED})
+    second = run(tmp_path, {"id": COUNTED})
+
+    assert counted.calls == ["a", "b"]
+    assert (first["cache_misses"], first["cache_hits"]) == (2, 0)
+    assert (second["cache_misses"], second["cache_hits"]) == (0, 2)
+
+
+def test_step_can_turn_the_cache_off(tmp_path):
+    run(tmp_path, {"id": COUNTED, "cache": False})
+    run(tmp_path, {"id": COUNTED, "cache": False})
+
+    assert counted.calls == ["a", "b", "a", "b"]
+
+
+def test_importer_is_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+    (tmp_path / "a").write_text('{"a": 1}')
+    (tmp_path / "b").write_text('{"b": 2}')
+    steps = run(tmp_path / "cache", {"id": IMPORTER})
+
+    assert (steps["cache_misses"], steps["cache_hits"]) == (0, 0)
+    assert not list((tmp_path / "cache").glob("*.pkl"))
+
+
+def test_failing_cache_key_follows_the_failure_policy(tmp_path):
+    step = run(tmp_path, {
+        "id": COUNTED,
+        "params": {"path": str(tmp_path / "missing")},
+        "retry": {"max_attempts": 2, "backoff": 0, "on_failure": "skip"},
+    })
+
+    # the task was called and failed, the task units were retried and
+    # skipped instead of stopping the pipeline
+    assert counted.calls == ["a", "b", "a", "b"]
+    assert step["retries"] == 2
+    assert step["failures"] == 2
+
+
+def test_key_depends_on_step_params_version_and_data(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    opts = {"params": {"rows": 1}, "data": {"b": 1, "a": 2}}
+    key = cache.key(COUNTED, opts, version="1")
+
+    assert key == cache.key(
+        COUNTED, {"params": {"rows": 1}, "data": {"a": 2, "b": 1}},
+        version="1",
+    )
+    assert key != cache.key(EMIT, opts, version="1")
+    assert key != cache.key(COUNTED, opts, version="2")
+    assert key != cache.key(
+        COUNTED, {**opts, "params": {"rows": 2}}, version="1"
+    )
+    assert key != cache.key(COUNTED, {**opts, "data": "x"}, version="1")
+
+
+def test_results_are_kept_across_instances(tmp_path):
+    ResultCache(str(tmp_path)).put("k", Result(data=Many(["a", "b"])))
+
+    assert ResultCache(str(tmp_path)).get("k").data.items == ["a", "b"]
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("a", Result(data="x" * 100))
+    cache.put("b", Result(data="x" * 100))
+    cache.max_bytes = cache.size
+    cache.get("a")
+    cache.put("c", Result(data="x" * 100))
+
+    assert list(cache.entries) == ["a", "c"]
+    assert sorted(p.stem for p in tmp_path.glob("*.pkl")) == ["a", "c"]
+
+
+def test_generators_are_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path))
+
+    assert not cache.put("k", Result(data=Many(i for i in range(3))))
+    assert cache.get("k") is None
+
+
+def test_unreadable_entry_is_dropped(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("k", Result(data="a"))
+    cache.path("k").write_bytes(b"not a pickle")
+
+    assert cache.get("k") is None
+    assert not cache.path("k").exists()
@@ -0,0 +1,74 @@
+import json
+import pytest
+from tests.tasks import collect
+from worker.nw.pipeline_runner import Pipeline
+from worker.tasks.fs import get_file_list
+from worker.tasks.importers import json as json_importer
+from worker.tasks.utils.compression import open_file, strip_suffix, suffix
+
+PAGES = [{"page": i, "items": [f"10.5555/{i}"]} for i in range(3)]
+
+
+@pytest.fixture(autouse=True)
+def metadata(tmp_path, monkeypatch):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+
+
+def write_lines(path, pages):
+    # one append per page, like the crossref downloader
+    for page in pages:
+        with open_file(path, "a") as f:
+            f.write(json.dumps(page) + "\n")
+
+
+def test_suffixes():
+    assert suffix(None) == ""
+    assert suffix("gzip") == ".gz"
+    assert strip_suffix("pages.jsonl.zst") == "pages.jsonl"
+    assert strip_suffix("00000001.json") == "00000001.json"
+    with pytest.raises(ValueError, match="unknown compression"):
+        suffix("brotli")
+
+
+@pytest.mark.parametrize("ext", [".jsonl", ".jsonl.gz", ".jsonl.zst"])
+def test_appended_pages_are_read_back(tmp_path, ext):
+    if ext.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    path = tmp_path / f"pages{ext}"
+    write_lines(path, PAGES)
+
+    assert list(json_importer.read_lines(path, convert=True)) == PAGES
+
+
+def test_compressed_files_are_found_by_their_extension(tmp_path):
+    for name in (
+        "a/00000000.json.gz", "a/pages.jsonl.zst", "b/00000001.json",
+        "b/.page.tmp", "b/records.xml.gz",
+    ):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+
+    result = get_file_list.run({"data": "", "params": {"ext": ".json"}})
+
+    assert sorted(result.data.items) == [
+        "a/00000000.json.gz", "a/pages.jsonl.zst", "b/00000001.json"
+    ]
+
+
+@pytest.mark.parametrize("name", ["page.json.gz", "pages.jsonl.gz"])
+def test_compressed_files_are_imported(tmp_path, name):
+    if "jsonl" in name:
+        write_lines(tmp_path / name, PAGES)
+    else:
+        with open_file(tmp_path / name, "w") as f:
+            json.dump(PAGES[0], f)
+
+    Pipeline({"phases": [[
+        {"id": "worker.tasks.importers.json", "params": {
+            "path": name, "convert": True
+        }},
+        {"id": "tests.tasks.collect"},
+    ]]}, {}, None).run()
+
+    expected = PAGES if "jsonl" in name else PAGES[:1]
+    assert sorted(collect.received, key=lambda p: p["page"]) == expected
@@ -0,0 +1,470 @@
+import json
+import os
+import time
+from datetime import date, timedelta
+import pytest
+from benchmarks.crossref_mock import CrossrefMock
+from worker.tasks.download import crossref_downloader, move_complete
+from worker.tasks.download import crossref_downloader_util as util
+from worker.tasks.importers.json import read_lines
+from worker.tasks.utils.compression import open_file
+
+FILTER = {"issn": "0000-0000", "from-update-date": "2020-01-01"}
+RECORDS = 200
+
+
+@pytest.fixture
+def mock():
+    mock = CrossrefMock(records=RECORDS, latency=0)
+    mock.start()
+    yield mock
+    mock.stop()
+
+
+def download(mock, download_dir, **options):
+    return util.run({
+        "filter": FILTER,
+        "download_dir": str(download_dir),
+        "base_url": mock.base_url,
+        "rows": 20,
+        **options,
+    })
+
+
+def page_files(download_dir):
+    return sorted(
+        name for name in os.listdir(download_dir)
+        if not name.startswith(".")
+    )
+
+
+def dois(download_dir):
+    found = []
+    for name in page_files(download_dir):
+        path = os.path.join(download_dir, name)
+        if ".jsonl" in name:
+            pages = read_lines(path, convert=True)
+        else:
+            with open_file(path, "r") as f:
+                pages = [json.load(f)]
+        for page in pages:
+            found += [item["DOI"] for item in page["message"]["items"]]
+    return found
+
+
+def test_download_writes_every_record_once(mock, tmp_path):
+    result = download(mock, tmp_path)
+
+    assert result["downloaded_records"] == RECORDS
+    assert result["pages"] == 10
+    assert len(set(dois(tmp_path))) == RECORDS
+    assert len(dois(tmp_path)) == RECORDS
+
+
+def test_finished_download_is_not_repeated(mock, tmp_path):
+    download(mock, tmp_path)
+    requests = mock.stats()["requests"]
+    result = download(mock, tmp_path)
+
+    assert result["downloaded_records"] == 0
+    assert result["resumed_pages"] == 10
+    assert mock.stats()["requests"] == requests
+
+
+@pytest.mark.parametrize("options", [
+    {"compression": "gzip"},
+    {"jsonl": True},
+    {"jsonl": True, "compression": "gzip"},
+])
+def test_changed_file_format_removes_old_pages(mock, tmp_path, options):
+    download(mock, tmp_path)
+    result = download(mock, tmp_path, **options)
+
+    assert result["downloaded_records"] == RECORDS
+    assert all(
+        name.endswith(util.file_format(options))
+        for name in page_files(tmp_path)
+    )
+    assert sorted(dois(tmp_path)) == sorted(set(dois(tmp_path)))
+    assert len(dois(tmp_path)) == RECORDS
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"jsonl": True},
+    {"jsonl": True, "compression": "gzip"},
+])
+def test_interrupted_download_is_resumed(
+    mock, tmp_path, monkeypatch, options
+):
+    write_page = util.write_page
+    written = []
+
+    def failing_write_page(page, path, append=False):
+        if len(written) == 3:
+            raise ValueError("disk full")
+        written.append(path)
+        write_page(page, path, append)
+
+    monkeypatch.setattr(util, "write_page", failing_write_page)
+    with pytest.raises(ValueError):
+        download(mock, tmp_path, **options)
+    monkeypatch.setattr(util, "write_page", write_page)
+    result = download(mock, tmp_path, **options)
+
+    assert result["resumed_pages"] == 3
+    assert result["pages"] == 7
+    assert len(dois(tmp_path)) == len(set(dois(tmp_path))) == RECORDS
+
+
+def test_expired_cursor_restart_removes_old_pages(mock, tmp_path):
+    download(mock, tmp_path, rows=10)
+    assert len(page_files(tmp_path)) == 20
+    # interrupted after 5 pages, the cursor is not known anymore
+    state = util.load_state(tmp_path, util.filter_fingerprint(FILTER))
+    state.update(
+        complete=False, pages=5, records=50, cursor="DXF1ZXF1expired/50"
+    )
+    util.save_state(tmp_path, state)
+
+    # pages of another size than before
+    result = download(mock, tmp_path, rows=50)
+
+    assert result["resumed_pages"] == 0
+    assert result["pages"] == 4
+    assert page_files(tmp_path) == [f"{i:08d}.json" for i in range(4)]
+    assert len(dois(tmp_path)) == len(set(dois(tmp_path))) == RECORDS
+
+
+def test_download_of_another_filter_starts_again(mock, tmp_path):
+    download(mock, tmp_path)
+    first = set(dois(tmp_path))
+    result = download(mock, tmp_path, filter={**FILTER, "issn": "1111-1111"})
+
+    assert result["resumed_pages"] == 0
+    assert result["downloaded_records"] == RECORDS
+    assert len(dois(tmp_path)) == RECORDS
+    assert not set(dois(tmp_path)) & first
+
+
+def run_downloader(mock, directory, **params):
+    return crossref_downloader.run({"params": {
+        "filter_list": [FILTER],
+        "directory": directory,
+        "user_agent": "tests",
+        "base_url": mock.base_url,
+        "rate_limit": 1000,
+        "rows": 20,
+        **params,
+    }})
+
+
+@pytest.mark.parametrize("shards", [1, 2])
+def test_only_complete_downloads_are_moved(
+    mock, tmp_path, monkeypatch, shards
+):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+    write_page = util.write_page
+    written = []
+
+    def failing_write_page(page, path, append=False):
+        if len(written) == 3:
+            raise ValueError("disk full")
+        written.append(path)
+        write_page(page, path, append)
+
+    monkeypatch.setattr(util, "write_page", failing_write_page)
+    result = run_downloader(mock, "download", shards=shards)
+    assert result.metrics["failed_downloads"] == 1
+
+    moved = move_complete.run(
+        {"params": {"src": "download", "dst": "import/1"}}
+    )
+    assert moved.metrics == {"moved": 0, "incomplete": 1}
+    assert not (tmp_path / "import" / "1").exists()
+
+    # the next run continues the download in the same directory
+    monkeypatch.setattr(util, "write_page", write_page)
+    result = run_downloader(mock, "download", shards=shards)
+    assert result.metrics["failed_downloads"] == 0
+    assert result.metrics["filters"][
+        util.create_filter_param(FILTER)
+    ]["resumed_pages"] == 3
+
+    moved = move_complete.run(
+        {"params": {"src": "download", "dst": "import/2"}}
+    )
+    assert moved.metrics == {"moved": 1, "incomplete": 0}
+    assert list((tmp_path / "download").iterdir()) == []
+    (filter_dir,) = (tmp_path / "import" / "2").iterdir()
+    assert crossref_downloader.is_complete(filter_dir)
+    found = []
+    for directory, _, files in os.walk(filter_dir):
+        found += dois(directory) if any(
+            f.endswith(".json") for f in files
+        ) else []
+    assert len(found) == len(set(found)) == RECORDS
+
+
+def test_filters_are_downloaded_in_parallel(tmp_path, monkeypatch):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+    filters = [{**FILTER, "issn": f"0000-000{i}"} for i in range(3)]
+    slow = CrossrefMock(records=RECORDS, latency=0.05)
+    slow.start()
+    try:
+        start = time.perf_counter()
+        result = run_downloader(
+            slow, "download", filter_list=filters, concurrency=3, rows=50
+        )
+        seconds = time.perf_counter() - start
+    finally:
+        slow.stop()
+
+    assert result.metrics["failed_downloads"] == 0
+    assert result.metrics["downloaded_records"] == 3 * RECORDS
+    assert len(result.metrics["filters"]) == 3
+    found = [
+        doi for filter_dir in (tmp_path / "download").iterdir()
+        for doi in dois(filter_dir)
+    ]
+    assert len(found) == len(set(found)) == 3 * RECORDS
+    # 12 pages of 0.05 s one after the other
+    assert seconds < 0.5
+
+
+def test_failed_filter_does_not_stop_the_others(
+    mock, tmp_path, monkeypatch
+):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+    filters = [{**FILTER, "issn": f"0000-000{i}"} for i in range(3)]
+    download_filter = util.run
+
+    def failing_run(options):
+        if options["filter"]["issn"] == "0000-0001":
+            raise ValueError("status 400")
+        return download_filter(options)
+
+    monkeypatch.setattr(util, "run", failing_run)
+    result = run_downloader(
+        mock, "download", filter_list=filters, concurrency=3
+    )
+
+    assert result.metrics["failed_downloads"] == 1
+    assert result.metrics["downloaded_records"] == 2 * RECORDS
+    assert "status 400" in result.logs[0]
+
+
+def test_token_bucket_limits_the_rate():
+    limiter = util.TokenBucket(rate=50, burst=1)
+    start = time.perf_counter()
+    for _ in range(6):
+        limiter.acquire()
+
+    assert time.perf_counter() - start >= 0.1
+
+
+def test_token_bucket_follows_the_announced_limit():
+    limiter = util.TokenBucket(rate=50)
+    limiter.update({"x-rate-limit-limit": "100"})
+    assert limiter.rate == 50
+
+    limiter.update(
+        {"x-rate-limit-limit": "20", "x-rate-limit-interval": "2s"}
+    )
+    assert limiter.rate == 10
+    assert limiter.burst == 20
+
+    limiter.update({"x-rate-limit-limit": "many"})
+    limiter.update({})
+    assert limiter.rate == 10
+
+
+def test_next_download_starts_at_the_watermark(mock, tmp_path, monkeypatch):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+    run_downloader(mock, "download", watermark_dir="watermarks")
+    (watermark_file,) = (tmp_path / "watermarks").iterdir()
+    watermark = json.loads(watermark_file.read_text())["indexed"]
+    last_day = mock.day(RECORDS - 1)
+    assert watermark.startswith(last_day.isoformat())
+
+    result = run_downloader(mock, "download", watermark_dir="watermarks")
+
+    # only the records of the last day are downloaded again
+    last_day_records = sum(
+        1 for i in range(RECORDS) if mock.day(i) == last_day
+    )
+    assert result.metrics["downloaded_records"] == last_day_records
+    assert len(list((tmp_path / "download").iterdir())) == 2
+
+
+@pytest.mark.parametrize("options", [
+    {}, {"compression": "gzip"}, {"jsonl": True, "compression": "gzip"},
+])
+def test_raw_responses_are_written_as_received(tmp_path, options):
+    # pages of about 300 KB, larger than the chunks they are read in
+    large = CrossrefMock(records=RECORDS, latency=0, padding=3000)
+    large.start()
+    try:
+        parsed = download(large, tmp_path / "parsed", rows=100, **options)
+        raw = download(
+            large, tmp_path / "raw", rows=100, raw=True, **options
+        )
+    finally:
+        large.stop()
+
+    assert raw["downloaded_records"] == parsed["downloaded_records"]
+    assert raw["pages"] == parsed["pages"] == 2
+    assert raw["watermark"] == parsed["watermark"]
+    assert page_files(tmp_path / "raw") == page_files(tmp_path / "parsed")
+    assert sorted(dois(tmp_path / "raw")) == sorted(
+        dois(tmp_path / "parsed")
+    )
+
+
+def test_page_size_follows_the_response_times():
+    rows = util.AdaptiveRows(rows=100, max_rows=800, target_seconds=1)
+    rows.succeeded(0.1)
+    rows.succeeded(0.1)
+    assert rows.rows == 400
+    rows.succeeded(2)
+    assert rows.rows == 200
+    rows.succeeded(0.7)
+    assert rows.rows == 200
+
+    rows.failed()
+    assert rows.rows == 100
+    # not larger again until PROBE_AFTER calls succeeded
+    for _ in range(util.PROBE_AFTER - 1):
+        rows.succeeded(0.1)
+    assert rows.rows == 100
+    rows.succeeded(0.1)
+    assert rows.rows == 200
+
+    with pytest.raises(ValueError):
+        util.AdaptiveRows(min_rows=500, max_rows=100)
+
+
+@pytest.fixture
+def overloaded(monkeypatch):
+    # pages of more than 300 rows fail with status 503
+    monkeypatch.setattr(util, "MAX_BACKOFF", 0)
+    mock = CrossrefMock(records=2_000, latency=0, overload_rows=300)
+    mock.start()
+    yield mock
+    mock.stop()
+
+
+def test_adaptive_rows_avoid_pages_that_fail(overloaded, tmp_path):
+    result = download(
+        overloaded, tmp_path, rows=400, adaptive_rows=True,
+        target_seconds=10,
+    )
+
+    assert result["downloaded_records"] == 2_000
+    assert result["retries"] == 1
+    assert result["rows"] <= 300
+    assert overloaded.stats()["statuses"] == {503: 1, 200: result["pages"]}
+    assert len(dois(tmp_path)) == len(set(dois(tmp_path))) == 2_000
+
+
+def test_fixed_rows_fail_without_retries(overloaded, tmp_path):
+    with pytest.raises(util.RetryableError):
+        download(overloaded, tmp_path, rows=400)
+
+
+def test_filter_dates():
+    assert util.parse_date("2023") == date(2023, 1, 1)
+    assert util.parse_date(2023, last=True) == date(2023, 12, 31)
+    assert util.parse_date("2024-02", last=True) == date(2024, 2, 29)
+    assert util.parse_date("2023-12", last=True) == date(2023, 12, 31)
+    assert util.parse_date("2023-05-17") == date(2023, 5, 17)
+    with pytest.raises(ValueError):
+        util.parse_date("2023-05-17-01")
+
+
+def test_shards_are_disjoint_windows_of_similar_size(mock):
+    windows = util.shard_filter(
+        FILTER, 4, "update", {"base_url": mock.base_url}
+    )
+
+    assert len(windows) == 4
+    assert windows[0]["from-update-date"] == "2020-01-01"
+    assert "until-update-date" not in windows[-1]
+    for window, following in zip(windows, windows[1:]):
+        until = util.parse_date(window["until-update-date"])
+        assert util.parse_date(
+            following["from-update-date"]
+        ) == until + timedelta(days=1)
+    counts = [
+        util.count_results(window, base_url=mock.base_url)
+        for window in windows
+    ]
+    assert sum(counts) == RECORDS
+    assert max(counts) <= 2 * RECORDS / 4
+
+
+@pytest.mark.parametrize("counts", [
+    [5] + [0] * 39,
+    [0] * 39 + [5],
+    [0] * 10 + [3, 0, 0, 4] + [0] * 26,
+    [0] * 40,
+])
+def test_shards_are_never_empty(counts, monkeypatch):
+    slices = iter(counts)
+    monkeypatch.setattr(
+        util, "count_results", lambda filter, **options: next(slices)
+    )
+    windows = util.shard_filter(
+        {**FILTER, "until-update-date": "2020-12-31"}, 4, "update"
+    )
+
+    assert len(windows) == max(1, sum(c > 0 for c in counts))
+    assert windows[0]["from-update-date"] == "2020-01-01"
+    assert windows[-1]["until-update-date"] == "2020-12-31"
+
+
+def test_filter_without_records_is_complete(tmp_path, monkeypatch):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+    empty = CrossrefMock(records=0, latency=0)
+    empty.start()
+    try:
+        result = run_downloader(empty, "download", shards=4)
+    finally:
+        empty.stop()
+    assert result.metrics["failed_downloads"] == 0
+
+    moved = move_complete.run(
+        {"params": {"src": "download", "dst": "import/1"}}
+    )
+    assert moved.metrics == {"moved": 1, "incomplete": 0}
+    (filter_dir,) = (tmp_path / "import" / "1").iterdir()
+    assert crossref_downloader.is_complete(filter_dir)
+
+
+@pytest.mark.parametrize("filter", [
+    {"issn": "0000-0000"},
+    {"from-update-date": "2021", "until-update-date": "2020"},
+])
+def test_filter_without_date_window_can_not_be_sharded(filter):
+    with pytest.raises(ValueError):
+        util.shard_filter(filter, 4, "update")
+
+
+def test_sharded_filter_is_downloaded_once(mock, tmp_path, monkeypatch):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+    result = run_downloader(mock, "download", shards=4, concurrency=4)
+
+    metrics = result.metrics["filters"][util.create_filter_param(FILTER)]
+    assert metrics["shards"] == 4
+    assert result.metrics["downloaded_records"] == RECORDS
+    (filter_dir,) = (tmp_path / "download").iterdir()
+    found = [
+        doi for i in range(4)
+        for doi in dois(crossref_downloader.shard_dir(filter_dir, i))
+    ]
+    assert len(found) == len(set(found)) == RECORDS
+
+    # the windows are not counted again
+    requests = mock.stats()["requests"]
+    run_downloader(mock, "download", shards=4, concurrency=4)
+    assert mock.stats()["requests"] == requests
@@ -0,0 +1,123 @@
+import json
+import time
+import urllib.error
+import urllib.request
+import pytest
+from benchmarks.crossref_mock import CrossrefMock
+
+FILTER = "issn:0000-0000,from-update-date:2020-01-01"
+
+
+def works(mock, **params):
+    status, headers, body, records = mock.works(params)
+    message = json.loads(body)["message"] if status == 200 else None
+    return status, headers, message
+
+
+def test_cursor_pages_return_every_record_once():
+    mock = CrossrefMock(records=95, latency=0)
+    cursor = "*"
+    found = []
+    while True:
+        status, _, message = works(
+            mock, filter=FILTER, cursor=cursor, rows="20"
+        )
+        assert status == 200
+        assert message["total-results"] == 95
+        if not message["items"]:
+            break
+        found += [item["DOI"] for item in message["items"]]
+        cursor = message["next-cursor"]
+
+    assert len(found) == len(set(found)) == 95
+
+
+def test_date_filters_select_a_window():
+    mock = CrossrefMock(records=1000, latency=0)
+    _, _, everything = works(mock, filter=FILTER, rows="0")
+    _, _, first = works(
+        mock, filter=FILTER + ",until-update-date:2020-12-31", rows="0"
+    )
+    _, _, rest = works(mock, filter="from-update-date:2021-01-01", rows="0")
+
+    assert everything["total-results"] == 1000
+    assert first["total-results"] + rest["total-results"] == 1000
+    # most records are updated late
+    assert first["total-results"] < rest["total-results"]
+
+
+def test_other_filters_get_other_records():
+    mock = CrossrefMock(records=10, latency=0)
+    _, _, a = works(mock, filter="issn:0000-0000", rows="10")
+    _, _, b = works(mock, filter="issn:1111-1111", rows="10")
+
+    assert not {i["DOI"] for i in a["items"]} & {i["DOI"] for i in b["items"]}
+
+
+def test_large_pages_are_rejected():
+    mock = CrossrefMock(latency=0, overload_rows=300)
+
+    assert works(mock, rows="1001")[0] == 400
+    assert works(mock, rows="301")[0] == 503
+    assert works(mock, rows="300")[0] == 200
+
+
+def test_errors_are_injected():
+    assert works(CrossrefMock(latency=0, error_rate=1))[0] == 500
+    status, headers, _ = works(
+        CrossrefMock(latency=0, throttle_rate=1, retry_after=3)
+    )
+    assert status == 429
+    assert headers == {"Retry-After": "3"}
+
+
+def test_expired_cursor_returns_no_items():
+    mock = CrossrefMock(records=50, latency=0, cursor_ttl=0.01)
+    _, _, first = works(mock, filter=FILTER, cursor="*", rows="10")
+    mock.cursors[first["next-cursor"]] -= 1
+
+    _, _, expired = works(
+        mock, filter=FILTER, cursor=first["next-cursor"], rows="10"
+    )
+    assert expired["items"] == []
+    assert expired["total-results"] == 50
+
+
+def test_enforced_rate_limit():
+    mock = CrossrefMock(latency=0, rate_limit=2, enforce_rate_limit=True)
+    statuses = [works(mock, rows="1")[0] for _ in range(3)]
+
+    assert statuses == [200, 200, 429]
+
+
+def test_unknown_settings_are_rejected():
+    with pytest.raises(ValueError, match="unknown settings"):
+        CrossrefMock(records=10, row=5)
+
+
+def test_works_endpoint_is_served_over_http():
+    mock = CrossrefMock(records=5, latency=0)
+    base_url = mock.start()
+    try:
+        with urllib.request.urlopen(
+            f"{base_url}works?rows=5&filter={FILTER}"
+        ) as r:
+            assert r.headers["X-Rate-Limit-Limit"] == "50"
+            message = json.load(r)["message"]
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(f"{base_url}members")
+        # responses are counted after they were sent
+        deadline = time.monotonic() + 5
+        while sum(mock.stats()["statuses"].values()) < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        mock.stop()
+
+    assert len(message["items"]) == 5
+    assert e.value.code == 404
+    assert mock.stats() == {
+        "requests": 1,
+        "records_served": 5,
+        "statuses": {200: 1, 404: 1},
+    }
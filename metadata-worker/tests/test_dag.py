@@ -0,0 +1,70 @@
+import time
+import pytest
+from tests.tasks import collect
+from worker.nw.dag import load_nodes
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+COLLECT = "tests.tasks.collect"
+SLEEP = "worker.tasks.examples.sleep"
+SET_SENTINEL = "worker.tasks.examples.set_sentinel"
+STEP = [{"id": COLLECT}]
+
+
+def branch(name, seconds):
+    return {"steps": [
+        {"id": EMIT, "params": {"items": [name]}},
+        {"id": SLEEP, "params": {"duration": seconds}, "executor": "thread"},
+    ]}
+
+
+def test_phases_become_a_chain_of_nodes():
+    nodes = load_nodes({"phases": [STEP, STEP, STEP]})
+
+    assert [nodes[i]["needs"] for i in range(3)] == [[], [0], [1]]
+
+
+@pytest.mark.parametrize("blueprint, message", [
+    ({}, "either"),
+    ({"phases": [STEP], "nodes": {}}, "either"),
+    ({"nodes": {"a": {"steps": []}}}, "has no steps"),
+    ({"nodes": {"a": {"steps": STEP, "needs": ["b"]}}}, "unknown node b"),
+    ({"nodes": {
+        "a": {"steps": STEP, "needs": ["c"]},
+        "b": {"steps": STEP, "needs": ["a"]},
+        "c": {"steps": STEP, "needs": ["b"]},
+        "d": {"steps": STEP},
+    }}, r"cycle .*\['a', 'b', 'c'\]"),
+])
+def test_invalid_blueprint_is_rejected(blueprint, message):
+    with pytest.raises(ValueError, match=message):
+        load_nodes(blueprint)
+
+
+def test_branches_run_in_parallel_and_the_join_waits_for_both():
+    start = time.perf_counter()
+    Pipeline({"nodes": {
+        "slow": branch("slow", 0.3),
+        "fast": branch("fast", 0.25),
+        "join": {
+            "needs": ["slow", "fast"],
+            "steps": [{"id": EMIT, "params": {"items": ["join"]}}, *STEP],
+        },
+    }}, {}, None, max_workers=2).run()
+    seconds = time.perf_counter() - start
+
+    assert collect.received == ["join"]
+    # one after the other would take 0.55 s
+    assert 0.3 <= seconds < 0.5
+
+
+def test_node_gets_the_sentinel_of_its_first_need():
+    Pipeline({"nodes": {
+        "a": {"steps": [{"id": SET_SENTINEL, "params": {"sentinel": "a"}}]},
+        "b": {"steps": [{"id": SET_SENTINEL, "params": {"sentinel": "b"}}]},
+        "c": {"needs": ["b", "a"], "steps": [
+            {"id": COLLECT, "passSentinel": True}
+        ]},
+    }}, {}, None).run()
+
+    assert collect.received == ["b"]
@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+import pytest
+from tests.tasks import collect
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+WHERE = "tests.tasks.where"
+COLLECT = "tests.tasks.collect"
+SLEEP = "worker.tasks.examples.sleep"
+ITEMS = [f"item {i}" for i in range(8)]
+
+
+def run_where(executor, **options):
+    Pipeline({"phases": [[
+        {"id": EMIT, "params": {"items": ITEMS}},
+        {"id": WHERE, "executor": executor},
+        {"id": COLLECT},
+    ]]}, {}, None, max_workers=2, **options).run()
+    return collect.received
+
+
+@pytest.mark.parametrize("transport", ["json", "local"])
+def test_inline_steps_run_in_the_main_thread(transport):
+    received = run_where("inline", transport=transport)
+
+    assert sorted(r["item"] for r in received) == ITEMS
+    assert {r["thread"] for r in received} == {
+        threading.main_thread().name
+    }
+
+
+def test_thread_steps_run_in_the_thread_pool():
+    received = run_where("thread")
+
+    assert sorted(r["item"] for r in received) == ITEMS
+    assert all(r["thread"].startswith("nw-task") for r in received)
+    assert {r["pid"] for r in received} == {os.getpid()}
+
+
+@pytest.mark.parametrize("transport", ["json", "local"])
+def test_process_steps_run_in_the_process_pool(transport):
+    received = run_where("process", transport=transport)
+
+    assert sorted(r["item"] for r in received) == ITEMS
+    assert os.getpid() not in {r["pid"] for r in received}
+
+
+def test_thread_steps_run_concurrently():
+    start = time.perf_counter()
+    Pipeline({"phases": [[
+        {"id": EMIT, "params": {"items": ITEMS}},
+        {"id": SLEEP, "params": {"duration": 0.2}, "executor": "thread"},
+    ]]}, {}, None, max_workers=len(ITEMS)).run()
+
+    # one after the other would take 1.6 s
+    assert time.perf_counter() - start < 1.0
+
+
+def test_unknown_executor_is_rejected():
+    with pytest.raises(ValueError, match="unknown executor"):
+        Pipeline(
+            {"phases": [[{"id": COLLECT, "executor": "gpu"}]]}, {}, None
+        )
@@ -0,0 +1,68 @@
+import pytest
+from tests.tasks import collect, objects
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+OBJECTS = "tests.tasks.objects"
+COLLECT = "tests.tasks.collect"
+NOOP = "worker.tasks.examples.noop"
+ITEMS = [f"item {i}" for i in range(5)]
+
+
+class RecordingPipeline(Pipeline):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queued_steps = []
+
+    def encode_msg(self, msg):
+        self.queued_steps.append(msg["task"]["id"])
+        return super().encode_msg(msg)
+
+
+def run(noop, **options):
+    pipeline = RecordingPipeline({"phases": [[
+        {"id": EMIT, "params": {"items": ITEMS}},
+        {"id": NOOP, **noop},
+        {"id": COLLECT},
+    ]]}, {}, None, **options)
+    pipeline.run()
+    return pipeline.queued_steps
+
+
+def test_fused_steps_are_not_queued():
+    queued = run({}, fuse=True)
+
+    assert sorted(collect.received) == ITEMS
+    assert queued == [EMIT]
+
+
+@pytest.mark.parametrize("noop", [
+    {"fuse": False},
+    {"executor": "thread"},
+    {"retry": {"max_attempts": 2}},
+])
+def test_steps_that_are_not_fused_are_queued(noop):
+    queued = run(noop, fuse=True)
+
+    assert sorted(collect.received) == ITEMS
+    assert queued.count(NOOP) == len(ITEMS)
+    # the step after it is fused again
+    assert COLLECT not in queued
+
+
+def test_without_fuse_every_step_is_queued():
+    queued = run({})
+
+    assert sorted(collect.received) == ITEMS
+    assert queued.count(NOOP) == queued.count(COLLECT) == len(ITEMS)
+
+
+def test_fused_steps_get_the_data_as_it_is():
+    Pipeline(
+        {"phases": [[{"id": OBJECTS}, {"id": NOOP}, {"id": COLLECT}]]},
+        {}, None, fuse=True,
+    ).run()
+
+    assert len(collect.received) == 3
+    for sent, got in zip(objects.returned, collect.received):
+        assert got is sent
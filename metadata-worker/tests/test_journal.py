@@ -0,0 +1,104 @@
+import pytest
+from tests.tasks import counted, flaky
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+COUNTED = "tests.tasks.counted"
+FLAKY = "tests.tasks.flaky"
+NOOP = "worker.tasks.examples.noop"
+# about 1 KB per task unit
+ITEMS = [f"{i:04d}" + "x" * 1000 for i in range(200)]
+
+
+def blueprint(fail_on):
+    return {"phases": [[
+        {"id": EMIT, "params": {"items": ITEMS}},
+        {"id": NOOP},
+        {"id": FLAKY, "params": {"only": fail_on}},
+    ]]}
+
+
+def run_until_done(journal, fail_on, **options):
+    """
+    Runs the pipeline, which stops at the first failure, and resumes it
+    until it completes. Returns the number of runs.
+    """
+    runs = 0
+    while True:
+        runs += 1
+        pipeline = Pipeline(
+            blueprint(fail_on), {}, None, journal=str(journal), **options
+        )
+        try:
+            pipeline.run()
+            return runs
+        except ConnectionError:
+            assert journal.exists()
+
+
+def received():
+    return sorted(r.decode("utf-8") for r in flaky.received)
+
+
+def test_stopped_pipeline_is_resumed(tmp_path):
+    journal = tmp_path / "journal"
+    runs = run_until_done(journal, [ITEMS[50], ITEMS[120]])
+
+    assert runs == 3
+    assert received() == ITEMS
+    assert not journal.exists()
+
+
+def stop_at_last_item(journal, **options):
+    pipeline = Pipeline(
+        blueprint([ITEMS[-1]]), {}, None, journal=str(journal), **options
+    )
+    with pytest.raises(ConnectionError):
+        pipeline.run()
+    return journal.stat().st_size
+
+
+def test_journal_is_compacted(tmp_path):
+    full = stop_at_last_item(
+        tmp_path / "full", journal_compact_bytes=10**12
+    )
+    flaky.reset()
+    journal = tmp_path / "journal"
+    options = {"journal_compact_bytes": 20_000, "max_queue_items": 10}
+    compacted = stop_at_last_item(journal, **options)
+
+    # the started event of the emit step holds all items and stays, the
+    # queued units of finished steps are dropped
+    assert compacted < full / 2
+    runs = run_until_done(journal, [ITEMS[-1]], **options)
+    assert runs == 1
+    assert received() == ITEMS
+
+
+def test_incomplete_last_line_is_dropped_on_resume(tmp_path):
+    journal = tmp_path / "journal"
+    with pytest.raises(ConnectionError):
+        Pipeline(blueprint([ITEMS[10]]), {}, None, journal=str(journal)).run()
+    with open(journal, "a", encoding="utf8") as f:
+        f.write('{"queued": {"task_tok')
+
+    runs = run_until_done(journal, [ITEMS[10]])
+
+    assert runs == 1
+    assert received() == ITEMS
+
+
+def test_finished_phases_are_not_run_again(tmp_path):
+    journal = tmp_path / "journal"
+    phases = {"phases": [
+        [{"id": EMIT, "params": {"items": ["a", "b"]}}, {"id": COUNTED}],
+        [{"id": EMIT, "params": {"items": ITEMS[:3]}},
+         {"id": FLAKY, "params": {"only": [ITEMS[1]]}}],
+    ]}
+    with pytest.raises(ConnectionError):
+        Pipeline(phases, {}, None, journal=str(journal)).run()
+    Pipeline(phases, {}, None, journal=str(journal)).run()
+
+    assert counted.calls == ["a", "b"]
+    assert received() == ITEMS[:3]
+    assert not journal.exists()
@@ -0,0 +1,68 @@
+import tracemalloc
+import pytest
+from tests.tasks import leaky
+from worker.nw import memory
+from worker.nw.memory import MB, MemoryTracker
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+LEAKY = "tests.tasks.leaky"
+NOOP = "worker.tasks.examples.noop"
+ITEMS = [f"item {i}" for i in range(20)]
+
+
+@pytest.fixture
+def kept_rss(monkeypatch):
+    # the RSS only grows if the allocator takes new pages, freed memory of
+    # earlier tests is used first
+    base = memory.current_rss()
+    monkeypatch.setattr(
+        memory, "current_rss",
+        lambda: base + sum(len(k) for k in leaky.kept),
+    )
+
+
+def run(mode, **options):
+    pipeline = Pipeline({"phases": [[
+        {"id": EMIT, "params": {"items": ITEMS}},
+        {"id": LEAKY, "params": {"bytes": 2 * MB}},
+        {"id": NOOP},
+    ]]}, {}, None, memory=mode, metrics=True, **options)
+    pipeline.run()
+    return pipeline.metrics.summary()["memory"]
+
+
+def test_retained_memory_is_recorded_per_step(kept_rss):
+    summary = run("rss")
+
+    leaky_step = summary["steps"][LEAKY]
+    assert leaky_step["calls"] == len(ITEMS)
+    assert leaky_step["retained_rss"] == 2 * len(ITEMS) * MB
+    assert leaky_step["max_rss_delta"] == 2 * MB
+    assert summary["steps"][NOOP]["retained_rss"] == 0
+    assert summary["growth"] == 2 * len(ITEMS) * MB
+
+
+def test_allocation_sites_are_found_with_tracemalloc():
+    summary = run("tracemalloc", memory_snapshot_every=5)
+
+    leaky_step = summary["steps"][LEAKY]
+    assert leaky_step["traced_peak"] >= 2 * MB
+    sites = [s["site"] for s in leaky_step["top_allocations"]]
+    assert sites[0].rpartition(":")[0].endswith("leaky.py")
+    assert not tracemalloc.is_tracing()
+
+
+def test_growing_step_is_reported_as_a_leak(kept_rss):
+    tracker = MemoryTracker("rss", warn_mb=10)
+    for _ in range(20):
+        tracker.call(LEAKY, leaky.run, {"params": {"bytes": MB}})
+        tracker.call(NOOP, lambda: None)
+
+    assert tracker.steps[LEAKY].warned
+    assert not tracker.steps[NOOP].warned
+
+
+def test_unknown_memory_mode_is_rejected():
+    with pytest.raises(ValueError, match="unknown memory mode"):
+        MemoryTracker("heap")
@@ -0,0 +1,64 @@
+import json
+from worker.nw.metrics import distribution, merge, percentile
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+SLEEP = "worker.tasks.examples.sleep"
+NOOP = "worker.tasks.examples.noop"
+ITEMS = ["a" * 100, "b" * 100, "c" * 100, "d" * 100]
+
+
+def test_percentiles_are_nearest_rank():
+    ordered = list(range(1, 101))
+
+    assert percentile(ordered, 50) == 50
+    assert percentile(ordered, 99) == 99
+    assert percentile([7], 90) == 7
+    assert distribution([]) == {
+        "total": 0, "mean": 0, "p50": 0, "p90": 0, "p99": 0, "max": 0
+    }
+    assert distribution([1.0, 3.0])["mean"] == 2.0
+
+
+def test_task_metrics_are_added_up():
+    total = {}
+    merge(total, {"records": 2, "errors": {"400": 1}, "state": "a"})
+    merge(total, {"records": 3, "errors": {"400": 1, "500": 1}})
+    merge(total, {"state": "b"})
+    merge(total, None)
+
+    assert total == {
+        "records": 5, "errors": {"400": 2, "500": 1}, "state": "b"
+    }
+
+
+def test_calls_sizes_and_fan_out_are_recorded(tmp_path):
+    metrics_file = tmp_path / "metrics.json"
+    Pipeline({"phases": [[
+        {"id": EMIT, "params": {"items": ITEMS}},
+        {"id": NOOP},
+        {"id": SLEEP, "params": {"duration": 0.01}},
+    ]]}, {}, None, metrics_file=str(metrics_file)).run()
+
+    summary = json.loads(metrics_file.read_text())
+    emit, noop, sleep = (summary["steps"][s] for s in (EMIT, NOOP, SLEEP))
+    assert emit["calls"] == 1
+    assert emit["task_units_out"] == 4
+    assert emit["fan_out"] == 4
+    assert emit["bytes_out"] == 400
+    assert noop["calls"] == 4
+    assert noop["bytes_in"] == noop["bytes_out"] == 400
+    assert sleep["calls"] == 4
+    assert sleep["wall"]["total"] >= 0.04
+    assert sleep["wall"]["p50"] >= 0.01
+    assert sleep["metrics"] == {"slept": 4}
+    assert sleep["log_count"] == 4
+    assert summary["metrics"] == {"slept": 4}
+    assert EMIT in summary["import_times"]
+
+
+def test_metrics_are_off_by_default():
+    pipeline = Pipeline({"phases": [[{"id": NOOP}]]}, {}, None)
+    pipeline.run()
+
+    assert pipeline.metrics is None
@@ -0,0 +1,92 @@
+import json
+import pytest
+from tests.tasks import collect, flaky
+from worker.nw.payloads import SpoolStore, discard, opened
+from worker.nw.pipeline_runner import Pipeline
+
+COLLECT = "tests.tasks.collect"
+EMIT = "tests.tasks.emit"
+FLAKY = "tests.tasks.flaky"
+ITEMS = ["a" * 10_000, "b" * 10_000, ""]
+
+
+class RecordingPipeline(Pipeline):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoded = []
+
+    def encode_msg(self, msg):
+        encoded = super().encode_msg(msg)
+        self.encoded.append(encoded)
+        return encoded
+
+
+def test_spool_file_is_mapped_and_removed(tmp_path):
+    handle = SpoolStore(str(tmp_path), "store").put(b"payload")
+
+    with opened(handle) as data:
+        assert bytes(data) == b"payload"
+
+    assert list((tmp_path / "store").iterdir()) == []
+
+
+def test_empty_spool_file_is_removed(tmp_path):
+    handle = SpoolStore(str(tmp_path), "store").put(b"")
+
+    with opened(handle) as data:
+        assert bytes(data) == b""
+
+    assert list((tmp_path / "store").iterdir()) == []
+
+
+def test_spool_file_is_kept_when_the_task_fails(tmp_path):
+    handle = SpoolStore(str(tmp_path), "store").put(b"payload")
+
+    with pytest.raises(ConnectionError):
+        with opened(handle):
+            raise ConnectionError("failed")
+
+    with opened(handle) as data:
+        assert bytes(data) == b"payload"
+    discard(handle)
+
+
+def test_binary_payloads_are_queued_as_handles(tmp_path):
+    pipeline = RecordingPipeline({"phases": [[
+        {"id": EMIT, "params": {"items": ITEMS, "binary": True}},
+        {"id": FLAKY, "params": {"failures": 0}},
+    ]]}, {}, None, payload_store="spool", spool_dir=str(tmp_path))
+    pipeline.run()
+
+    assert sorted(flaky.received) == sorted(i.encode() for i in ITEMS)
+    handles = [
+        json.loads(msg)["data"] for msg in pipeline.encoded
+        if json.loads(msg)["task"]["id"] == FLAKY
+    ]
+    assert len(handles) == len(ITEMS)
+    assert all(h["enc"] == "spool" for h in handles)
+    assert max(len(json.dumps(h)) for h in handles) < 500
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+
+
+@pytest.mark.parametrize("transport", ["json", "local"])
+@pytest.mark.parametrize("executor", ["inline", "thread"])
+def test_spooled_payloads_can_be_passed_through(
+    tmp_path, executor, transport
+):
+    items = ["a" * 10_000, "b" * 10_000]
+    Pipeline({"phases": [[
+        {"id": EMIT, "params": {"items": items, "binary": True}},
+        {"id": "worker.tasks.examples.noop", "executor": executor},
+        {"id": COLLECT},
+    ]]}, {}, None, payload_store="spool", spool_dir=str(tmp_path),
+        transport=transport).run()
+
+    assert sorted(collect.received) == [item.encode() for item in items]
+
+
+def test_unknown_payload_store_is_rejected():
+    with pytest.raises(ValueError, match="unknown payload store"):
+        Pipeline(
+            {"phases": [[{"id": EMIT}]]}, {}, None, payload_store="s3"
+        )
@@ -0,0 +1,68 @@
+import time
+from tests.tasks import collect
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+COLLECT = "tests.tasks.collect"
+NOOP = "worker.tasks.examples.noop"
+SLEEP = "worker.tasks.examples.sleep"
+SET_SENTINEL = "worker.tasks.examples.set_sentinel"
+
+
+class TimingPipeline(Pipeline):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # when the first task unit of a step was processed
+        self.started = {}
+
+    def process_msg(self, msg):
+        self.started.setdefault(msg["task"]["id"], time.perf_counter())
+        super().process_msg(msg)
+
+
+def test_next_phase_starts_after_the_last_task_unit():
+    Pipeline({"phases": [
+        [
+            {"id": EMIT, "params": {"items": ["a", "b", "c"]}},
+            {"id": NOOP, "executor": "thread"},
+            {"id": COLLECT},
+        ],
+        [{"id": EMIT, "params": {"items": ["z"]}}, {"id": COLLECT}],
+    ]}, {}, None, max_workers=3).run()
+
+    assert sorted(collect.received[:3]) == ["a", "b", "c"]
+    assert collect.received[3:] == ["z"]
+
+
+def test_phases_are_not_polled():
+    phases = 200
+    start = time.perf_counter()
+    Pipeline(
+        {"phases": [[{"id": NOOP}] for _ in range(phases)]}, {}, None
+    ).run()
+
+    # a polling interval of even 5 ms per phase would take a second
+    assert time.perf_counter() - start < 1.0
+
+
+def test_running_task_unit_keeps_the_phase_open():
+    pipeline = TimingPipeline({"phases": [
+        [
+            {"id": EMIT, "params": {"items": ["a"]}},
+            {"id": SLEEP, "params": {"duration": 0.2}, "executor": "thread"},
+        ],
+        [{"id": COLLECT}],
+    ]}, {}, None)
+    start = time.perf_counter()
+    pipeline.run()
+
+    assert pipeline.started[COLLECT] - start >= 0.2
+
+
+def test_sentinel_is_handed_to_the_next_phase():
+    Pipeline({"phases": [
+        [{"id": SET_SENTINEL, "params": {"sentinel": "2024-01-01"}}],
+        [{"id": COLLECT, "passSentinel": True}],
+    ]}, {}, None).run()
+
+    assert collect.received == ["2024-01-01"]
@@ -0,0 +1,44 @@
+import pstats
+import pytest
+from worker.nw.pipeline_runner import Pipeline
+from worker.nw.profiling import PipelineProfiler
+
+EMIT = "tests.tasks.emit"
+SLEEP = "worker.tasks.examples.sleep"
+
+
+def run(mode, profile_dir, executor="inline"):
+    Pipeline({"phases": [[
+        {"id": EMIT, "params": {"items": ["a", "b"]}},
+        {"id": SLEEP, "params": {"duration": 0.05}, "executor": executor},
+    ]]}, {}, None, profile=mode, profile_dir=str(profile_dir)).run()
+
+
+def collapsed(profile_dir):
+    return (profile_dir / "collapsed.txt").read_text().splitlines()
+
+
+def test_cprofile_writes_a_profile_per_step(tmp_path):
+    run("cprofile", tmp_path)
+
+    stats = pstats.Stats(str(tmp_path / f"{SLEEP}.prof"))
+    assert any(name == "run" for _, _, name in stats.stats)
+    assert (tmp_path / f"import_{EMIT}.prof").exists()
+    lines = collapsed(tmp_path)
+    assert any(line.startswith(f"{SLEEP};") for line in lines)
+    # step id;function microseconds
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+@pytest.mark.parametrize("executor", ["inline", "thread"])
+def test_sampling_records_the_stacks_of_the_tasks(tmp_path, executor):
+    run("sampling", tmp_path, executor)
+
+    stacks = (tmp_path / f"{SLEEP}.collapsed").read_text().splitlines()
+    assert any(f";{SLEEP}:run" in stack for stack in stacks)
+    assert any(line.startswith(f"{SLEEP};") for line in collapsed(tmp_path))
+
+
+def test_unknown_profiler_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="unknown profiler"):
+        PipelineProfiler("perf", str(tmp_path))
@@ -0,0 +1,82 @@
+import pytest
+from tests.tasks import collect, side_effects
+from worker.nw.pipeline_runner import Pipeline
+
+EMIT = "tests.tasks.emit"
+SIDE_EFFECTS = "tests.tasks.side_effects"
+COLLECT = "tests.tasks.collect"
+NOOP = "worker.tasks.examples.noop"
+# about 1 KB per task unit
+ITEMS = [f"{i:03d}" + "x" * 1000 for i in range(100)]
+
+
+class RecordingPipeline(Pipeline):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_items = 0
+        self.max_bytes = 0
+        # items the generator had produced when a task unit of the last step
+        # ran
+        self.produced = []
+
+    def queue_msg(self, msg, journal=True):
+        super().queue_msg(msg, journal)
+        self.max_items = max(self.max_items, self.wq.qsize())
+        if msg["task"]["id"] != EMIT:
+            # the first task unit holds all items in its params
+            self.max_bytes = max(self.max_bytes, self.queued_bytes)
+
+    def process_msg(self, msg):
+        if msg["task"]["id"] == COLLECT:
+            self.produced.append(len(side_effects.produced))
+        super().process_msg(msg)
+
+
+def run(first, **options):
+    pipeline = RecordingPipeline(
+        {"phases": [[first, {"id": NOOP}, {"id": COLLECT}]]}, {}, None,
+        **options,
+    )
+    pipeline.run()
+    return pipeline
+
+
+@pytest.mark.parametrize("transport", ["json", "local"])
+def test_queued_task_units_are_limited(transport):
+    pipeline = run(
+        {"id": EMIT, "params": {"items": ITEMS}},
+        max_queue_items=5, transport=transport,
+    )
+
+    assert sorted(collect.received) == ITEMS
+    assert pipeline.max_items <= 5
+
+
+@pytest.mark.parametrize("transport", ["json", "local"])
+def test_queued_bytes_are_limited(transport):
+    pipeline = run(
+        {"id": EMIT, "params": {"items": ITEMS}},
+        max_queue_bytes=5_000, transport=transport,
+    )
+
+    assert sorted(collect.received) == ITEMS
+    # the last task unit may exceed the limit
+    assert 0 < pipeline.max_bytes < 5_000 + 2_000
+
+
+def test_unbounded_queue_takes_all_items():
+    pipeline = run({"id": EMIT, "params": {"items": ITEMS}})
+
+    assert pipeline.max_items >= len(ITEMS)
+
+
+def test_generator_items_are_taken_when_needed():
+    pipeline = run(
+        {"id": SIDE_EFFECTS, "params": {"items": 50}}, stream_prefetch=3
+    )
+
+    assert side_effects.produced == list(range(50))
+    assert len(pipeline.produced) == 49
+    # the first items reach the last step before the generator is exhausted,
+    # the item 0 is not handed on as it is falsy
+    assert pipeline.produced[0] < 10
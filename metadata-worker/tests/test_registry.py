@@ -0,0 +1,47 @@
+import pytest
+from tests.tasks import collect
+from worker.nw.pipeline_runner import Pipeline
+from worker.nw.registry import TaskRegistry
+
+COLLECT = "tests.tasks.collect"
+FLAKY = "tests.tasks.flaky"
+ASYNC_SLEEP = "worker.tasks.examples.async_sleep"
+
+
+def test_run_method_is_resolved_once():
+    registry = TaskRegistry()
+
+    assert registry.load(COLLECT) is collect.run
+    assert registry.get(COLLECT) is registry.load(COLLECT)
+    assert registry.module_name(COLLECT) == COLLECT
+    assert COLLECT in registry.import_times
+
+
+def test_module_attributes():
+    registry = TaskRegistry()
+
+    assert callable(registry.attribute(FLAKY, "failure_metrics"))
+    assert registry.attribute(COLLECT, "failure_metrics") is None
+    assert registry.is_async(ASYNC_SLEEP)
+    assert not registry.is_async(COLLECT)
+
+
+def test_preloaded_modules_are_timed():
+    registry = TaskRegistry()
+    registry.preload(["json"])
+
+    assert "json" in registry.import_times
+
+
+def test_unknown_step_is_rejected_before_anything_runs():
+    with pytest.raises(ValueError, match="tests.tasks.missing"):
+        Pipeline({"phases": [
+            [{"id": COLLECT}], [{"id": "tests.tasks.missing"}]
+        ]}, {}, None)
+
+    assert collect.received == []
+
+
+def test_module_without_run_method_is_rejected():
+    with pytest.raises(ValueError, match="has no run method"):
+        Pipeline({"phases": [[{"id": "tests.tasks"}]]}, {}, None)
@@ -0,0 +1,180 @@
+import os
+import pytest
+from tests.tasks import flaky
+from worker.nw.pipeline_runner import Pipeline
+from worker.nw.retry import RetryPolicy
+
+EMIT = "tests.tasks.emit"
+FLAKY = "tests.tasks.flaky"
+ITEMS = ["a", "b", "c"]
+
+
+def blueprint(failures, retry, binary=True):
+    return {
+        "phases": [[
+            {"id": EMIT, "params": {"items": ITEMS, "binary": binary}},
+            {
+                "id": FLAKY,
+                "params": {"failures": failures},
+                "retry": {"backoff": 0, "jitter": 0, **retry},
+            },
+        ]],
+    }
+
+
+def spool_files(spool_dir):
+    return [files for _, _, files in os.walk(spool_dir) if files]
+
+
+def test_spooled_payload_is_retried(tmp_path):
+    pipeline = Pipeline(
+        blueprint(failures=2, retry={"max_attempts": 3}), {}, None,
+        payload_store="spool", spool_dir=str(tmp_path), metrics=True,
+    )
+    pipeline.run()
+
+    assert sorted(flaky.received) == [b"a", b"b", b"c"]
+    assert all(flaky.calls[i.encode()] == 3 for i in ITEMS)
+    step = pipeline.metrics.summary()["steps"][FLAKY]
+    assert step["retries"] == 6
+    assert step["failures"] == 0
+    assert spool_files(tmp_path) == []
+
+
+def test_skipped_payload_removes_spool_file(tmp_path):
+    pipeline = Pipeline(
+        blueprint(
+            failures=5, retry={"max_attempts": 2, "on_failure": "skip"}
+        ),
+        {}, None,
+        payload_store="spool", spool_dir=str(tmp_path), metrics=True,
+    )
+    spool_dir = pipeline.payload_store.spool_dir
+    removed = []
+    # the store itself is removed at the end of the run, check that the
+    # files are gone before that
+    pipeline.payload_store.cleanup = lambda: removed.append(
+        list(spool_dir.iterdir())
+    )
+    pipeline.run()
+
+    assert flaky.received == []
+    assert removed == [[]]
+    step = pipeline.metrics.summary()["steps"][FLAKY]
+    assert step["failures"] == 3
+    assert step["metrics"] == {
+        "failed": 3, "errors": {"ConnectionError": 3}
+    }
+
+
+def test_delay_is_doubled_up_to_max_backoff():
+    policy = RetryPolicy({"backoff": 2, "max_backoff": 5, "jitter": 0})
+
+    assert [policy.delay(a) for a in (1, 2, 3, 4)] == [2, 4, 5, 5]
+
+
+def test_jitter_shortens_the_delay():
+    policy = RetryPolicy({"backoff": 10, "jitter": 0.5})
+
+    assert all(5 <= policy.delay(1) <= 10 for _ in range(100))
+
+
+def test_attempts_and_errors_are_limited():
+    policy = RetryPolicy({"max_attempts": 3, "retry_on": "OSError"})
+
+    assert policy.should_retry(ConnectionError(), 1)
+    assert policy.should_retry(OSError(), 2)
+    assert not policy.should_retry(OSError(), 3)
+    assert not policy.should_retry(ValueError(), 1)
+    assert RetryPolicy({"retry_on": ["builtins.ValueError"]}).should_retry(
+        ValueError(), 1
+    )
+
+
+@pytest.mark.parametrize("retry", [
+    {"on_failure": "ignore"}, {"jitter": 2},
+])
+def test_invalid_policy_is_rejected(retry):
+    with pytest.raises(ValueError):
+        Pipeline(blueprint(0, retry), {}, None)
+
+
+def test_failed_task_unit_is_retried_until_it_succeeds():
+    pipeline = Pipeline(
+        blueprint(failures=2, binary=False, retry={"max_attempts": 3}),
+        {}, None, metrics=True,
+    )
+    pipeline.run()
+
+    assert sorted(flaky.received) == [i.encode() for i in ITEMS]
+    step = pipeline.metrics.summary()["steps"][FLAKY]
+    assert step["calls"] == 3
+    assert step["retries"] == 6
+    assert step["failures"] == 0
+
+
+def test_skipped_task_unit_does_not_stop_the_others():
+    skipping = blueprint(
+        failures=5, binary=False,
+        retry={"max_attempts": 2, "on_failure": "skip"},
+    )
+    skipping["phases"][0][1]["params"]["only"] = ["b"]
+    pipeline = Pipeline(skipping, {}, None, metrics=True)
+    pipeline.run()
+
+    assert sorted(flaky.received) == [b"a", b"c"]
+    step = pipeline.metrics.summary()["steps"][FLAKY]
+    assert step["retries"] == 1
+    assert step["failures"] == 1
+
+
+def test_failure_without_retry_stops_the_pipeline(tmp_path):
+    pipeline = Pipeline(
+        {"phases": [[
+            {"id": EMIT, "params": {"items": ITEMS, "binary": True}},
+            {"id": FLAKY},
+        ]]},
+        {}, None, payload_store="spool", spool_dir=str(tmp_path),
+    )
+    with pytest.raises(ConnectionError):
+        pipeline.run()
+
+
+def test_error_not_in_retry_on_is_not_retried():
+    pipeline = Pipeline(
+        blueprint(
+            failures=1, binary=False,
+            retry={"retry_on": ["ValueError"], "on_failure": "skip"},
+        ),
+        {}, None, metrics=True,
+    )
+    pipeline.run()
+
+    assert flaky.received == []
+    step = pipeline.metrics.summary()["steps"][FLAKY]
+    assert step["retries"] == 0
+    assert step["failures"] == 3
+
+
+def test_failed_inserts_are_counted():
+    pytest.importorskip("psycopg2")
+    step = {
+        "id": "worker.tasks.db.record_store",
+        "params": {"db": "postgresql://nw@127.0.0.1:1/nw", "table": "records"},
+        "retry": {
+            "max_attempts": 2, "backoff": 0,
+            "retry_on": ["psycopg2.OperationalError"], "on_failure": "skip",
+        },
+    }
+    pipeline = Pipeline(
+        {"phases": [[
+            {"id": EMIT, "params": {"items": [[{"id": 1}, {"id": 2}]]}},
+            step,
+        ]]},
+        {}, None, metrics=True,
+    )
+    pipeline.run()
+
+    metrics = pipeline.metrics.summary()["steps"][step["id"]]
+    assert metrics["retries"] == 1
+    assert metrics["metrics"] == {"total": 2, "new": 0, "failed": 2}
@@ -0,0 +1,52 @@
+import pytest
+from tests.tasks import collect, side_effects
+from worker.nw.pipeline_runner import Pipeline
+
+SIDE_EFFECTS = "tests.tasks.side_effects"
+NOOP = "worker.tasks.examples.noop"
+COLLECT = "tests.tasks.collect"
+SET_SENTINEL = "worker.tasks.examples.set_sentinel"
+GET_FILE_LIST = "worker.tasks.fs.get_file_list"
+
+
+def step(wrap):
+    return {"id": SIDE_EFFECTS, "params": {"items": 3, "wrap": wrap}}
+
+
+@pytest.mark.parametrize("wrap", [None, "many", "partial"])
+def test_generator_of_last_step_is_exhausted(wrap):
+    Pipeline({"phases": [[step(wrap)]]}, {}, None).run()
+
+    assert side_effects.produced == [0, 1, 2]
+
+
+@pytest.mark.parametrize("fuse", [False, True])
+@pytest.mark.parametrize("wrap", [None, "many", "partial"])
+def test_generator_items_reach_the_next_step(wrap, fuse):
+    pipeline = Pipeline(
+        {"phases": [[step(wrap), {"id": NOOP}]]}, {}, None,
+        fuse=fuse, metrics=True,
+    )
+    pipeline.run()
+
+    assert side_effects.produced == [0, 1, 2]
+    assert pipeline.metrics.summary()["steps"][NOOP]["calls"] == 3
+
+
+def test_file_list_is_streamed(tmp_path, monkeypatch):
+    monkeypatch.setenv("METADATA", str(tmp_path))
+    (tmp_path / "import").mkdir()
+    for i in range(5):
+        (tmp_path / "import" / f"{i}.json").write_text("{}")
+    (tmp_path / "import" / "skipped.xml").write_text("")
+
+    Pipeline({"phases": [
+        [{"id": SET_SENTINEL, "params": {"sentinel": "import"}}],
+        [
+            {"id": GET_FILE_LIST, "params": {"ext": ".json", "stream": True},
+             "passSentinel": True},
+            {"id": COLLECT},
+        ],
+    ]}, {}, None).run()
+
+    assert sorted(collect.received) == [f"import/{i}.json" for i in range(5)]
@@ -0,0 +1,38 @@
+from datetime import datetime
+import pytest
+from tests.tasks import collect, objects
+from worker.nw.pipeline_runner import Pipeline
+
+OBJECTS = "tests.tasks.objects"
+COLLECT = "tests.tasks.collect"
+NOOP = "worker.tasks.examples.noop"
+
+
+def run(transport):
+    Pipeline(
+        {"phases": [[{"id": OBJECTS}, {"id": NOOP}, {"id": COLLECT}]]},
+        {}, None, transport=transport,
+    ).run()
+    return collect.received
+
+
+def test_local_transport_hands_over_the_objects():
+    received = run("local")
+
+    assert len(received) == 3
+    for sent, got in zip(objects.returned, received):
+        assert got is sent
+
+
+def test_json_transport_copies_the_data():
+    received = run("json")
+
+    assert received[0] == str(datetime(2024, 5, 1, 12, 30))
+    assert received[1] == b"\x00\xffbinary"
+    assert received[2] == objects.returned[2]
+    assert received[2] is not objects.returned[2]
+
+
+def test_unknown_transport_is_rejected():
+    with pytest.raises(ValueError, match="unknown transport"):
+        Pipeline({"phases": [[{"id": NOOP}]]}, {}, None, transport="pipe")
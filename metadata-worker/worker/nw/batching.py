@@ -0,0 +1,85 @@
+import json
+import time
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+# id of the built-in step that collects the results of many task units and
+# hands them to the next step in one list
+BATCH = "nw.batch"
+
+DEFAULT_MAX_RECORDS = 1000
+
+
+class Batch:
+    """
+    Buffer of a batch step.
+
+    Items are collected until one of the limits given in the step params is
+    reached:
+    - max_records: int, number of items, defaults to 1000
+    - max_bytes: int, optional, size of the items serialized to JSON
+    - max_seconds: float, optional, time since the first buffered item
+
+    Methods
+    -------
+    add(data)
+        Adds data to the buffer, lists are added item by item. Returns True
+        if the batch should be flushed
+    is_due()
+        True if the batch is not empty and max_seconds have passed
+    take()
+        Returns the buffered items and empties the buffer
+    """
+
+    def __init__(self, params, next_tasks, priority):
+        params = params or {}
+        self.max_records = params.get("max_records", DEFAULT_MAX_RECORDS)
+        self.max_bytes = params.get("max_bytes")
+        self.max_seconds = params.get("max_seconds")
+        self.next_tasks = next_tasks
+        self.priority = priority
+
+        self.items = []
+        self.size = 0
+        self.started = None
+        # tokens of the task units the items came from, only used with a
+        # journal
+        self.owners = []
+
+    def add(self, data):
+        items = data if type(data) == list else [data]
+        if not self.items:
+            self.started = time.monotonic()
+        self.items += items
+        if self.max_bytes:
+            self.size += sum(
+                len(json.dumps(i, ensure_ascii=False, default=str))
+                for i in items
+            )
+        return self.is_full() or self.is_due()
+
+    def is_full(self):
+        if self.max_records and len(self.items) >= self.max_records:
+            return True
+        return bool(self.max_bytes) and self.size >= self.max_bytes
+
+    def is_due(self):
+        if not self.items or not self.max_seconds:
+            return False
+        return time.monotonic() - self.started >= self.max_seconds
+
+    def deadline(self):
+        if not self.items or not self.max_seconds:
+            return None
+        return self.started + self.max_seconds
+
+    def take(self):
+        items = self.items
+        self.items = []
+        self.size = 0
+        self.started = None
+        return items
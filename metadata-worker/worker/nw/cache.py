@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from collections.abc import Iterator
+from pathlib import Path
+from .utils import Many, Partial
+from .payloads import is_handle
+from .log import get_logger
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+
+def default_cache_dir():
+    if os.environ.get("METADATA"):
+        return str(Path(os.environ["METADATA"]) / ".cache")
+    return str(Path(tempfile.gettempdir()) / "nw-cache")
+
+
+class ResultCache:
+    """
+    Content-addressed cache of task results on local disk.
+
+    A result is stored under the hash of the step id, the version of the
+    task module, the step params and the input of the task. The input is the
+    task data, unless the task module defines cache_key(opts), e.g. to hash
+    the modification time of a file instead of its path. When the cache
+    grows beyond max_bytes the least recently used results are removed.
+
+    Methods
+    -------
+    key(step_id, opts, cache_key=None, version=None)
+        Returns the key of a task call
+    get(key)
+        Returns the cached Result or None
+    put(key, result)
+        Stores a Result, results with generators or other iterators as data
+        are not stored
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = Path(cache_dir or default_cache_dir())
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # key -> size, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        files = sorted(
+            (f.stat().st_mtime, f.name, f.stat().st_size)
+            for f in self.cache_dir.glob("*.pkl")
+        )
+        for _, name, size in files:
+            self.entries[name[:-len(".pkl")]] = size
+            self.size += size
+
+    def key(self, step_id, opts, cache_key=None, version=None):
+        if cache_key:
+            data = cache_key(opts)
+        else:
+            data = opts.get("data")
+        digest = hashlib.sha256()
+        digest.update(
+            json.dumps(
+                [step_id, version, opts.get("params")],
+                sort_keys=True, default=str,
+            ).encode("utf-8")
+        )
+        digest.update(b"\0")
+        if is_handle(data):
+            # spooled payload, the path is different for every task unit
+            with open(data["path"], "rb") as f:
+                for chunk in iter(lambda: f.read(1024 ** 2), b""):
+                    digest.update(chunk)
+        else:
+            digest.update(data_bytes(data))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.pkl"
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        try:
+            with open(self.path(key), "rb") as f:
+                result = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"dropping unreadable cache entry {key}: {e}")
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        os.utime(self.path(key))
+        return result
+
+    def put(self, key, result):
+        if not is_cacheable(result):
+            return False
+        try:
+            raw = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.debug(f"result for {key} can't be cached: {e}")
+            return False
+
+        # written to a temporary file first, a crash never leaves a
+        # truncated entry behind
+        tmp = self.path(key).with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(raw)
+        os.replace(tmp, self.path(key))
+
+        if key in self.entries:
+            self.size -= self.entries.pop(key)
+        self.entries[key] = len(raw)
+        self.size += len(raw)
+        self.evict()
+        return True
+
+    def evict(self):
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self.remove(key)
+
+    def remove(self, key):
+        self.size -= self.entries.pop(key, 0)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def data_bytes(data):
+    if data is None:
+        return b""
+    if type(data) == str:
+        return data.encode("utf-8")
+    if type(data) in (bytes, bytearray, memoryview):
+        return data
+    return json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+
+
+def is_cacheable(result):
+    data = result.data
+    if type(data) == Partial:
+        data = data.partial
+    if type(data) == Many:
+        data = data.items
+    return not isinstance(data, Iterator) and type(data) != memoryview
+
+
+def module_version(module):
+    """
+    Hash of the source file of a task module, results cached before the
+    module was changed are not used anymore
+    """
+    path = getattr(module, "__file__", None)
+    if not path:
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
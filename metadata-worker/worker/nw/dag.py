@@ -0,0 +1,73 @@
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+def load_nodes(blueprint):
+    """
+    Returns the nodes of a blueprint as a dict of node name to
+    {"steps": list, "needs": list}.
+
+    A blueprint either has "phases", a list of step lists that run one
+    after the other, or "nodes", a dict of node names to a node with
+    "steps" (one chain of steps, like a phase) and "needs" (names of the
+    nodes that have to be finished before the node starts). Phases become
+    nodes named by their index, each needing the phase before.
+
+    Raises a ValueError for unknown needs, cycles and empty nodes.
+    """
+    if ("phases" in blueprint) == ("nodes" in blueprint):
+        raise ValueError('a blueprint needs either "phases" or "nodes"')
+
+    if "phases" in blueprint:
+        nodes = {
+            i: {"steps": phase, "needs": [i - 1] if i else []}
+            for i, phase in enumerate(blueprint["phases"])
+        }
+    else:
+        nodes = {
+            name: {"steps": node.get("steps", []),
+                   "needs": node.get("needs", [])}
+            for name, node in blueprint["nodes"].items()
+        }
+
+    for name, node in nodes.items():
+        if not node["steps"]:
+            raise ValueError(f"node {name} has no steps")
+        for need in node["needs"]:
+            if need not in nodes:
+                raise ValueError(f"node {name} needs unknown node {need}")
+    check_cycles(nodes)
+    return nodes
+
+
+def check_cycles(nodes):
+    # Kahn's algorithm, nodes that are never ready are part of a cycle or
+    # need one
+    waiting = {name: len(set(node["needs"])) for name, node in nodes.items()}
+    needed_by = {name: [] for name in nodes}
+    for name, node in nodes.items():
+        for need in set(node["needs"]):
+            needed_by[need].append(name)
+    ready = [name for name, count in waiting.items() if count == 0]
+    while ready:
+        for name in needed_by[ready.pop()]:
+            waiting[name] -= 1
+            if waiting[name] == 0:
+                ready.append(name)
+    cyclic = [name for name, count in waiting.items() if count > 0]
+    if cyclic:
+        raise ValueError(f"cycle in the blueprint at nodes {cyclic}")
+
+
+def blueprint_steps(blueprint):
+    """
+    All steps of a blueprint with phases or nodes
+    """
+    if "nodes" in blueprint:
+        for node in blueprint["nodes"].values():
+            yield from node.get("steps", [])
+    else:
+        for phase in blueprint.get("phases", []):
+            yield from phase
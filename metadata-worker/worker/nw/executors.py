@@ -0,0 +1,164 @@
+import asyncio
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from importlib import import_module
+from .payloads import detach, is_handle, opened
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+INLINE = "inline"
+THREAD = "thread"
+PROCESS = "process"
+# async def run methods, run concurrently on an event loop in its own thread
+ASYNC = "async"
+# task units of one async step that run at the same time
+DEFAULT_CONCURRENCY = 10
+
+EXECUTOR_TYPES = (INLINE, THREAD, PROCESS, ASYNC)
+
+
+def call_task(module_name, opts):
+    """
+    Import a task module and call its run method. Module level so it can be
+    pickled and sent to a process pool.
+    """
+    return call_run(import_module(module_name).run, opts)
+
+
+def call_run(run, opts):
+    """
+    Call the run method of a task module. Spooled payloads are mapped here,
+    in the process running the task, and views of them in the result are
+    copied before the mapping is closed. An async run method that is not run on
+    the event loop (e.g. in a process pool) gets an event loop of its own.
+    """
+    if is_handle(opts.get("data")):
+        with opened(opts["data"]) as data:
+            return detach(complete(run({**opts, "data": data})))
+    return complete(run(opts))
+
+
+def complete(result):
+    if inspect.iscoroutine(result):
+        return asyncio.run(result)
+    return result
+
+
+async def call_run_async(run, opts):
+    """
+    Await the async run method of a task module on the event loop
+    """
+    if is_handle(opts.get("data")):
+        with opened(opts["data"]) as data:
+            return detach(await run({**opts, "data": data}))
+    return await run(opts)
+
+
+def timed_call(fn, *args):
+    """
+    Call fn and measure it in the thread running it. Returns the result and
+    a tuple of start time (epoch), wall time and CPU time of the thread.
+    """
+    started = time.time()
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    result = fn(*args)
+    return result, (
+        started, time.perf_counter() - wall, time.thread_time() - cpu
+    )
+
+
+async def timed_call_async(limit, fn, *args):
+    """
+    Await fn once limit (an asyncio.Semaphore) allows it. Returns the result
+    and the same timing tuple as timed_call, the event loop thread is shared
+    by all coroutines so no CPU time is measured.
+    """
+    async with limit:
+        started = time.time()
+        wall = time.perf_counter()
+        result = await fn(*args)
+        return result, (started, time.perf_counter() - wall, 0.0)
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop running in a daemon thread, coroutines are
+    submitted from other threads
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="nw-async", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, fn, *args):
+        return asyncio.run_coroutine_threadsafe(fn(*args), self.loop)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if cancel_futures:
+            for task in asyncio.all_tasks(self.loop):
+                self.loop.call_soon_threadsafe(task.cancel)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if wait:
+            self.thread.join()
+            self.loop.close()
+
+
+class TaskExecutor:
+    """
+    Lazily created thread and process pools and event loop, shared by all
+    steps of a pipeline.
+
+    Methods
+    -------
+    submit(executor_type, fn, *args)
+        Submit fn to the pool for the given executor type and return
+        a concurrent.futures.Future. For the async executor fn has to be
+        a coroutine function
+    shutdown(wait=True)
+        Shut down all pools that have been created
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        Parameters
+        ----------
+        param max_workers : int, optional
+            Size of each pool and the maximum number of task units in
+            flight at the same time, defaults to the number of CPUs
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pools = {}
+
+    def submit(self, executor_type, fn, *args):
+        pool = self._pools.get(executor_type)
+        if pool is None:
+            pool = self._create_pool(executor_type)
+            self._pools[executor_type] = pool
+        return pool.submit(fn, *args)
+
+    def _create_pool(self, executor_type):
+        if executor_type == THREAD:
+            return ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="nw-task"
+            )
+        if executor_type == PROCESS:
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        if executor_type == ASYNC:
+            return EventLoopThread()
+        raise ValueError(f"no pool for executor type {executor_type}")
+
+    def shutdown(self, wait=True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait, cancel_futures=not wait)
+        self._pools = {}
@@ -0,0 +1,225 @@
+import base64
+import json
+import os
+from pathlib import Path
+from .log import get_logger
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+logger = get_logger(__name__)
+
+# the journal is compacted when it grew beyond this size, and again when it
+# doubled after that
+DEFAULT_COMPACT_BYTES = 64 * 1024 ** 2
+
+
+class Journal:
+    """
+    Append only journal of a pipeline run, one JSON object per line:
+
+    - {"fingerprint": str}            first line, identifies the pipeline
+    - {"started": node, "unit": dict} a node (a phase) was started with this
+                                      task unit
+    - {"finished": node}              all task units of the node are done
+    - {"queued": dict}                a task unit was put on the queue
+    - {"done": str}                   the task unit with this token and all
+                                      task units created from its result
+                                      have been queued or processed
+    - {"sentinel": any, "node": node} the sentinel of a node was set
+
+    After a crash the journal is loaded and the task units that were queued
+    but not done are queued again.
+
+    Every queued task unit is written with its data, so the journal is
+    compacted while the pipeline runs: once it grew beyond compact_bytes it
+    is rewritten without the task units that are done. Only the tokens of
+    the task units that are not done are kept in memory for this.
+
+    Methods
+    -------
+    load()
+        Reads an existing journal of the same pipeline, returns True if
+        there is something to resume
+    open(resume)
+        Opens the journal for writing, a new journal is started unless
+        resume is True
+    close(completed)
+        Closes the journal, it is removed if the pipeline completed
+    compact()
+        Rewrites the journal without the task units that are done
+    """
+
+    def __init__(self, path, fingerprint, compact_bytes=None):
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.file = None
+        self.compact_bytes = compact_bytes or DEFAULT_COMPACT_BYTES
+        self.compact_at = self.compact_bytes
+        # tokens of the task units that were queued and are not done, and of
+        # the task units nodes were started with
+        self.live = set()
+        self.roots = set()
+        # size of the complete lines read by load
+        self.loaded_bytes = 0
+
+        self.started = []
+        self.finished = set()
+        self.sentinels = {}
+        self.queued_units = {}
+        self.done_tokens = set()
+
+    def load(self):
+        if not self.path.exists():
+            return False
+
+        with open(self.path, "r", encoding="utf8") as f:
+            for number, line in enumerate(f):
+                try:
+                    if not line.endswith("\n"):
+                        raise ValueError("incomplete line")
+                    event = json.loads(line)
+                except ValueError:
+                    # the last line can be incomplete after a crash
+                    logger.warning(f"{self.path}: ignoring line {number + 1}")
+                    break
+                self.loaded_bytes += len(line.encode("utf8"))
+                if number == 0:
+                    if event.get("fingerprint") != self.fingerprint:
+                        logger.warning(
+                            f"{self.path} belongs to another pipeline, "
+                            "starting from scratch"
+                        )
+                        return False
+                    continue
+                self.replay(event)
+
+        return bool(self.started)
+
+    def replay(self, event):
+        if "started" in event:
+            self.started.append(event["started"])
+            unit = decode_unit(event["unit"])
+            self.queued_units[unit["task_token"]] = unit
+            self.roots.add(unit["task_token"])
+        elif "finished" in event:
+            self.finished.add(event["finished"])
+        elif "queued" in event:
+            unit = decode_unit(event["queued"])
+            self.queued_units[unit["task_token"]] = unit
+        elif "done" in event:
+            self.done_tokens.add(event["done"])
+            self.queued_units.pop(event["done"], None)
+        elif "sentinel" in event:
+            self.sentinels[event.get("node")] = event["sentinel"]
+
+    def pending(self):
+        return list(self.queued_units.values())
+
+    def is_known(self, token):
+        return token in self.queued_units or token in self.done_tokens
+
+    def open(self, resume):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume:
+            # new events must not be appended to an incomplete last line
+            os.truncate(self.path, self.loaded_bytes)
+        self.file = open(self.path, "a" if resume else "w", encoding="utf8")
+        if resume:
+            self.live = set(self.queued_units)
+            self.compact_at = max(
+                self.compact_bytes, 2 * self.path.stat().st_size
+            )
+        else:
+            self.write({"fingerprint": self.fingerprint})
+
+    def close(self, completed):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if completed and self.path.exists():
+            os.remove(self.path)
+
+    def write(self, event):
+        self.file.write(
+            json.dumps(event, ensure_ascii=False, default=encode_value) + "\n"
+        )
+        # flushed to the OS, survives a crash of the worker process
+        self.file.flush()
+
+    def started_node(self, node, unit):
+        self.live.add(unit["task_token"])
+        self.roots.add(unit["task_token"])
+        self.write({"started": node, "unit": unit})
+
+    def finished_node(self, node):
+        self.write({"finished": node})
+
+    def queued(self, unit):
+        self.live.add(unit["task_token"])
+        self.write({"queued": unit})
+
+    def done(self, token):
+        self.live.discard(token)
+        self.write({"done": token})
+        if self.file.tell() > self.compact_at:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrites the journal with the events a resume needs: the nodes,
+        sentinels and task units that are not done, and the done tokens of
+        task units created by those (their results are created again on a
+        resume, the done ones are skipped) and of the task units nodes were
+        started with
+        """
+        size = self.file.tell()
+        self.file.close()
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(self.path, "r", encoding="utf8") as src, open(
+            tmp, "w", encoding="utf8"
+        ) as dst:
+            for line in src:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # incomplete line written before a crash
+                    continue
+                if "queued" in event:
+                    keep = event["queued"]["task_token"] in self.live
+                elif "done" in event:
+                    token = event["done"]
+                    keep = (
+                        token in self.roots
+                        or token.rpartition(".")[0] in self.live
+                    )
+                else:
+                    keep = True
+                if keep:
+                    dst.write(line)
+        os.replace(tmp, self.path)
+        self.file = open(self.path, "a", encoding="utf8")
+        compacted = self.file.tell()
+        self.compact_at = max(self.compact_bytes, 2 * compacted)
+        logger.debug(
+            f"compacted {self.path} from {size} to {compacted} bytes"
+        )
+
+    def set_sentinel(self, node, sentinel):
+        self.write({"sentinel": sentinel, "node": node})
+
+
+def encode_value(obj):
+    if type(obj) in (bytes, bytearray, memoryview):
+        return {"enc": "b64", "raw": base64.b64encode(obj).decode("utf-8")}
+    return str(obj)
+
+
+def decode_unit(unit):
+    data = unit.get("data")
+    if type(data) == dict and data.get("enc") == "b64" and "raw" in data:
+        unit["data"] = base64.b64decode(data["raw"])
+    return unit
@@ -0,0 +1,202 @@
+import os
+import resource
+import threading
+import tracemalloc
+from collections import deque
+from .log import get_logger
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+logger = get_logger(__name__)
+
+# memory option values, rss only or rss and tracemalloc
+RSS = "rss"
+TRACEMALLOC = "tracemalloc"
+MEMORY_MODES = (RSS, TRACEMALLOC)
+
+MB = 1024 ** 2
+# calls of a step looked at to decide if its retained memory keeps growing
+GROWTH_WINDOW = 20
+DEFAULT_WARN_MB = 100
+DEFAULT_SNAPSHOT_EVERY = 100
+TOP_SITES = 10
+
+
+def current_rss():
+    """
+    Resident set size of the worker process in bytes
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # no procfs (e.g. macOS), the peak is the best we have
+        return peak_rss()
+
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def take_snapshot():
+    # without the allocations of the measurement itself
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+
+
+class StepMemory:
+    def __init__(self):
+        self.calls = 0
+        self.retained = 0
+        self.max_delta = 0
+        self.new_peaks = 0
+        self.traced_peak = 0
+        self.recent = deque(maxlen=GROWTH_WINDOW)
+        self.warned = False
+        # allocation site -> [size difference, count difference]
+        self.sites = {}
+
+    def summary(self):
+        top = sorted(
+            self.sites.items(), key=lambda s: s[1][0], reverse=True
+        )[:TOP_SITES]
+        return {
+            "calls": self.calls,
+            "retained_rss": self.retained,
+            "max_rss_delta": self.max_delta,
+            "new_peaks": self.new_peaks,
+            "traced_peak": self.traced_peak,
+            "top_allocations": [
+                {"site": site, "size": size, "count": count}
+                for site, (size, count) in top
+            ],
+        }
+
+
+class MemoryTracker:
+    """
+    Measures the memory used by the task calls of every step id.
+
+    For each call the change of the RSS of the worker process is recorded,
+    a step whose retained RSS grows in most of its last calls by more than
+    warn_mb in total is logged as a possible leak. If a call raised the peak
+    RSS of the process the step is counted as the cause. In tracemalloc mode
+    the peak of Python allocations made during each call is recorded and
+    every snapshot_every-th call of a step is compared to a snapshot taken
+    before it, to find the allocation sites of the step.
+
+    Calls running at the same time in a thread pool are measured together,
+    steps in a process pool are not measured.
+
+    Methods
+    -------
+    call(step_id, fn, *args)
+        Calls fn and measures it under step_id
+    summary()
+        Returns the measurements and the memory growth of the run
+    stop()
+        Stops tracemalloc if it was started by the tracker
+    """
+
+    def __init__(self, mode, warn_mb=None, snapshot_every=None):
+        if mode not in MEMORY_MODES:
+            raise ValueError(f"unknown memory mode {mode}")
+        self.mode = mode
+        self.warn_bytes = (warn_mb or DEFAULT_WARN_MB) * MB
+        self.snapshot_every = snapshot_every or DEFAULT_SNAPSHOT_EVERY
+        self.steps = {}
+        self.lock = threading.Lock()
+        self.rss_start = current_rss()
+        self.rss_max = self.rss_start
+        self.tracing = mode == TRACEMALLOC and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+
+    def step(self, step_id):
+        if step_id not in self.steps:
+            self.steps[step_id] = StepMemory()
+        return self.steps[step_id]
+
+    def call(self, step_id, fn, *args):
+        step = self.step(step_id)
+        snapshot = None
+        traced = 0
+        if self.mode == TRACEMALLOC:
+            with self.lock:
+                if step.calls % self.snapshot_every == 0:
+                    snapshot = take_snapshot()
+                tracemalloc.reset_peak()
+                traced = tracemalloc.get_traced_memory()[0]
+        peak_before = peak_rss()
+        rss_before = current_rss()
+
+        result = fn(*args)
+
+        rss_after = current_rss()
+        with self.lock:
+            self.record(step_id, step, rss_after - rss_before, rss_after)
+            if peak_rss() > peak_before:
+                step.new_peaks += 1
+            if self.mode == TRACEMALLOC:
+                step.traced_peak = max(
+                    step.traced_peak,
+                    tracemalloc.get_traced_memory()[1] - traced,
+                )
+                if snapshot:
+                    self.compare(step, snapshot)
+        return result
+
+    def record(self, step_id, step, delta, rss):
+        step.calls += 1
+        step.retained += delta
+        step.max_delta = max(step.max_delta, delta)
+        step.recent.append(delta)
+        self.rss_max = max(self.rss_max, rss)
+
+        growing = sum(1 for d in step.recent if d > 0)
+        if (
+            not step.warned
+            and len(step.recent) == GROWTH_WINDOW
+            and growing >= 0.8 * GROWTH_WINDOW
+            and step.retained > self.warn_bytes
+        ):
+            step.warned = True
+            logger.warning(
+                f"{step_id} retained {step.retained / MB:.1f} MB over "
+                f"{step.calls} calls, memory grew in {growing} of the last "
+                f"{GROWTH_WINDOW} calls"
+            )
+
+    def compare(self, step, snapshot):
+        stats = take_snapshot().compare_to(snapshot, "lineno")
+        for stat in stats[:TOP_SITES]:
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            site = f"{frame.filename}:{frame.lineno}"
+            sizes = step.sites.setdefault(site, [0, 0])
+            sizes[0] += stat.size_diff
+            sizes[1] += stat.count_diff
+
+    def summary(self):
+        rss_end = current_rss()
+        return {
+            "rss_start": self.rss_start,
+            "rss_end": rss_end,
+            "rss_max": max(self.rss_max, rss_end),
+            "peak_rss": peak_rss(),
+            "growth": rss_end - self.rss_start,
+            "steps": {k: v.summary() for k, v in self.steps.items()},
+        }
+
+    def stop(self):
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
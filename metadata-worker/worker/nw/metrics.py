@@ -0,0 +1,182 @@
+import json
+import time
+from array import array
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+# logs kept per step id in the summary
+MAX_LOGS = 1000
+
+
+class StepMetrics:
+    """
+    Measurements of all task units of one step id
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = array("d")
+        self.cpu = array("d")
+        self.wait = array("d")
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.emitted = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.retries = 0
+        self.failures = 0
+        self.task_metrics = {}
+        self.logs = []
+        self.log_count = 0
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "wall": distribution(self.wall),
+            "cpu": distribution(self.cpu),
+            "queue_wait": distribution(self.wait),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "task_units_out": self.emitted,
+            "fan_out": self.emitted / self.calls if self.calls else 0,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "retries": self.retries,
+            "failures": self.failures,
+            "metrics": self.task_metrics,
+            "log_count": self.log_count,
+            "logs": self.logs,
+        }
+
+
+class PipelineMetrics:
+    """
+    Collects timings, payload sizes and the metrics and logs returned by the
+    tasks of a pipeline run, per step id.
+
+    Methods
+    -------
+    record_call(step_id, timing, queued_at, size, result)
+        Records one task call, timing is the tuple returned by
+        executors.timed_call, size the size of the data the task got
+    record_emit(step_id, size)
+        Records a task unit created from the result of step_id
+    record_cache(step_id, hit)
+        Records a lookup in the result cache
+    record_failure(step_id, retried, metrics=None)
+        Records a failed task call, retried is False if the task unit was
+        dropped. metrics are added to the metrics of the step's tasks
+    summary()
+        Returns everything as a JSON serializable dict
+    dump(path)
+        Writes the summary to a JSON file
+    """
+
+    def __init__(self):
+        self.steps = {}
+        self.started = time.time()
+        self.finished = None
+        self.extra = {}
+
+    def step(self, step_id):
+        if step_id not in self.steps:
+            self.steps[step_id] = StepMetrics()
+        return self.steps[step_id]
+
+    def record_call(self, step_id, timing, queued_at, size, result):
+        step = self.step(step_id)
+        started, wall, cpu = timing
+        step.calls += 1
+        step.wall.append(wall)
+        step.cpu.append(cpu)
+        step.wait.append(max(0, started - (queued_at or started)))
+        step.bytes_in += size
+        if result.metrics:
+            merge(step.task_metrics, result.metrics)
+        if result.logs:
+            logs = result.logs if type(result.logs) == list else [result.logs]
+            step.log_count += len(logs)
+            step.logs += logs[:MAX_LOGS - len(step.logs)]
+
+    def record_emit(self, step_id, size):
+        step = self.step(step_id)
+        step.emitted += 1
+        step.bytes_out += size
+
+    def record_cache(self, step_id, hit):
+        step = self.step(step_id)
+        if hit:
+            step.cache_hits += 1
+        else:
+            step.cache_misses += 1
+
+    def record_failure(self, step_id, retried, metrics=None):
+        step = self.step(step_id)
+        if retried:
+            step.retries += 1
+        else:
+            step.failures += 1
+        if metrics:
+            merge(step.task_metrics, metrics)
+
+    def summary(self):
+        finished = self.finished or time.time()
+        task_metrics = {}
+        for step in self.steps.values():
+            merge(task_metrics, step.task_metrics)
+        return {
+            "started": self.started,
+            "duration": finished - self.started,
+            "steps": {k: v.summary() for k, v in self.steps.items()},
+            "metrics": task_metrics,
+            "cache": {
+                "hits": sum(s.cache_hits for s in self.steps.values()),
+                "misses": sum(s.cache_misses for s in self.steps.values()),
+            },
+            **self.extra,
+        }
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.summary(), f, indent=2, default=str)
+
+
+def distribution(values):
+    if not values:
+        return {"total": 0, "mean": 0, "p50": 0, "p90": 0, "p99": 0, "max": 0}
+    ordered = sorted(values)
+    total = sum(ordered)
+    return {
+        "total": total,
+        "mean": total / len(ordered),
+        "p50": percentile(ordered, 50),
+        "p90": percentile(ordered, 90),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1],
+    }
+
+
+def percentile(ordered, p):
+    # nearest rank
+    index = max(0, -(-len(ordered) * p // 100) - 1)
+    return ordered[int(index)]
+
+
+def merge(total, metrics):
+    """
+    Adds up numbers of the metrics dicts returned by tasks, nested dicts are
+    merged, other values are replaced
+    """
+    if type(metrics) != dict:
+        return
+    for k, v in metrics.items():
+        if type(v) == dict:
+            merge(total.setdefault(k, {}), v)
+        elif type(v) in (int, float) and type(total.get(k)) in (int, float):
+            total[k] += v
+        else:
+            total[k] = v
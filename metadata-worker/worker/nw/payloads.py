@@ -0,0 +1,135 @@
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from .utils import Many, Partial
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+SPOOL = "spool"
+
+
+def default_spool_dir():
+    if os.environ.get("METADATA"):
+        return str(Path(os.environ["METADATA"]) / ".spool")
+    return str(Path(tempfile.gettempdir()) / "nw-spool")
+
+
+class SpoolStore:
+    """
+    Stores binary task results in spool files, so only a small handle has to
+    be put on the queue instead of the base64 encoded data.
+
+    Methods
+    -------
+    put(data)
+        Writes data to a new spool file and returns the handle
+    cleanup()
+        Removes the spool directory with all files that were not consumed
+    """
+
+    def __init__(self, spool_dir=None, name=None):
+        """
+        Parameters
+        ----------
+        param spool_dir : str, optional
+            Directory for the spool files, a subdirectory is created for
+            every store. Defaults to "$METADATA/.spool"
+        param name : str, optional
+            Name of the subdirectory, a random one is used if not given
+        """
+        spool_dir = spool_dir or default_spool_dir()
+        self.spool_dir = Path(spool_dir) / (name or uuid.uuid4().hex)
+
+    def put(self, data):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / uuid.uuid4().hex
+        with open(path, "wb") as f:
+            size = f.write(data)
+        return {"enc": SPOOL, "path": str(path), "size": size}
+
+    def cleanup(self):
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+def is_handle(data):
+    return type(data) == dict and data.get("enc") == SPOOL and "path" in data
+
+
+@contextmanager
+def opened(handle):
+    """
+    Maps the spool file of a handle into memory and yields a read only
+    memoryview of it. The view is only valid until the task returns, see
+    detach for results that still refer to it. The spool file is removed
+    afterwards if the task succeeded. If the task raised the file is kept,
+    the task unit may be retried, see discard.
+    """
+    path = handle["path"]
+    if handle.get("size") == 0:
+        # empty files can't be mapped
+        yield memoryview(b"")
+        os.remove(path)
+        return
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    succeeded = False
+    try:
+        yield view
+        succeeded = True
+    finally:
+        try:
+            view.release()
+            mm.close()
+        except BufferError:
+            # the task kept a reference to the data, the mapping is closed
+            # when the last reference is gone
+            pass
+        if succeeded:
+            os.remove(path)
+
+
+def detach(result):
+    """
+    Copies the memoryviews a task returned in the data or skip of its Result
+    to bytes, views of a mapped spool file are released when the task
+    returns. Generators have to copy the data they yield themselves.
+    """
+    if result is not None:
+        result.data = copied(result.data)
+        result.skip = copied(result.skip)
+    return result
+
+
+def copied(data):
+    if type(data) == memoryview:
+        return data.tobytes()
+    if type(data) == Many:
+        return Many(copied(data.items))
+    if type(data) == Partial:
+        return Partial(copied(data.partial))
+    if type(data) in (list, tuple):
+        return type(data)(copied(item) for item in data)
+    return data
+
+
+def discard(data):
+    """
+    Removes the spool file of a handle, for task units that are dropped
+    after their task failed
+    """
+    if is_handle(data):
+        try:
+            os.remove(data["path"])
+        except FileNotFoundError:
+            pass
@@ -1,10 +1,32 @@
+import asyncio
 import queue
+import itertools
+import time
 import nanoid
 import json
 import base64
-from importlib import import_module
+import hashlib
+import heapq
 from datetime import date, datetime
-from .utils import Many, Partial, is_module_available
+from collections import Counter, deque, namedtuple
+from collections.abc import Iterator
+from concurrent.futures import Future
+from .utils import Many, Partial, payload_size
+from .payloads import SPOOL, SpoolStore, discard
+from .batching import BATCH, Batch
+from .dag import blueprint_steps, load_nodes
+from .executors import (
+    ASYNC, DEFAULT_CONCURRENCY, EXECUTOR_TYPES, INLINE, PROCESS,
+    TaskExecutor, call_run, call_run_async, call_task, timed_call,
+    timed_call_async
+)
+from .memory import MemoryTracker
+from .metrics import PipelineMetrics
+from .registry import TaskRegistry
+from .journal import Journal
+from .cache import ResultCache, module_version
+from .profiling import PipelineProfiler
+from .retry import SKIP, RetryPolicy
 from .log import get_logger
 
 __author__ = "Daniel Opitz"
@@ -17,18 +39,136 @@ logger = get_logger(__name__)
 
 current_tz = datetime.now().astimezone().tzinfo
 
+# task units are serialized to JSON strings when they are queued and parsed
+# again when they are taken from the queue, bytes are base64 encoded
+JSON = "json"
+# task units are queued as they are and payloads are handed to the next step
+# without being copied. Data only gets serialized (pickled) when it leaves
+# the process, i.e. when the next step runs in a process pool.
+LOCAL = "local"
+TRANSPORTS = (JSON, LOCAL)
+
+BINARY_TYPES = (bytes, bytearray, memoryview)
+
+# the items of a task result that still have to be turned into task units,
+# stream is set if the task returned a generator or another iterator, owner
+# is the token of the queued task unit the result belongs to, source the
+# id of the step that returned it and node the node (phase) of the step
+Expansion = namedtuple(
+    "Expansion",
+    "task next_tasks priority items fused stream owner source node"
+)
+
 
 class Pipeline:
-    def __init__(self, blueprint, variables, working_dir):
+    def __init__(self, blueprint, variables, working_dir, **options):
         self.variables = variables
         self._variables = json.dumps(variables)
         self.working_dir = working_dir
         self._blueprint = json.dumps(blueprint)
         self.blueprint = self.fill_blueprint(blueprint)
+        # phases are nodes that need the phase before
+        self.nodes = load_nodes(self.blueprint)
+        self.needed_by = {node: [] for node in self.nodes}
+        for node, spec in self.nodes.items():
+            for need in spec["needs"]:
+                self.needed_by[need].append(node)
+        # options can be given in the blueprint or as keyword arguments,
+        # keyword arguments take precedence
+        self.options = {**blueprint.get("options", {}), **options}
+
+        self.transport = self.options.get("transport", JSON)
+        if self.transport not in TRANSPORTS:
+            raise ValueError(f"unknown transport {self.transport}")
+
+        self.journal = None
+        # number of results, batches and running fused task units that
+        # still belong to a queued task unit, only tracked with a journal
+        self.holds = {}
+        self.child_counts = {}
+        if self.options.get("journal"):
+            self.journal = Journal(
+                self.options["journal"], self.fingerprint(),
+                self.options.get("journal_compact_bytes"),
+            )
+
+        self.payload_store = None
+        if self.options.get("payload_store") == SPOOL:
+            # with a journal the spool files have to survive a restart
+            self.payload_store = SpoolStore(
+                self.options.get("spool_dir"),
+                self.journal.fingerprint[:16] if self.journal else None,
+            )
+        elif self.options.get("payload_store"):
+            raise ValueError(
+                f"unknown payload store {self.options['payload_store']}"
+            )
+
+        self.metrics = None
+        if self.options.get("metrics") or self.options.get("metrics_file"):
+            self.metrics = PipelineMetrics()
+
+        self.cache = None
+        self.cache_versions = {}
+        if self.options.get("cache"):
+            self.cache = ResultCache(
+                self.options.get("cache_dir"),
+                self.options.get("cache_max_bytes"),
+            )
+
+        self.profiler = None
+        if self.options.get("profile"):
+            self.profiler = PipelineProfiler(
+                self.options["profile"],
+                self.options.get("profile_dir", "profile"),
+                self.options.get("profile_interval"),
+            )
+
+        self.memory = None
+        if self.options.get("memory"):
+            self.memory = MemoryTracker(
+                self.options["memory"],
+                self.options.get("memory_warn_mb"),
+                self.options.get("memory_snapshot_every"),
+            )
 
         self.wq = queue.PriorityQueue()
-        self.running_tasks = set()
-        self.current_phase = 0
+        # tie breaker, task units with the same priority are taken from the
+        # queue in the order they were put in and never compared themselves
+        self.msg_counter = itertools.count()
+        # tokens of the queued and running task units per node
+        self.running_tasks = {}
+        self.started_nodes = set()
+        self.active_nodes = set()
+        self.finished_nodes = set()
+        self.sentinels = {}
+        self.batches = {}
+        # results whose task units have not been created yet, and their
+        # number per node
+        self.expansions = []
+        self.open_expansions = Counter()
+        self.filling = False
+        self.queued_bytes = 0
+        # failed task units waiting for their next attempt, a heap of
+        # (due, counter, task unit)
+        self.delayed = []
+        # semaphores limiting the task units of async steps, per step id
+        self.async_limits = {}
+
+        # resolve and import all task modules before the first task unit
+        self.registry = TaskRegistry(self.profiler)
+        self.registry.preload(self.options.get("preload"))
+        self.registry.load_blueprint(self.blueprint)
+        self.validate_executors()
+
+        self.executor = TaskExecutor(self.options.get("max_workers"))
+        # pools run max_workers task units at a time, async steps as many as
+        # their concurrency allows
+        self.max_in_flight = self.executor.max_workers + sum(
+            self.get_concurrency(step)
+            for step in blueprint_steps(self.blueprint)
+            if self.get_executor_type(step) == ASYNC
+        )
 
     def print(self):
         print("---blueprint---")
@@ -51,15 +191,14 @@ class Pipeline:
             for jvk, jvv in job_vars.items():
                 updated_vars[k] = updated_vars[k].replace(jvk, jvv)
 
-        for phase in blueprint["phases"]:
-            for step in phase:
-                if "params" in step:
-                    for k in step["params"].keys():
-                        for uvk, uvv in updated_vars.items():
-                            if type(step["params"][k]) == str:
-                                step["params"][k] = step["params"][k].replace(
-                                    uvk, uvv
-                                )
+        for step in blueprint_steps(blueprint):
+            if "params" in step:
+                for k in step["params"].keys():
+                    for uvk, uvv in updated_vars.items():
+                        if type(step["params"][k]) == str:
+                            step["params"][k] = step["params"][k].replace(
+                                uvk, uvv
+                            )
 
         return blueprint
 
@@ -72,42 +211,264 @@ class Pipeline:
         vars["$LAST_SUCCESSFUL_RUN"] = ""
         return vars
 
-    def is_completed(self):
-        if len(self.running_tasks) > 0:
-            return False
-
-        if self.current_phase + 1 == len(self.blueprint["phases"]):
-            return True
+    def fingerprint(self):
+        return hashlib.sha256(
+            "\n".join(
+                [self._blueprint, self._variables, str(self.working_dir)]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def get_executor_type(self, task):
+        if task["id"] == BATCH:
+            return INLINE
+        if "executor" in task:
+            return task["executor"]
+        if self.registry.is_async(task["id"]):
+            return ASYNC
+        return self.options.get("executor", INLINE)
+
+    def get_concurrency(self, task):
+        return task.get(
+            "concurrency",
+            self.options.get("async_concurrency", DEFAULT_CONCURRENCY),
+        )
 
-        self.current_phase += 1
-        self.start_current_phase()
-        return False
+    def validate_executors(self):
+        for step in blueprint_steps(self.blueprint):
+            executor_type = self.get_executor_type(step)
+            if executor_type not in EXECUTOR_TYPES:
+                raise ValueError(
+                    f"unknown executor {executor_type} for {step['id']}"
+                )
+            if executor_type == ASYNC and not self.registry.is_async(
+                step["id"]
+            ):
+                raise ValueError(f"{step['id']} has no async run method")
+            if executor_type in (PROCESS, ASYNC) and self.profiler:
+                logger.warning(
+                    f"{step['id']} runs in the {executor_type} executor "
+                    "and is not profiled"
+                )
+            if executor_type in (PROCESS, ASYNC) and self.memory:
+                logger.warning(
+                    f"{step['id']} runs in the {executor_type} executor "
+                    "and its memory is not measured"
+                )
+            if "retry" in step:
+                RetryPolicy(step["retry"])
 
-    def start_current_phase(self):
-        current_phase = self.blueprint["phases"][self.current_phase]
-        first_task = current_phase[0]
+    def is_completed(self):
+        """
+        Finishes the nodes that have nothing left to do and starts the nodes
+        whose needs are all finished. Returns True once every node is
+        finished.
+        """
+        finished = []
+        for node in list(self.active_nodes):
+            if self.running_tasks.get(node) or self.open_expansions[node]:
+                continue
+            # the node is done, hand on what is left in its batches
+            if self.flush_batches(node):
+                continue
+            self.finish_node(node)
+            finished.append(node)
+        for node in finished:
+            self.start_ready_nodes(self.needed_by[node])
+        return len(self.finished_nodes) == len(self.nodes)
+
+    def start_ready_nodes(self, nodes=None):
+        for node in self.nodes if nodes is None else nodes:
+            if node not in self.started_nodes and all(
+                need in self.finished_nodes
+                for need in self.nodes[node]["needs"]
+            ):
+                self.start_node(node)
+
+    def start_node(self, node):
+        steps = self.nodes[node]["steps"]
+        # the node gets the sentinel of the first of its needs that has one
+        for need in self.nodes[node]["needs"]:
+            if self.sentinels.get(need) is not None:
+                self.sentinels[node] = self.sentinels[need]
+                break
         task_unit = {
-            "task": first_task,
-            "next_tasks": current_phase[1:],
+            "task": steps[0],
+            "next_tasks": steps[1:],
             "task_token": nanoid.generate(),
             "priority": 10,
+            "node": node,
         }
-        self.running_tasks.add(task_unit["task_token"])
-        self.queue_msg(task_unit)
+        logger.debug(f"starting node {node}")
+        self.started_nodes.add(node)
+        self.active_nodes.add(node)
+        self.add_running(task_unit)
+        if self.journal:
+            self.journal.started_node(node, task_unit)
+        self.queue_msg(task_unit, journal=False)
+
+    def finish_node(self, node):
+        logger.debug(f"finished node {node}")
+        self.active_nodes.remove(node)
+        self.finished_nodes.add(node)
+        self.running_tasks.pop(node, None)
+        self.open_expansions.pop(node, None)
+        if self.journal:
+            self.journal.finished_node(node)
+
+    def add_running(self, task_unit):
+        self.running_tasks.setdefault(task_unit["node"], set()).add(
+            task_unit["task_token"]
+        )
+
+    def remove_running(self, task_unit):
+        self.running_tasks[task_unit["node"]].remove(task_unit["task_token"])
+
+    def resume(self):
+        if not self.journal.load():
+            self.journal.open(resume=False)
+            return False
+
+        self.journal.open(resume=True)
+        self.started_nodes = set(self.journal.started)
+        self.finished_nodes = set(self.journal.finished)
+        self.active_nodes = self.started_nodes - self.finished_nodes
+        self.sentinels = dict(self.journal.sentinels)
+        pending = self.journal.pending()
+        logger.info(
+            f"resuming nodes {sorted(map(str, self.active_nodes))} with "
+            f"{len(pending)} task units"
+        )
+        for task_unit in pending:
+            task_unit["data"] = self.encode_data(task_unit.get("data"))
+            self.add_running(task_unit)
+            self.queue_msg(task_unit, journal=False)
+        return True
+
+    def owner_of(self, msg):
+        return msg["task_token"] or msg.get("owner")
+
+    def hold(self, owner):
+        if self.journal:
+            self.holds[owner] = self.holds.get(owner, 0) + 1
+
+    def release(self, owner):
+        if not self.journal:
+            return
+        self.holds[owner] -= 1
+        if self.holds[owner] == 0:
+            del self.holds[owner]
+            self.child_counts.pop(owner, None)
+            self.journal.done(owner)
+
+    def child_token(self, owner):
+        # tokens are derived from the parent, so a task unit that is run
+        # again after a restart creates the same tokens and task units that
+        # are already known can be skipped
+        number = self.child_counts.get(owner, 0)
+        self.child_counts[owner] = number + 1
+        return f"{owner}.{number}"
 
     def process_msg(self, msg):
+        if msg["task"]["id"] == BATCH:
+            self.process_batch(msg)
+            return
+        opts = self.prepare_task(msg)
+        cached = self.cached_result(msg, opts)
+        if cached:
+            self.process_result(msg, *cached)
+            return
+        try:
+            result, timing = timed_call(
+                *self.task_call(msg["task"]["id"], opts)
+            )
+        except Exception as e:
+            self.process_failure(msg, e)
+            return
+        self.process_result(msg, result, timing)
+
+    def submit_task(self, msg, executor_type):
+        opts = self.prepare_task(msg)
+        cached = self.cached_result(msg, opts)
+        if cached:
+            future = Future()
+            future.set_result(cached)
+            return future
+        step_id = msg["task"]["id"]
+        if executor_type == ASYNC:
+            return self.executor.submit(
+                executor_type, timed_call_async, self.async_limit(msg["task"]),
+                call_run_async, self.registry.get(step_id), opts
+            )
+        if executor_type == PROCESS:
+            # functions can't be sent to another process, the worker
+            # process imports the module itself
+            return self.executor.submit(
+                executor_type, timed_call, call_task,
+                self.registry.module_name(step_id), opts
+            )
+        return self.executor.submit(
+            executor_type, timed_call, *self.task_call(step_id, opts)
+        )
+
+    def async_limit(self, task):
+        if task["id"] not in self.async_limits:
+            self.async_limits[task["id"]] = asyncio.Semaphore(
+                self.get_concurrency(task)
+            )
+        return self.async_limits[task["id"]]
+
+    def is_cacheable(self, task):
+        if "cache" in task:
+            return bool(task["cache"])
+        return bool(self.registry.attribute(task["id"], "CACHEABLE"))
+
+    def cached_result(self, msg, opts):
+        """
+        Looks up the result of a task unit in the result cache. Returns the
+        result and its timing on a hit, on a miss the cache key is stored in
+        the task unit so the result can be cached when it arrives.
+        """
+        if not self.cache or not self.is_cacheable(msg["task"]):
+            return None
+        step_id = msg["task"]["id"]
+        if step_id not in self.cache_versions:
+            self.cache_versions[step_id] = module_version(
+                self.registry.loaded[step_id]
+            )
+        try:
+            key = self.cache.key(
+                step_id, opts, self.registry.attribute(step_id, "cache_key"),
+                self.cache_versions[step_id],
+            )
+        except Exception as e:
+            # the task is called without the cache, its errors are handled
+            # by the failure policy of the step
+            logger.warning(f"no cache key for {step_id}: {e!r}")
+            return None
+        result = self.cache.get(key)
+        if self.metrics:
+            self.metrics.record_cache(step_id, result is not None)
+        if result is None:
+            msg["cache_key"] = key
+            return None
+        return result, (time.time(), 0, 0)
+
+    def task_call(self, step_id, opts):
+        run = self.registry.get(step_id)
+        call = (call_run, run, opts)
+        if self.profiler:
+            call = (self.profiler.call, step_id) + call
+        if self.memory:
+            call = (self.memory.call, step_id) + call
+        return call
+
+    def prepare_task(self, msg):
         module_name = msg["task"]["id"]
         logger.debug(f"in task with id {module_name}")
         print(module_name)
-        if not is_module_available(module_name):
-            raise ValueError(f"module {module_name} is not available")
 
-        module = import_module(module_name)
         params = msg["task"].get("params")
-        data = msg.get("data")
-        if type(data) == dict:
-            if "enc" in data and "raw" in data:
-                data = base64.b64decode(data["raw"])
+        data = self.decode_data(msg.get("data"))
 
         opts = {}
         if params:
@@ -116,13 +477,29 @@ class Pipeline:
         if data:
             opts["data"] = data
 
-        if msg["task"].get("passSentinel") and self.sentinel:
-            opts["data"] = self.sentinel
+        sentinel = self.sentinels.get(msg["node"])
+        if msg["task"].get("passSentinel") and sentinel:
+            opts["data"] = sentinel
 
-        result = module.run(opts)
+        return opts
+
+    def process_result(self, msg, result, timing):
+        module_name = msg["task"]["id"]
         if not result:
             raise ValueError(f"Got no Result from {module_name}!")
 
+        if self.metrics:
+            self.metrics.record_call(
+                module_name, timing, msg.get("queued_at"),
+                payload_size(msg.get("data")), result
+            )
+
+        if msg.get("cache_key"):
+            self.cache.put(msg.pop("cache_key"), result)
+
+        owner = self.owner_of(msg)
+        self.hold(owner)
+
         next_step = (
             msg["next_tasks"][0]
             if "next_tasks" in msg
@@ -152,112 +529,442 @@ class Pipeline:
             msg["priority"] - 1 if msg["priority"] > 0 else msg["priority"]
         )
 
-        new_tasks = []
-
-        if next_step:
-            if type(result.data) == Partial:
-                for r in result.data.partial:
-                    if type(r) == bytes:
-                        r = {
-                            "enc": "b64",
-                            "raw": base64.b64encode(r).decode("utf-8"),
-                        }
-                    task_token = nanoid.generate()
-                    self.running_tasks.add(task_token)
-                    self.queue_msg(
-                        {
-                            "task": next_step,
-                            "next_tasks": further_steps,
-                            "task_token": task_token,
-                            "priority": priority,
-                            "data": r,
-                        }
-                    )
+        expansions = []
+        node = msg["node"]
+        if next_step and type(result.data) == Partial:
+            expansions.append(
+                self.new_expansion(
+                    next_step, further_steps, priority, result.data.partial,
+                    owner, module_name, node
+                )
+            )
+        elif next_step and result.data:
+            expansions.append(
+                self.new_expansion(
+                    next_step, further_steps, priority, items(result.data),
+                    owner, module_name, node
+                )
+            )
+        elif isinstance(items(result.data), Iterator):
+            # nothing consumes the items, run the generator to its end anyway
+            deque(items(result.data), maxlen=0)
+
+        if skip_step and result.skip:
+            expansions.append(
+                self.new_expansion(
+                    skip_step, further_skip_steps, priority,
+                    items(result.skip), owner, module_name, node
+                )
+            )
 
-            elif result.data:
-                rd = []
-                if type(result.data) == Many:
-                    rd += result.data.items
-                else:
-                    rd.append(result.data)
-                for r in rd:
-                    if type(r) == bytes:
-                        r = {
-                            "enc": "b64",
-                            "raw": base64.b64encode(r).decode("utf-8"),
-                        }
-                    task_token = nanoid.generate()
-                    new_tasks.append(
-                        {
-                            "task": next_step,
-                            "next_tasks": further_steps,
-                            "task_token": task_token,
-                            "priority": priority,
-                            "data": r,
-                        }
-                    )
+        if msg["task_token"]:
+            self.remove_running(msg)
+        if result.sentinel:
+            if type(result.sentinel) != list:
+                raise ValueError("Sentinel must be a list!")
+            self.sentinels[node] = result.sentinel[0]
+            if self.journal:
+                self.journal.set_sentinel(node, result.sentinel[0])
+
+        # expansions are taken from the end, the next step comes first
+        self.expansions += reversed(expansions)
+        self.release(owner)
+        self.fill_queue()
+
+    def process_failure(self, msg, error):
+        """
+        Handles an exception raised by a task. Without a retry policy the
+        error is raised again and stops the pipeline. Otherwise the task
+        unit is queued again after a delay, or dropped if on_failure is skip
+        and it can't be retried.
+        """
+        if "retry" not in msg["task"] or not msg["task_token"]:
+            raise error
+        step_id = msg["task"]["id"]
+        policy = RetryPolicy(msg["task"]["retry"])
+        attempt = msg.get("attempt", 1)
+        msg.pop("cache_key", None)
+
+        if policy.should_retry(error, attempt):
+            delay = policy.delay(attempt)
+            logger.warning(
+                f"{step_id} failed (attempt {attempt}): {error!r}, "
+                f"retrying in {delay:.1f} s"
+            )
+            if self.metrics:
+                self.metrics.record_failure(step_id, retried=True)
+            msg["attempt"] = attempt + 1
+            heapq.heappush(
+                self.delayed,
+                (time.monotonic() + delay, next(self.msg_counter), msg),
+            )
+            return
+
+        if policy.on_failure != SKIP:
+            raise error
+        logger.error(
+            f"{step_id} failed after {attempt} attempts, skipping the task "
+            f"unit: {error!r}"
+        )
+        if self.metrics:
+            self.metrics.record_failure(
+                step_id, retried=False,
+                metrics=self.failure_metrics(msg, error),
+            )
+        # the spool file of a retried task unit is kept until here
+        discard(msg.get("data"))
+        self.remove_running(msg)
+        if self.journal:
+            self.journal.done(msg["task_token"])
+
+    def failure_metrics(self, msg, error):
+        """
+        Metrics of a dropped task unit from the failure_metrics(opts, error)
+        function of its task module, if it has one
+        """
+        step_id = msg["task"]["id"]
+        report = self.registry.attribute(step_id, "failure_metrics")
+        if not report:
+            return None
+        opts = {"data": self.decode_data(msg.get("data"))}
+        if msg["task"].get("params"):
+            opts["params"] = msg["task"]["params"]
+        try:
+            return report(opts, error)
+        except Exception as e:
+            logger.warning(f"no failure metrics for {step_id}: {e!r}")
+            return None
+
+    def queue_due_retries(self):
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, msg = heapq.heappop(self.delayed)
+            self.queue_msg(msg)
+
+    def new_expansion(
+        self, task, next_tasks, priority, data, owner, source, node
+    ):
+        self.hold(owner)
+        self.open_expansions[node] += 1
+        return Expansion(
+            task, next_tasks, priority, iter(data), self.is_fused(task),
+            isinstance(data, Iterator), owner, source, node
+        )
 
-        if skip_step:
-            if result.skip:
-                rd = []
-                if type(result.skip) == Many:
-                    rd += result.skip.items
-                else:
-                    rd.append(result.skip)
-                for r in rd:
-                    if type(r) == bytes:
-                        r = {
-                            "enc": "b64",
-                            "raw": base64.b64encode(r).decode("utf-8"),
-                        }
-                    task_token = nanoid.generate()
-                    new_tasks.append(
-                        {
-                            "task": skip_step,
-                            "next_tasks": further_skip_steps,
-                            "task_token": task_token,
-                            "priority": priority,
-                            "data": r,
-                        }
+    def fill_queue(self):
+        # Creates task units for the items of the results in self.expansions
+        # until the queue is full. Fused task units are processed right away,
+        # their results are expanded by this loop as well (depth first)
+        # instead of a nested call.
+        if self.filling:
+            return False
+        self.filling = True
+        filled = False
+        try:
+            while self.expansions:
+                expansion = self.expansions[-1]
+                if not expansion.fused and self.is_queue_full(expansion):
+                    break
+                try:
+                    data = next(expansion.items)
+                except StopIteration:
+                    self.expansions.pop()
+                    self.open_expansions[expansion.node] -= 1
+                    self.release(expansion.owner)
+                    continue
+                task = self.new_task_unit(
+                    expansion.task, expansion.next_tasks, expansion.priority,
+                    data, expansion.node, expansion.owner
+                )
+                if self.journal and self.journal.is_known(task["task_token"]):
+                    # queued again or done before the restart
+                    continue
+                if self.metrics:
+                    self.metrics.record_emit(
+                        expansion.source, payload_size(data)
                     )
+                if task["task_token"]:
+                    self.add_running(task)
+                self.dispatch(task)
+                filled = True
+        finally:
+            self.filling = False
+        return filled
+
+    def is_queue_full(self, expansion):
+        if self.wq.empty():
+            return False
+        # items of generators are only taken when they are needed, so the
+        # next steps can start before the generator is exhausted
+        prefetch = self.options.get(
+            "stream_prefetch", self.executor.max_workers
+        )
+        if expansion.stream and self.wq.qsize() >= prefetch:
+            return True
+        max_items = self.options.get("max_queue_items")
+        if max_items and self.wq.qsize() >= max_items:
+            return True
+        max_bytes = self.options.get("max_queue_bytes")
+        return bool(max_bytes) and self.queued_bytes >= max_bytes
+
+    def process_batch(self, msg):
+        # batches are identified by their node and position in the node
+        key = (msg["node"], len(msg["next_tasks"] or []))
+        if key not in self.batches:
+            self.batches[key] = Batch(
+                msg["task"].get("params"), msg["next_tasks"], msg["priority"]
+            )
+        data = self.decode_data(msg.get("data"))
+        flush = data is not None and self.batches[key].add(data)
+        if self.journal:
+            # done once the batch was handed on
+            owner = self.owner_of(msg)
+            self.hold(owner)
+            self.batches[key].owners.append(owner)
+        if msg["task_token"]:
+            self.remove_running(msg)
+        if flush:
+            self.flush_batch(key)
+        self.fill_queue()
+
+    def flush_batch(self, key):
+        batch = self.batches[key]
+        owners = batch.owners
+        batch.owners = []
+        items = batch.take()
+        flushed = bool(items and batch.next_tasks)
+        if flushed:
+            # with a journal the batch is queued, so it is journaled before
+            # the task units it was collected from are done
+            task = self.new_task_unit(
+                batch.next_tasks[0], batch.next_tasks[1:], batch.priority,
+                items, key[0], fuse=not self.journal
+            )
+            if task["task_token"]:
+                self.add_running(task)
+            if self.metrics:
+                self.metrics.record_emit(BATCH, payload_size(items))
+            self.dispatch(task)
+        for owner in owners:
+            self.release(owner)
+        return flushed
+
+    def flush_batches(self, node=None, due_only=False):
+        flushed = False
+        for key, batch in list(self.batches.items()):
+            if node is not None and key[0] != node:
+                continue
+            if not due_only or batch.is_due():
+                flushed = self.flush_batch(key) or flushed
+        return flushed
+
+    def wait_timeout(self):
+        # seconds until the next batch is due or a retry has to be queued
+        deadlines = [
+            d for d in (b.deadline() for b in self.batches.values()) if d
+        ]
+        if self.delayed:
+            deadlines.append(self.delayed[0][0])
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def is_fused(self, task):
+        # task units of steps with a retry policy are always queued, so
+        # they can be queued again
+        return (
+            self.options.get("fuse", False)
+            and task.get("fuse", True)
+            and "retry" not in task
+            and self.get_executor_type(task) == INLINE
+        )
 
-        for task in new_tasks:
-            self.running_tasks.add(task["task_token"])
+    def new_task_unit(
+        self, task, next_tasks, priority, data, node, owner=None, fuse=True
+    ):
+        task_unit = {
+            "task": task,
+            "next_tasks": next_tasks,
+            "priority": priority,
+            "node": node,
+        }
+        if fuse and self.is_fused(task):
+            # fused task units are run right away and never queued, they
+            # need no token and their data is passed on as it is
+            task_unit["task_token"] = None
+            task_unit["data"] = data
+            if self.journal:
+                task_unit["owner"] = owner
+        else:
+            task_unit["task_token"] = (
+                self.child_token(owner)
+                if self.journal and owner
+                else nanoid.generate()
+            )
+            task_unit["data"] = self.encode_data(data)
+        return task_unit
+
+    def dispatch(self, task_unit):
+        if task_unit["task_token"]:
+            self.queue_msg(task_unit)
+        else:
+            self.process_msg(task_unit)
+
+    def encode_data(self, data):
+        if self.payload_store and type(data) in BINARY_TYPES:
+            return self.payload_store.put(data)
+        if self.transport == JSON and type(data) == bytes:
+            return {
+                "enc": "b64",
+                "raw": base64.b64encode(data).decode("utf-8"),
+            }
+        return data
+
+    def decode_data(self, data):
+        if self.transport == JSON and type(data) == dict:
+            if "enc" in data and "raw" in data:
+                return base64.b64decode(data["raw"])
+        return data
 
-        self.running_tasks.remove(msg["task_token"])
-        if result.sentinel:
-            if type(result.sentinel) != list:
-                raise ValueError("Sentinel must be a list!")
-            self.sentinel = result.sentinel[0]
+    def encode_msg(self, msg):
+        if self.transport == JSON:
+            return json.dumps(
+                msg, ensure_ascii=False, default=ext_json_serializer
+            )
+        return msg
 
-        for task in new_tasks:
-            self.queue_msg(task)
+    def decode_msg(self, msg):
+        if self.transport == JSON:
+            return json.loads(msg)
+        return msg
 
-    def queue_msg(self, msg):
+    def queue_msg(self, msg, journal=True):
         priority = msg["priority"]
-        self.wq.put(
-            (
-                priority,
-                json.dumps(
-                    msg, ensure_ascii=False, default=ext_json_serializer
-                ),
+        if self.metrics:
+            msg["queued_at"] = time.time()
+        encoded = self.encode_msg(msg)
+        if journal and self.journal:
+            self.journal.queued(msg)
+        size = 0
+        if self.options.get("max_queue_bytes"):
+            size = (
+                len(encoded)
+                if type(encoded) == str
+                else payload_size(msg.get("data"))
             )
-        )
+            self.queued_bytes += size
+        self.wq.put((priority, next(self.msg_counter), encoded, size))
+
+    def get_msg(self, block=True, timeout=None):
+        _, _, msg, size = self.wq.get(block, timeout)
+        self.queued_bytes -= size
+        return self.decode_msg(msg)
 
     def run(self):
-        self.start_current_phase()
+        if not self.journal or not self.resume():
+            self.start_ready_nodes()
+        completed = False
+        try:
+            completed = self.run_loop()
+        finally:
+            self.executor.shutdown()
+            if self.profiler:
+                self.profiler.dump()
+            memory = None
+            if self.memory:
+                memory = self.memory.summary()
+                self.memory.stop()
+                logger.info(
+                    f"memory grew by {memory['growth'] / 1024 ** 2:.1f} MB "
+                    f"to {memory['rss_end'] / 1024 ** 2:.1f} MB, peak "
+                    f"{memory['peak_rss'] / 1024 ** 2:.1f} MB"
+                )
+            if self.metrics:
+                self.metrics.finished = time.time()
+                self.metrics.extra["import_times"] = self.registry.import_times
+                if memory:
+                    self.metrics.extra["memory"] = memory
+                if self.options.get("metrics_file"):
+                    self.metrics.dump(self.options["metrics_file"])
+            if self.journal:
+                self.journal.close(completed)
+            if self.payload_store and (completed or not self.journal):
+                self.payload_store.cleanup()
+
+    def run_loop(self):
+        # Only this thread touches the queue and running_tasks, the pools
+        # just call the task modules. Finished futures are handed back
+        # through the completed queue.
+        # There is no polling: nodes are finished as soon as nothing of them
+        # is queued or in flight, and the nodes needing them are started
+        # right away while other nodes keep running.
+        in_flight = {}
+        completed = queue.Queue()
         while True:
             try:
-                msg = self.wq.get(timeout=5)
-                msg = json.loads(msg[1])
-                self.process_msg(msg)
-                self.wq.task_done()
-            except queue.Empty:
+                while True:
+                    try:
+                        future = completed.get_nowait()
+                    except queue.Empty:
+                        break
+                    self.complete_future(future, in_flight)
+                self.queue_due_retries()
                 if self.is_completed():
-                    break
-                continue
+                    return True
+
+                while len(in_flight) < self.max_in_flight:
+                    try:
+                        msg = self.get_msg(block=False)
+                    except queue.Empty:
+                        if self.fill_queue():
+                            continue
+                        break
+                    executor_type = self.get_executor_type(msg["task"])
+                    if executor_type == INLINE:
+                        self.process_msg(msg)
+                        self.wq.task_done()
+                        self.flush_batches(due_only=True)
+                        self.is_completed()
+                        continue
+                    future = self.submit_task(msg, executor_type)
+                    in_flight[future] = msg
+                    future.add_done_callback(completed.put)
+
+                if in_flight:
+                    try:
+                        future = completed.get(timeout=self.wait_timeout())
+                    except queue.Empty:
+                        self.flush_batches(due_only=True)
+                        continue
+                    self.complete_future(future, in_flight)
+                    self.flush_batches(due_only=True)
+                elif self.delayed and self.wq.empty():
+                    # nothing to do until the next retry is due
+                    time.sleep(self.wait_timeout())
+                    self.flush_batches(due_only=True)
             except KeyboardInterrupt:
-                break
+                self.executor.shutdown(wait=False)
+                return False
+
+    def complete_future(self, future, in_flight):
+        msg = in_flight.pop(future)
+        try:
+            result, timing = future.result()
+        except Exception as e:
+            self.process_failure(msg, e)
+        else:
+            self.process_result(msg, result, timing)
+        self.wq.task_done()
+
+
+def items(data):
+    if type(data) == Many:
+        return data.items
+    if type(data) == Partial:
+        return data.partial
+    if isinstance(data, Iterator):
+        return data
+    return [data]
 
 
 def ext_json_serializer(obj):
@@ -0,0 +1,168 @@
+import cProfile
+import pstats
+import re
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+from .log import get_logger
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+logger = get_logger(__name__)
+
+# deterministic, every function call is recorded
+CPROFILE = "cprofile"
+# the stacks of the threads running a task are sampled periodically
+SAMPLING = "sampling"
+PROFILERS = (CPROFILE, SAMPLING)
+
+DEFAULT_INTERVAL = 0.005
+COLLAPSED_FILE = "collapsed.txt"
+
+
+class PipelineProfiler:
+    """
+    Profiles the task calls (and task module imports) of a pipeline per
+    step id.
+
+    With cprofile a <step id>.prof file is written per step id, it can be
+    read with pstats or snakeviz. Only one task call is profiled at a time,
+    calls from a thread pool wait for each other.
+    With sampling a <step id>.collapsed file is written per step id. Both
+    write collapsed.txt with the stacks of all step ids, prefixed with the
+    step id, for flamegraph.pl or speedscope. cProfile doesn't record
+    stacks, so its collapsed.txt is flat: step id;function and the time
+    spent in the function itself in microseconds.
+
+    Methods
+    -------
+    call(step_id, fn, *args)
+        Calls fn and profiles it under step_id
+    dump()
+        Writes the profiles to the profile directory
+    """
+
+    def __init__(self, mode, profile_dir, interval=None):
+        """
+        Parameters
+        ----------
+        mode : str
+            cprofile or sampling
+        profile_dir : str
+            Directory the profiles are written to
+        interval : float, optional
+            Seconds between two samples, defaults to 0.005
+        """
+        if mode not in PROFILERS:
+            raise ValueError(f"unknown profiler {mode}")
+        self.mode = mode
+        self.profile_dir = Path(profile_dir)
+        self.interval = interval or DEFAULT_INTERVAL
+
+        self.profiles = {}
+        self.lock = threading.Lock()
+
+        # thread id -> step id of the task call the thread is running
+        self.active = {}
+        self.samples = Counter()
+        self.sampler = None
+        self.stopped = threading.Event()
+
+    def call(self, step_id, fn, *args):
+        if self.mode == CPROFILE:
+            with self.lock:
+                profile = self.profiles.setdefault(step_id, cProfile.Profile())
+                return profile.runcall(fn, *args)
+
+        if self.sampler is None:
+            self.start_sampler()
+        thread_id = threading.get_ident()
+        self.active[thread_id] = step_id
+        try:
+            return profiled_call(fn, *args)
+        finally:
+            del self.active[thread_id]
+
+    def start_sampler(self):
+        with self.lock:
+            if self.sampler is not None:
+                return
+            self.sampler = threading.Thread(
+                target=self.sample, name="nw-profiler", daemon=True
+            )
+            self.sampler.start()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, step_id in list(self.active.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.samples[(step_id, collapse(frame))] += 1
+
+    def dump(self):
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+
+        lines = []
+        if self.mode == CPROFILE:
+            for step_id, profile in self.profiles.items():
+                profile.dump_stats(self.path(step_id, ".prof"))
+                stats = pstats.Stats(profile).stats
+                for func, (_, _, tottime, _, _) in stats.items():
+                    micros = int(tottime * 1e6)
+                    if micros > 0:
+                        lines.append(f"{step_id};{func_label(func)} {micros}")
+        else:
+            per_step = {}
+            for (step_id, stack), count in self.samples.items():
+                per_step.setdefault(step_id, []).append(f"{stack} {count}")
+                lines.append(f"{step_id};{stack} {count}")
+            for step_id, step_lines in per_step.items():
+                with open(
+                    self.path(step_id, ".collapsed"), "w", encoding="utf8"
+                ) as f:
+                    f.write("\n".join(step_lines) + "\n")
+
+        with open(
+            self.profile_dir / COLLAPSED_FILE, "w", encoding="utf8"
+        ) as f:
+            f.write("\n".join(lines) + "\n" if lines else "")
+        logger.info(f"wrote profiles to {self.profile_dir}")
+
+    def path(self, step_id, suffix):
+        return self.profile_dir / (re.sub(r"[^\w.-]", "_", step_id) + suffix)
+
+
+def profiled_call(fn, *args):
+    # marks the outermost frame that belongs to the task in sampled stacks
+    return fn(*args)
+
+
+def collapse(frame):
+    stack = []
+    while frame is not None and frame.f_code is not profiled_call.__code__:
+        stack.append(frame_label(frame))
+        frame = frame.f_back
+    # flamegraph tools expect the root first and no spaces or semicolons
+    return ";".join(reversed(stack))
+
+
+def frame_label(frame):
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}".replace(" ", "_")
+
+
+def func_label(func):
+    filename, line, name = func
+    if filename == "~":
+        # built-in function, name is e.g. <built-in method time.sleep>
+        return name.replace(" ", "_").replace(";", "_")
+    return f"{Path(filename).stem}:{name}:{line}".replace(" ", "_")
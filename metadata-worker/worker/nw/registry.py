@@ -0,0 +1,119 @@
+import inspect
+import time
+from importlib import import_module
+from .utils import resolve_module
+from .batching import BATCH
+from .dag import blueprint_steps
+from .log import get_logger
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+logger = get_logger(__name__)
+
+
+class TaskRegistry:
+    """
+    Resolves and imports the task modules of a blueprint once and caches
+    their run methods, so task units don't have to look them up again.
+
+    Methods
+    -------
+    load_blueprint(blueprint)
+        Loads every step id of the blueprint, raises a ValueError for steps
+        that can't be resolved or have no run method
+    load(step_id)
+        Loads one step id and returns its run method
+    preload(modules)
+        Imports modules (e.g. heavy dependencies like psycopg2 or httpx)
+        ahead of the first task unit
+    get(step_id)
+        Returns the cached run method of a step id
+    module_name(step_id)
+        Returns the name of the module a step id was resolved to
+    is_async(step_id)
+        True if the run method of a step id is a coroutine function
+    attribute(step_id, name)
+        Returns an attribute of the module of a step id, None if the
+        module doesn't define it
+    """
+
+    def __init__(self, profiler=None):
+        """
+        Parameters
+        ----------
+        profiler : PipelineProfiler, optional
+            Imports are profiled under the step id "import <module>"
+        """
+        self.profiler = profiler
+        self.tasks = {}
+        self.modules = {}
+        self.loaded = {}
+        self.async_steps = {}
+        # seconds it took to import a module, step ids and preloaded modules
+        self.import_times = {}
+
+    def load_blueprint(self, blueprint):
+        for step in blueprint_steps(blueprint):
+            if step["id"] != BATCH:
+                self.load(step["id"])
+
+    def load(self, step_id):
+        if step_id in self.tasks:
+            return self.tasks[step_id]
+
+        module_name = resolve_module(step_id)
+        if not module_name:
+            raise ValueError(f"module {step_id} is not available")
+
+        module = self.import_timed(module_name)
+        run = getattr(module, "run", None)
+        if not callable(run):
+            raise ValueError(f"module {module_name} has no run method")
+
+        self.modules[step_id] = module_name
+        self.loaded[step_id] = module
+        self.tasks[step_id] = run
+        return run
+
+    def preload(self, modules):
+        for module_name in modules or []:
+            self.import_timed(module_name)
+
+    def import_timed(self, module_name):
+        start = time.perf_counter()
+        if self.profiler:
+            module = self.profiler.call(
+                f"import {module_name}", import_module, module_name
+            )
+        else:
+            module = import_module(module_name)
+        self.import_times[module_name] = time.perf_counter() - start
+        logger.debug(
+            f"imported {module_name} in "
+            f"{self.import_times[module_name] * 1000:.1f} ms"
+        )
+        return module
+
+    def get(self, step_id):
+        return self.tasks.get(step_id) or self.load(step_id)
+
+    def module_name(self, step_id):
+        if step_id not in self.modules:
+            self.load(step_id)
+        return self.modules[step_id]
+
+    def attribute(self, step_id, name):
+        if step_id not in self.loaded:
+            self.load(step_id)
+        return getattr(self.loaded[step_id], name, None)
+
+    def is_async(self, step_id):
+        if step_id not in self.async_steps:
+            self.async_steps[step_id] = inspect.iscoroutinefunction(
+                self.get(step_id)
+            )
+        return self.async_steps[step_id]
@@ -0,0 +1,75 @@
+import random
+
+__author__ = "Daniel Opitz"
+__copyright__ = "Copyright 2022, SuUB"
+__license__ = "GPL"
+__maintainer__ = "Marie-Saphira Flug"
+
+
+# what happens to a task unit that failed and is not retried
+FAIL = "fail"
+SKIP = "skip"
+ON_FAILURE = (FAIL, SKIP)
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+DEFAULT_JITTER = 0.5
+
+
+class RetryPolicy:
+    """
+    Retry policy of a step, given as "retry" in the blueprint:
+
+    - max_attempts: int, number of calls including the first one, default 3
+    - backoff: float, seconds to wait before the first retry, doubled for
+      every further retry, default 1
+    - max_backoff: float, upper limit of the delay, default 60
+    - jitter: float between 0 and 1, the delay is reduced by a random part
+      of up to this fraction, so retries of many task units spread out,
+      default 0.5
+    - retry_on: list of exception names, e.g. "OperationalError" or
+      "psycopg2.OperationalError", subclasses match as well, default
+      ["Exception"]
+    - on_failure: "fail" (default) stops the pipeline with the last error,
+      "skip" logs the error and drops the task unit
+
+    Methods
+    -------
+    should_retry(error, attempt)
+        True if the task unit should be run again after the given attempt
+        failed with error
+    delay(attempt)
+        Seconds to wait before the next attempt
+    """
+
+    def __init__(self, params):
+        params = params or {}
+        self.max_attempts = params.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
+        self.backoff = params.get("backoff", DEFAULT_BACKOFF)
+        self.max_backoff = params.get("max_backoff", DEFAULT_MAX_BACKOFF)
+        self.jitter = params.get("jitter", DEFAULT_JITTER)
+        self.retry_on = params.get("retry_on", ["Exception"])
+        self.on_failure = params.get("on_failure", FAIL)
+
+        if self.on_failure not in ON_FAILURE:
+            raise ValueError(f"unknown on_failure {self.on_failure}")
+        if not 0 <= self.jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+        if type(self.retry_on) == str:
+            self.retry_on = [self.retry_on]
+
+    def should_retry(self, error, attempt):
+        return attempt < self.max_attempts and matches(error, self.retry_on)
+
+    def delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+def matches(error, names):
+    for cls in type(error).__mro__:
+        qualified = f"{cls.__module__}.{cls.__name__}"
+        if cls.__name__ in names or qualified in names:
+            return True
+    return False
@@ -1,3 +1,4 @@
+import json
 from collections import namedtuple
 from dataclasses import dataclass
 from importlib.util import find_spec
@@ -56,6 +57,19 @@ def resolve_module(module):
     return f"pipelines.{module}" if spec else None
 
 
+def payload_size(data):
+    """
+    Approximate size of task data in bytes
+    """
+    if data is None:
+        return 0
+    if type(data) == str:
+        return len(data)
+    if type(data) in (bytes, bytearray, memoryview):
+        return memoryview(data).nbytes
+    return len(json.dumps(data, ensure_ascii=False, default=str))
+
+
 def split(a, n):
     k, m = divmod(len(a), n)
     return (
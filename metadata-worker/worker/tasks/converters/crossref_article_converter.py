@@ -25,6 +25,17 @@ logger = get_logger(__name__)
 
 ORCID_RE = re.compile(r"(\d{4}-\d{4}-\d{4}-(\d{3}X|\d{3}x|\d{4}))")
 
+# results can be taken from the result cache of the pipeline
+CACHEABLE = True
+
+
+def cache_key(opts):
+    """
+    The open access status depends on the current date (licenses starting
+    in the future), cached results are only used on the same day.
+    """
+    return [datetime.now().date().isoformat(), opts.get("data")]
+
 
 def run(opts):
     """
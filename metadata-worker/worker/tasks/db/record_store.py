@@ -16,6 +16,16 @@ dict for each record in the field 'data'
 }
 example for DB_CON:
     "DB_CON": "postgresql://nw:nw@nightwatch-db:5432/nw"
+
+Failed inserts raise an exception, add a "retry" policy to the step to retry
+them. The records of a task unit that is skipped are counted as "failed" in
+the metrics of the step, e.g.:
+    "retry": {
+        "max_attempts": 5,
+        "backoff": 30,
+        "retry_on": ["psycopg2.OperationalError"],
+        "on_failure": "skip"
+    }
 ======================================================
 """
 
@@ -23,7 +33,6 @@ import psycopg2
 from psycopg2.sql import Identifier, SQL
 from psycopg2.extras import DictCursor, Json, execute_values
 from datetime import datetime
-import time
 from worker.nw.utils import Result
 from worker.nw.log import get_logger
 
@@ -83,12 +92,23 @@ def run(opts) -> Result:
     db, table = get_params(opts.get("params"))
 
     con = psycopg2.connect(db, cursor_factory=DictCursor)
-    metrics = insert(opts["data"], con, table)
-    con.close()
+    try:
+        metrics = insert(opts["data"], con, table)
+    finally:
+        con.close()
 
     return Result(metrics=metrics)
 
 
+def failure_metrics(opts, error) -> dict:
+    """
+    Metrics of a task unit that was dropped after its insert failed, called
+    by the pipeline when the retry policy of the step skips the task unit
+    """
+    records = opts.get("data") or []
+    return {"total": len(records), "new": 0, "failed": len(records)}
+
+
 def get_params(params) -> (str, str):
     """
     Extract parameters from given params dict
@@ -118,12 +138,11 @@ def insert(records, con, table) -> dict:
     inserts = prepare_inserts(records, db_record_map)
 
     logger.debug(f"records to insert: {len(inserts)}")
-    failed = insert_records(inserts, con, table)
+    insert_records(inserts, con, table)
 
     return {
         "total": len(records),
         "new": len(inserts),
-        "failed": failed
     }
 
 
@@ -165,13 +184,11 @@ def prepare_inserts(records, db_record_map) -> list[dict]:
     return inserts
 
 
-def insert_records(records, con, table) -> int:
+def insert_records(records, con, table):
     """
-    Insert records into given db table
-
-    Returns
-    ------
-    Number of failed inserts
+    Insert records into given db table. The transaction is rolled back and
+    the exception raised again if the insert fails, the pipeline retries
+    the task unit according to the retry policy of the step.
     """
     table = Identifier(table)
     query = SQL("INSERT INTO {} ({}) VALUES %s;").format(
@@ -182,24 +199,15 @@ def insert_records(records, con, table) -> int:
     record_tuples = [
         tuple(r[k] for k in RECORDS_TABLE_COLUMNS) for r in records
     ]
-    retries = 0
-    commited = False
-    while not commited:
-        try:
-            cur = con.cursor()
-            execute_values(cur, query, record_tuples)
-            con.commit()
-            commited = True
-        except Exception:
-            con.rollback()
-            retries += 1
-            if retries < 5:
-                time.sleep(30)
-                continue
-            return len(records)
-        finally:
-            cur.close()
-    return 0
+    cur = con.cursor()
+    try:
+        execute_values(cur, query, record_tuples)
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
 
 
 def prepare_for_db(record) -> dict:
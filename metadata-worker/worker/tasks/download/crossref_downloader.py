@@ -7,7 +7,11 @@ Script to start a crossref download.
     "params": {
         "directory": "<DOWNLOAD_DIR>",
         "user_agent": "--email--",
-        "filter_array": [
+        "concurrency": 3,
+        "rate_limit": 10,
+        "watermark_dir": "crossref/watermarks",
+        "compression": "gzip",
+        "filter_list": [
             {
             "issn": "1865-7648",
             "type": "journal-article",
@@ -20,8 +24,10 @@ Script to start a crossref download.
 ======================================================
 """
 
+import json
 import os
-import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from worker.tasks.download import crossref_downloader_util
 from worker.nw.utils import Result
@@ -31,6 +37,29 @@ __maintainer__ = "Lena Klaproth <nightwatch@suub.uni-bremen.de>"
 
 logger = get_logger(__name__)
 
+# params passed on to crossref_downloader_util.run
+DOWNLOAD_OPTIONS = (
+    "compression",
+    "jsonl",
+    "raw",
+    "rows",
+    "adaptive_rows",
+    "min_rows",
+    "max_rows",
+    "target_seconds",
+    "max_retries",
+    "timeout",
+    "base_url",
+)
+
+# filter key set from the watermark of a filter
+WATERMARK_FILTER = "from-index-date"
+
+# date the windows of sharded filters are split by, from-/until-<x>-date
+DEFAULT_SHARD_BY = "update"
+# the date windows of a sharded filter, in the directory of the filter
+SHARDS_FILE = ".shards"
+
 
 def run(opts):
     """
@@ -50,6 +79,60 @@ def run(opts):
         - param user_agent: str, required
             a user_agent containing contact information, should always be given
             in order to be polite and improve crossref performance
+        - param concurrency: int, optional
+            number of filters downloaded at the same time, default 3
+        - param rate_limit: float, optional
+            requests per second of all filters together, default 10, lowered
+            when crossref announces a smaller limit
+        - param watermark_dir: str, optional
+            if given, the latest "indexed" date-time of the records of each
+            filter is saved in this directory after the filter was
+            downloaded, and the next download of the filter only asks for
+            records indexed since that day (from-index-date)
+
+        - param compression: str, optional
+            "gzip" or "zstd" (needs the zstandard package) to write the
+            pages compressed, as .json.gz or .json.zst files
+        - param jsonl: bool, optional
+            if true the pages of a filter are appended to one pages.jsonl
+            file (compressed if compression is given), one response per line
+        - param raw: bool, optional
+            if true the responses are written to disk as they are received,
+            without parsing them, only the total, next cursor, number of
+            items and indexed dates are read from the bytes
+        - param rows: int, optional
+            records per call, crossref returns 20 by default and at most 1000
+        - param adaptive_rows: bool, optional
+            if true large pages are requested, starting with rows (default
+            200). The page size is doubled after calls faster than half of
+            target_seconds (default 5) and halved after slower calls,
+            timeouts and server errors, between min_rows (default 20) and
+            max_rows (default 1000)
+        - param max_retries: int, optional
+            how often a call that timed out or failed with status 429 or 5xx
+            is repeated, default 5 with adaptive_rows, otherwise 0
+        - param timeout: float, optional
+            seconds to wait for a response, default 60
+        - param base_url: str, optional
+            URL of the crossref API, default https://api.crossref.org/, e.g.
+            of a local stand-in for benchmarks
+
+        - param shards: int, optional
+            if larger than 1 every filter is split into this many date
+            windows with about the same number of records, each downloaded
+            with its own cursor in parallel, default 1. The filter needs a
+            from-<shard_by>-date, the windows are sized by counting the
+            records of smaller windows
+        - param shard_by: str, optional
+            the date the windows are split by, e.g. "update", "index" or
+            "deposit", default "update"
+
+        Every filter is downloaded to a directory named by the fingerprint
+        of its values. A download that failed is continued from the last
+        page written when it is started again with the same directory, so
+        the directory should not change between runs (e.g. with the job
+        date). worker.tasks.download.move_complete moves only the filters
+        whose download is complete on to the import.
 
 
         Example filter_list:
@@ -92,7 +175,9 @@ def run(opts):
         - Result
             A nightwatch Result with the parameters:
             - param metrics: dict
-                statistics about successful and unsuccessful downloads
+                statistics about successful and unsuccessful downloads,
+                pages, retries, pages_per_second and records_per_second, in
+                total and per filter in "filters"
             - param logs: list
                 information about unsuccessful downloads (e.g. error messages)
 
@@ -121,50 +206,264 @@ def run(opts):
             logs=["Download skipped, since no user_agent was given. "]
             )
 
-    metrics = {"downloaded_records": 0, "failed_downloads": 0}
+    watermark_dir = opts["params"].get("watermark_dir")
+    if watermark_dir:
+        watermark_dir = str(Path(os.environ["METADATA"]) / Path(watermark_dir))
+
+    concurrency = opts["params"].get("concurrency", 3)
+    # one limiter for all filters, crossref limits the requests per client
+    limiter = crossref_downloader_util.TokenBucket(
+        opts["params"].get(
+            "rate_limit", crossref_downloader_util.DEFAULT_RATE_LIMIT
+        )
+    )
+    settings = {
+        "user_agent": user_agent,
+        "limiter": limiter,
+        **{
+            k: v for k, v in opts["params"].items() if k in DOWNLOAD_OPTIONS
+        },
+    }
+    # unknown compressions fail before anything is downloaded
+    crossref_downloader_util.file_format(settings)
+    sharding = {
+        "shards": opts["params"].get("shards", 1),
+        "shard_by": opts["params"].get("shard_by", DEFAULT_SHARD_BY),
+    }
+
+    metrics = {
+        "downloaded_records": 0,
+        "failed_downloads": 0,
+        "pages": 0,
+        "retries": 0,
+        "filters": {},
+    }
     logs = []
+    started = time.monotonic()
 
-    for filter_dict in filter_list:
-        try:
-            logger.debug(f"Retrieving data for filter values: {filter_dict}")
-            # Start crossref download
-            downloaded = download(filter_dict, download_dir, user_agent)
-        except (ValueError, PermissionError) as e:
-            logger.debug(
-                f"Download failed for: {filter_dict}.  With exception: {e}"
-                )
-            metrics["failed_downloads"] += 1
-            logs.append(
-                f"Download failed for: {filter_dict}.  With exception: {e}"
+    with ThreadPoolExecutor(
+        max_workers=max(1, concurrency),
+        thread_name_prefix="crossref",
+    ) as pool:
+        # the shards of all filters are planned first, then all shards are
+        # downloaded in parallel
+        plans = [
+            pool.submit(
+                plan_filter, filter_dict, download_dir, watermark_dir,
+                settings, **sharding
+            )
+            for filter_dict in filter_list
+        ]
+        downloads = []
+        for plan in plans:
+            shards, error = plan.result()
+            downloads.append((
+                [pool.submit(download_shard, shard, settings)
+                 for shard in shards],
+                error,
+            ))
+        for filter_dict, (futures, error) in zip(filter_list, downloads):
+            results = [future.result() for future in futures]
+            filter_metrics, errors = combine(results, error)
+            key = crossref_downloader_util.create_filter_param(filter_dict)
+            metrics["filters"][key] = filter_metrics
+            metrics["retries"] += filter_metrics.get("retries", 0)
+            if errors:
+                metrics["failed_downloads"] += 1
+                logs += [
+                    f"Download failed for: {filter_dict}.  With exception: "
+                    f"{e}"
+                    for e in errors
+                ]
+                continue
+            metrics["downloaded_records"] += filter_metrics[
+                "downloaded_records"
+            ]
+            metrics["pages"] += filter_metrics["pages"]
+            if watermark_dir and filter_metrics.get("watermark"):
+                save_watermark(
+                    watermark_dir, filter_dict, filter_metrics["watermark"]
                 )
-        else:
-            metrics["downloaded_records"] += downloaded
 
+    metrics.update(rates(metrics, time.monotonic() - started))
     return Result(metrics=metrics, logs=logs)
 
 
-def download(filter_dict, download_dir, user_agent):
-    """Calls crossref_downloader_util's run method with given options
+def rates(metrics, seconds):
+    seconds = max(seconds, 1e-6)
+    return {
+        "pages_per_second": round(metrics.get("pages", 0) / seconds, 3),
+        "records_per_second": round(
+            metrics["downloaded_records"] / seconds, 3
+        ),
+    }
 
-    Parameters
-    ----------
-    param filter_dict: dict, required
-        Dict containing filter key-value pairs for one crossref query
-    param download_dir: str, required
-        Path to the location the query results will be saved to
-    param user_agent: str, optional
-        A string containing contact information for the crossref query,
-        should always be given to be a 'polite' crossref user and
-        recieve a more reliable crossref service
 
-    Returns
-    ------
-    int
-        Returns the result of the crossref_downloader_util's run method,
-        which contains an int indicating how many records have been retrieved
+def plan_filter(
+    filter_dict,
+    download_dir,
+    watermark_dir,
+    settings,
+    shards=1,
+    shard_by=DEFAULT_SHARD_BY,
+):
+    """
+    Returns the shards of a filter, dicts with the filter and download
+    directory of each cursor, and an error message or None.
+
+    The filter gets the from-index-date of its watermark and is downloaded
+    to a directory named by the fingerprint of the resulting filter. With
+    more than one shard the filter is split into date windows with about
+    the same number of records, each downloaded to a subdirectory. The
+    windows are saved in the directory of the filter, so a download that is
+    started again uses the same windows.
+    """
+    query_filter = filter_dict
+    if watermark_dir:
+        watermark = load_watermark(watermark_dir, filter_dict)
+        if watermark:
+            # records indexed on the day of the watermark are downloaded
+            # again, crossref filters by day
+            query_filter = {**filter_dict, WATERMARK_FILTER: watermark[:10]}
+    fingerprint = crossref_downloader_util.filter_fingerprint(query_filter)
+    filter_dir = f"{download_dir}/{fingerprint}"
+    if shards <= 1:
+        return [{"filter": query_filter, "download_dir": filter_dir}], None
+
+    try:
+        windows = load_shards(filter_dir)
+        if windows is None:
+            logger.debug(f"Planning {shards} shards for {query_filter}")
+            windows = crossref_downloader_util.shard_filter(
+                query_filter, shards, shard_by, settings
+            )
+            save_shards(filter_dir, windows)
+    except (ValueError, PermissionError) as e:
+        return [], e
+    return [
+        {"filter": window, "download_dir": shard_dir(filter_dir, i)}
+        for i, window in enumerate(windows)
+    ], None
+
 
+def download_shard(shard, settings):
     """
-    opts = {"filter": filter_dict,
-            "download_dir": f"{download_dir}/{uuid.uuid4()}",
-            "user_agent": user_agent}
-    return crossref_downloader_util.run(opts)
+    Downloads one shard of a filter with crossref_downloader_util's run
+    method and returns its metrics, with the start and end time, and an
+    error or None if the download succeeded
+    """
+    started = time.monotonic()
+    try:
+        logger.debug(f"Retrieving data for filter values: {shard['filter']}")
+        shard_metrics = crossref_downloader_util.run({**settings, **shard})
+        error = None
+    except (ValueError, PermissionError) as e:
+        logger.debug(
+            f"Download failed for: {shard['filter']}.  With exception: {e}"
+        )
+        shard_metrics = {}
+        error = e
+    shard_metrics["started"] = started
+    shard_metrics["finished"] = time.monotonic()
+    return shard_metrics, error
+
+
+def combine(results, error=None):
+    """
+    Adds up the metrics of the shards of a filter and returns them and the
+    errors of the shards
+    """
+    summed = ("downloaded_records", "pages", "resumed_pages", "retries")
+    filter_metrics = {k: 0 for k in summed}
+    errors = [error] if error else []
+    for shard_metrics, shard_error in results:
+        for k in summed:
+            filter_metrics[k] += shard_metrics.get(k, 0)
+        if shard_metrics.get("rows"):
+            filter_metrics["rows"] = shard_metrics["rows"]
+        watermark = shard_metrics.get("watermark")
+        if watermark and watermark > filter_metrics.get("watermark", ""):
+            filter_metrics["watermark"] = watermark
+        if shard_error:
+            errors.append(shard_error)
+    if len(results) > 1:
+        filter_metrics["shards"] = len(results)
+    if errors:
+        filter_metrics["failed_downloads"] = 1
+    seconds = 0
+    if results:
+        seconds = max(m["finished"] for m, _ in results) - min(
+            m["started"] for m, _ in results
+        )
+    filter_metrics["seconds"] = round(seconds, 3)
+    filter_metrics.update(rates(filter_metrics, seconds))
+    return filter_metrics, errors
+
+
+def shard_dir(filter_dir, i):
+    return f"{filter_dir}/shard-{i:03d}"
+
+
+def load_shards(filter_dir):
+    try:
+        with open(Path(filter_dir) / SHARDS_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_complete(filter_dir):
+    """
+    True if the download of a filter directory is complete, for sharded
+    filters every shard has to be complete
+    """
+    if not (Path(filter_dir) / SHARDS_FILE).exists():
+        try:
+            path = Path(filter_dir) / crossref_downloader_util.STATE_FILE
+            with open(path, "r") as f:
+                return json.load(f).get("complete") is True
+        except (OSError, ValueError):
+            return False
+    windows = load_shards(filter_dir)
+    if windows is None:
+        return False
+    return all(
+        is_complete(shard_dir(filter_dir, i)) for i in range(len(windows))
+    )
+
+
+def save_shards(filter_dir, windows):
+    os.makedirs(filter_dir, exist_ok=True)
+    path = Path(filter_dir) / SHARDS_FILE
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(windows, f)
+    os.replace(tmp, path)
+
+
+def watermark_path(watermark_dir, filter_dict):
+    fingerprint = crossref_downloader_util.filter_fingerprint(filter_dict)
+    return Path(watermark_dir) / f"{fingerprint}.json"
+
+
+def load_watermark(watermark_dir, filter_dict):
+    """
+    Returns the latest indexed date-time downloaded for the filter or None
+    """
+    try:
+        with open(watermark_path(watermark_dir, filter_dict), "r") as f:
+            return json.load(f)["indexed"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_watermark(watermark_dir, filter_dict, indexed):
+    previous = load_watermark(watermark_dir, filter_dict)
+    if previous and previous >= indexed:
+        return
+    os.makedirs(watermark_dir, exist_ok=True)
+    path = watermark_path(watermark_dir, filter_dict)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"filter": filter_dict, "indexed": indexed}, f)
+    os.replace(tmp, path)
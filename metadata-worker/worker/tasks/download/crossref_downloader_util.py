@@ -1,7 +1,16 @@
+import hashlib
 import json
 import os
+import re
+import threading
 import time
+from collections import namedtuple
+from datetime import date, timedelta
+from pathlib import Path
 from worker.tasks.utils import httpxClient
+from worker.tasks.utils.compression import (
+    JSON_LINES, SUFFIXES, compression_of, open_file, suffix
+)
 from worker.nw.log import get_logger
 
 __maintainer__ = "Lena Klaproth <nightwatch@suub.uni-bremen.de>"
@@ -10,6 +19,173 @@ logger = get_logger(__name__)
 
 BASE_URL = "https://api.crossref.org/"
 
+# written to the download directory of a filter after every page, not a
+# .json file so it is never imported
+STATE_FILE = ".cursor-state"
+
+# the response body of the raw download path is streamed to this file in the
+# download directory before it is moved to its page file
+RAW_PAGE_FILE = ".page.tmp"
+CHUNK_SIZE = 64 * 1024
+
+# the files written by a download, removed when it starts again from the
+# first page: the numbered pages or the pages.jsonl file in any format, and
+# temporary files
+PAGE_FILE = re.compile(
+    r"^(\d{8}\.json|pages\.jsonl)("
+    + "|".join(re.escape(ext) for ext in SUFFIXES.values())
+    + r")?$|\.tmp$"
+)
+
+# the fields read from the raw bytes of a response, the fields of the
+# message come before and after the items and never appear inside of them
+TOTAL_RESULTS = re.compile(rb'"total-results"\s*:\s*(\d+)')
+NEXT_CURSOR = re.compile(rb'"next-cursor"\s*:\s*"((?:[^"\\]|\\.)*)"')
+ITEMS_PER_PAGE = re.compile(rb'"items-per-page"\s*:\s*(\d+)')
+NO_ITEMS = re.compile(rb'"items"\s*:\s*\[\s*\]')
+# every work has an indexed date, references of a work don't
+INDEXED = re.compile(
+    rb'"indexed"\s*:\s*\{[^{}]*?"date-time"\s*:\s*"([^"]+)"'
+)
+# longer than any match of INDEXED
+OVERLAP = 256
+
+# total, item_count, next_cursor and indexed of a page and either its data
+# or the path of the file its raw bytes were written to
+Page = namedtuple("Page", "total item_count next_cursor indexed data path")
+
+# page sizes of the adaptive rows mode, crossref returns at most 1000 records
+# per call
+MIN_ROWS = 20
+MAX_ROWS = 1000
+START_ROWS = 200
+# calls faster than half of this grow the page size, slower ones shrink it
+TARGET_SECONDS = 5.0
+# successful calls after a failure before larger pages are tried again
+PROBE_AFTER = 20
+# retries of the adaptive rows mode and the longest delay between them
+ADAPTIVE_RETRIES = 5
+MAX_BACKOFF = 60
+
+# the records of a sharded filter are counted in this many windows per shard
+SLICES_PER_SHARD = 4
+
+# requests per second of the polite pool, lowered when crossref announces
+# a smaller limit in the X-Rate-Limit headers
+DEFAULT_RATE_LIMIT = 10
+
+
+class RetryableError(ValueError):
+    """
+    A call failed in a way that may succeed when it is repeated, retry_after
+    are the seconds the server asked to wait
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveRows:
+    """
+    Page size of a cursor download that follows the response times: it is
+    doubled after a call that took less than half of target_seconds, halved
+    after a call that took longer than target_seconds or failed, and always
+    stays between min_rows and max_rows. After a failure the page size is not
+    doubled again until PROBE_AFTER calls succeeded.
+
+    Methods
+    -------
+    succeeded(seconds)
+        Adjusts the page size to the time a call took
+    failed()
+        Halves the page size after a timeout or server error
+    """
+
+    def __init__(
+        self, rows=None, min_rows=None, max_rows=None, target_seconds=None
+    ):
+        self.min_rows = min_rows or MIN_ROWS
+        self.max_rows = min(max_rows or MAX_ROWS, MAX_ROWS)
+        if self.min_rows > self.max_rows:
+            raise ValueError("min_rows must not be larger than max_rows")
+        self.target_seconds = target_seconds or TARGET_SECONDS
+        self.ceiling = self.max_rows
+        self.successes = 0
+        self.rows = self.limit(rows or START_ROWS)
+
+    def limit(self, rows):
+        return max(self.min_rows, min(self.ceiling, int(rows)))
+
+    def succeeded(self, seconds):
+        self.successes += 1
+        if self.successes >= PROBE_AFTER:
+            self.ceiling = self.max_rows
+        if seconds < self.target_seconds / 2:
+            self.rows = self.limit(self.rows * 2)
+        elif seconds > self.target_seconds:
+            self.rows = self.limit(self.rows / 2)
+
+    def failed(self):
+        self.successes = 0
+        self.rows = self.limit(self.rows / 2)
+        self.ceiling = self.rows
+        logger.debug(f"page size lowered to {self.rows}")
+
+
+class TokenBucket:
+    """
+    A token bucket limiting the requests per second of all threads that
+    share it.
+
+    Methods
+    -------
+    acquire()
+        Blocks until a request may be sent
+    update(headers)
+        Lowers the rate to the limit given in the X-Rate-Limit-Limit and
+        X-Rate-Limit-Interval headers of a crossref response
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, headers):
+        try:
+            limit = int(headers["x-rate-limit-limit"])
+            interval = float(
+                headers.get("x-rate-limit-interval", "1s").rstrip("s")
+            )
+        except (KeyError, ValueError):
+            return
+        if limit <= 0 or interval <= 0:
+            return
+        with self.lock:
+            if limit / interval < self.rate:
+                logger.debug(f"rate limit lowered to {limit}/{interval}s")
+                self.rate = limit / interval
+                self.burst = min(self.burst, float(limit))
+
 
 def run(options):
     """
@@ -17,6 +193,15 @@ def run(options):
     downloads the corresponding crossref entries and saves them in json format
     to the specified location.
 
+    After every page the next cursor, the page and record count and the
+    fingerprint of the filter are saved in the download directory. If the
+    download of the same filter to the same directory is started again it
+    continues after the last saved page, a finished download is not repeated.
+    Crossref cursors expire a few minutes after their last use, if the saved
+    cursor is not accepted anymore the download starts from the beginning.
+    The pages written before are removed whenever a download starts from
+    the first page.
+
     Parameters
     ----------
     param options: dict, required
@@ -30,28 +215,386 @@ def run(options):
         - param user_agent: str, optional
             a user_agent containing contact information, should always be
             given in order to improve crossref performance
+        - param limiter: TokenBucket, optional
+            limits the requests per second, shared by concurrent downloads
+        - param compression: str, optional
+            "gzip" or "zstd" to write compressed files (.gz, .zst), zstd
+            needs the zstandard package
+        - param jsonl: bool, optional
+            if true the pages are appended to one pages.jsonl file, one
+            response per line, instead of one file per page
+        - param raw: bool, optional
+            if true the response bodies are streamed to disk without parsing
+            them (see retrieve_raw)
+        - param rows: int, optional
+            records per call, the first page size in adaptive rows mode
+        - param adaptive_rows: bool, optional
+            if true the page size follows the response times (see
+            AdaptiveRows), with min_rows, max_rows and target_seconds
+        - param max_retries: int, optional
+            how often a call that timed out or failed with status 429 or 5xx
+            is repeated, default 5 in adaptive rows mode, otherwise 0
+        - param timeout: float, optional
+            seconds to wait for a response, default 60
+        - param base_url: str, optional
+            URL of the crossref API, default https://api.crossref.org/
 
     Returns
     ------
-    - records_downloaded: int
-        indicating how many records have successfully been downloaded
+    - dict
+        downloaded_records: how many records have successfully been
+        downloaded, pages: the number of pages written, resumed_pages: the
+        number of pages written by an earlier run, retries: the number of
+        repeated calls, watermark: the latest indexed date-time of the
+        downloaded records, rows: the last page size in adaptive rows mode
+
+    """
+    download_dir = options["download_dir"]
+    fingerprint = filter_fingerprint(options.get("filter") or {})
+    state = load_state(download_dir, fingerprint)
+    written_as = state.get("file_format", ".json")
+    if state["pages"] and written_as != file_format(options):
+        logger.warning(
+            f"{download_dir} was written as {written_as}, starting again"
+        )
+        state = new_state(fingerprint)
+    result = {
+        "downloaded_records": 0,
+        "pages": 0,
+        "resumed_pages": state["pages"],
+        "retries": 0,
+    }
+    if state["complete"]:
+        logger.info(f"{download_dir} is complete, nothing to download")
+    elif state["cursor"]:
+        logger.info(f"resuming {download_dir} after page {state['pages']}")
+        try:
+            download_pages(options, state, result)
+        except ValueError as e:
+            if result["pages"]:
+                raise
+            logger.warning(f"can't resume {download_dir}: {e}")
+        if not state["complete"] and not result["pages"]:
+            # the cursor expired
+            state = new_state(fingerprint)
+            result["resumed_pages"] = 0
+    if not state["complete"]:
+        if state["cursor"] is None:
+            # pages of an earlier download, e.g. in another format or with
+            # another page size, would be imported as well
+            clear_pages(download_dir)
+        download_pages(options, state, result)
+    result["watermark"] = state["watermark"]
+    return result
+
 
+def download_pages(options, state, result):
+    """
+    Writes the pages retrieved from the cursor in state to the download
+    directory and updates the state after every page
     """
     download_dir = options["download_dir"]
-    records_downloaded = 0
-    for data in retrieve(**options):
-        json_data, total, item_count, next_cursor = extract_data(data)
-        records_downloaded += item_count
-        if not os.path.exists(download_dir):
-            try:
-                os.makedirs(download_dir, exist_ok=True)
-            except PermissionError:
-                time.sleep(120)
-                os.makedirs(download_dir, exist_ok=True)
-
-        with open(f"{download_dir}/{time.time_ns()//1000000}.json", "w") as f:
-            f.write(json.dumps(data))
-    return records_downloaded
+    resumed = state["cursor"] is not None
+    pages = result["pages"]
+    state["file_format"] = file_format(options)
+    lines_path = f"{download_dir}/pages{state['file_format']}"
+    if options.get("jsonl") and os.path.exists(lines_path):
+        # drop pages appended after the state was saved
+        os.truncate(lines_path, state.get("offset", 0))
+    retrieve_options = {
+        **options,
+        "cursor": state["cursor"] or "*",
+        "done": state["records"],
+        "stats": result,
+    }
+    if options.get("adaptive_rows"):
+        rows = AdaptiveRows(
+            options.get("rows"),
+            options.get("min_rows"),
+            options.get("max_rows"),
+            options.get("target_seconds"),
+        )
+        retrieve_options["rows"] = rows
+        retrieve_options.setdefault("max_retries", ADAPTIVE_RETRIES)
+    if options.get("raw"):
+        make_dir(download_dir)
+        retrieval = retrieve_raw(
+            page_path=f"{download_dir}/{RAW_PAGE_FILE}", **retrieve_options
+        )
+    else:
+        retrieval = (
+            Page(*extract_data(data)[1:], latest_indexed(data), data, None)
+            for data in retrieve(**retrieve_options)
+        )
+    for page in retrieval:
+        make_dir(download_dir)
+        if options.get("jsonl"):
+            write_page(page, lines_path, append=True)
+            state["offset"] = os.path.getsize(lines_path)
+        else:
+            # pages are named by their number, a page fetched again after a
+            # restart replaces the one written before
+            write_page(
+                page,
+                f"{download_dir}/{state['pages']:08d}{state['file_format']}",
+            )
+
+        result["downloaded_records"] += page.item_count
+        result["pages"] += 1
+        state["pages"] += 1
+        state["records"] += page.item_count
+        state["total"] = page.total
+        state["cursor"] = page.next_cursor
+        if page.indexed and page.indexed > (state["watermark"] or ""):
+            state["watermark"] = page.indexed
+        save_state(download_dir, state)
+    if options.get("adaptive_rows"):
+        result["rows"] = rows.rows
+    if resumed and pages == result["pages"] and (
+        state["records"] < (state["total"] or 0)
+    ):
+        # an expired cursor returns no items, the download is not complete
+        return
+    state["complete"] = True
+    # also for filters without records, so the download counts as complete
+    make_dir(download_dir)
+    save_state(download_dir, state)
+
+
+def make_dir(download_dir):
+    if not os.path.exists(download_dir):
+        try:
+            os.makedirs(download_dir, exist_ok=True)
+        except PermissionError:
+            time.sleep(120)
+            os.makedirs(download_dir, exist_ok=True)
+
+
+def clear_pages(download_dir):
+    """
+    Removes the pages and temporary files of an earlier download from
+    download_dir, the state file and subdirectories are kept
+    """
+    if not os.path.isdir(download_dir):
+        return
+    for entry in os.scandir(download_dir):
+        if entry.is_file() and PAGE_FILE.search(entry.name):
+            os.remove(entry.path)
+
+
+def write_page(page, path, append=False):
+    """
+    Writes a page to path, as one line if append is true
+    """
+    if page.data is not None:
+        with open_file(path, "a" if append else "w") as f:
+            f.write(json.dumps(page.data) + ("\n" if append else ""))
+        return
+    if not append and not compression_of(path):
+        os.replace(page.path, path)
+        return
+    with open(page.path, "rb") as src, open_file(
+        path, "ab" if append else "wb"
+    ) as f:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            if append:
+                # JSON strings can't contain raw line breaks, only the
+                # whitespace between tokens is removed
+                chunk = chunk.replace(b"\n", b"").replace(b"\r", b"")
+            f.write(chunk)
+        if append:
+            f.write(b"\n")
+    os.remove(page.path)
+
+
+def file_format(options):
+    """
+    Suffix of the files written with the given options, e.g. ".json.gz"
+    """
+    ext = JSON_LINES if options.get("jsonl") else ".json"
+    return ext + suffix(options.get("compression"))
+
+
+def filter_fingerprint(filter):
+    """
+    Short hash identifying the values of a filter
+    """
+    return hashlib.sha256(
+        json.dumps(filter, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+def new_state(fingerprint):
+    return {
+        "fingerprint": fingerprint,
+        "cursor": None,
+        "pages": 0,
+        "records": 0,
+        "total": None,
+        "watermark": None,
+        "complete": False,
+        "file_format": None,
+        # size of the pages.jsonl file after the last saved page
+        "offset": 0,
+    }
+
+
+def load_state(download_dir, fingerprint):
+    """
+    Returns the saved state of the download in download_dir, or a new state
+    if there is none or it belongs to another filter
+    """
+    try:
+        with open(Path(download_dir) / STATE_FILE, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return new_state(fingerprint)
+    if state.get("fingerprint") != fingerprint:
+        logger.warning(
+            f"{download_dir} was downloaded with another filter, starting "
+            "again"
+        )
+        return new_state(fingerprint)
+    return state
+
+
+def save_state(download_dir, state):
+    path = Path(download_dir) / STATE_FILE
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def latest_indexed(data):
+    """
+    Latest "indexed" date-time of the items of a crossref response
+    """
+    dates = [
+        item.get("indexed", {}).get("date-time")
+        for item in data["message"].get("items", [])
+    ]
+    return max((d for d in dates if d), default=None)
+
+
+def shard_filter(filter, shards, field, options=None):
+    """
+    Splits a filter into up to shards filters for disjoint windows of the
+    from-<field>-date and until-<field>-date, with about the same number of
+    records each. No window is empty, a filter without records is not split.
+
+    The time between the from date of the filter and its until date (or
+    today) is cut into SLICES_PER_SHARD slices per shard, the records of
+    each slice are counted and consecutive slices are joined to windows.
+    The last window has no until date if the filter has none, so records of
+    today are not missed.
+
+    Parameters
+    ----------
+    - param filter: dict, required
+        crossref filter key-value pairs with a from-<field>-date
+    - param shards: int, required
+        the number of windows
+    - param field: str, required
+        the date to split by, e.g. "update", "index", "created"
+    - param options: dict, optional
+        user_agent, limiter and timeout for the count calls
+
+    Returns
+    ------
+    - list[dict]
+        the filters of the windows
+    """
+    options = options or {}
+    from_key = f"from-{field}-date"
+    until_key = f"until-{field}-date"
+    if from_key not in filter:
+        raise ValueError(f"sharding by {field} needs {from_key} in {filter}")
+    start = parse_date(filter[from_key])
+    end = parse_date(filter[until_key], last=True) if (
+        until_key in filter
+    ) else date.today()
+    days = (end - start).days + 1
+    if days < 1:
+        raise ValueError(f"{from_key} is after {until_key} in {filter}")
+
+    slices = min(days, shards * SLICES_PER_SHARD)
+    bounds = [
+        start + timedelta(days=days * i // slices) for i in range(slices + 1)
+    ]
+    counts = [
+        count_results(
+            {**filter, from_key: bounds[i].isoformat(),
+             until_key: (bounds[i + 1] - timedelta(days=1)).isoformat()},
+            **options
+        )
+        for i in range(slices)
+    ]
+    logger.debug(f"records per slice of {filter}: {counts}")
+
+    windows = []
+    target = sum(counts) / shards
+    first = 0
+    total = 0
+    for i, count in enumerate(counts[:-1]):
+        total += count
+        if (
+            total >= target * (len(windows) + 1)
+            and len(windows) < shards - 1
+            # neither this window nor the rest of the filter may be empty
+            and any(counts[first:i + 1])
+            and any(counts[i + 1:])
+        ):
+            windows.append((bounds[first], bounds[i + 1] - timedelta(days=1)))
+            first = i + 1
+    windows.append((bounds[first], None))
+
+    sharded = []
+    for window_start, window_end in windows:
+        window = {**filter, from_key: window_start.isoformat()}
+        if window_end:
+            window[until_key] = window_end.isoformat()
+        elif until_key in filter:
+            window[until_key] = filter[until_key]
+        sharded.append(window)
+    return sharded
+
+
+def parse_date(value, last=False):
+    """
+    Parses a crossref filter date (YYYY, YYYY-MM or YYYY-MM-DD), with last
+    the last day of a year or month is returned instead of the first
+    """
+    parts = [int(p) for p in str(value).split("-")]
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"invalid date {value}")
+    if len(parts) == 3:
+        return date(*parts)
+    if len(parts) == 1:
+        return date(parts[0], 12, 31) if last else date(parts[0], 1, 1)
+    if not last:
+        return date(parts[0], parts[1], 1)
+    following = date(parts[0] + parts[1] // 12, parts[1] % 12 + 1, 1)
+    return following - timedelta(days=1)
+
+
+def count_results(
+    filter, endpoint="works", user_agent="", limiter=None, timeout=60,
+    base_url=BASE_URL, **kwargs
+):
+    """
+    Returns the number of records for the filter, without retrieving them
+    """
+    customClient = httpxClient.httpxClient()
+    try:
+        r = get(
+            customClient, {"user-agent": user_agent}, f"{base_url}{endpoint}",
+            {**construct_params(filter, None, None), "rows": 0}, limiter,
+            timeout
+        )
+    finally:
+        customClient.close()
+    return extract_data(r)[1]
 
 
 def retrieve(
@@ -60,6 +603,12 @@ def retrieve(
     cursor="*",
     rows=None,
     user_agent="",
+    limiter=None,
+    done=0,
+    max_retries=0,
+    timeout=60,
+    stats=None,
+    base_url=BASE_URL,
     **kwargs
 ):
     """
@@ -78,14 +627,27 @@ def retrieve(
         cursor parameter, if a cursor is used it should be "*" on the first
         API call and should be then set to the cursor value of the last
         received result
-    - param rows: int, optional
-        Should not be used! Gives the possibility to retrieve a specified
-        amount of rows per API call, the crossref default value is 20 and
-        crossref advises against changing it
+    - param rows: int or AdaptiveRows, optional
+        number of records per API call, the crossref default value is 20
+        and the maximum 1000. Larger pages need fewer calls but take longer
+        and fail more often, AdaptiveRows adjusts the number to the
+        response times
     - param user_agent: str, optional
         a user_agent containing contact information, should always be given in
         order to improve crossref performance
-
+    - param limiter: TokenBucket, optional
+        waited for before every API call
+    - param done: int, optional
+        number of records retrieved before the given cursor
+    - param max_retries: int, optional
+        how often a call that timed out or failed with status 429 or 5xx is
+        repeated, default 0
+    - param timeout: float, optional
+        seconds to wait for a response, default 60
+    - param stats: dict, optional
+        "retries" is counted up in this dict
+    - param base_url: str, optional
+        URL of the crossref API, ending with "/", e.g. of a local stand-in
 
     Returns
     ------
@@ -100,30 +662,35 @@ def retrieve(
     # There should always be a user-agent when using the crossref api
     headers = {"user-agent": user_agent}
 
-    url = f"{BASE_URL}{endpoint}"
+    url = f"{base_url}{endpoint}"
 
     total_results = 0
-    done = 0
 
-    customClient = httpxClient.httpxClient()
-    r = get(customClient, headers, url, construct_params(filter, cursor, rows))
+    # timeouts are retried here if retries are configured
+    customClient = httpxClient.httpxClient(
+        timeout_retries=0 if max_retries else 3
+    )
+
+    def fetch(cursor, rows):
+        return get(customClient, headers, url,
+                   construct_params(filter, cursor, rows), limiter, timeout)
+
+    r = request_page(fetch, cursor, rows, max_retries, stats)
     data, total, item_count, next_cursor = extract_data(r)
 
     if next_cursor is not None:
         total_results = total
-        done = item_count
+        done += item_count
         cursor = next_cursor
     logger.debug(f"Total item count: {total_results}")
-    if total_results > 0:
+    # an expired cursor returns no items
+    if total_results > 0 and item_count > 0:
         yield data
 
     while done < total_results:
         # slow down retrieval
         # time.sleep(1)
-        r = get(customClient,
-                headers,
-                url,
-                construct_params(filter, cursor, rows))
+        r = request_page(fetch, cursor, rows, max_retries, stats)
         data, total, item_count, next_cursor = extract_data(r)
         if item_count == 0:
             break
@@ -135,7 +702,38 @@ def retrieve(
     customClient.close()
 
 
-def get(customClient, headers, url, url_params):
+def request_page(fetch, cursor, rows, max_retries=0, stats=None):
+    """
+    Calls fetch(cursor, rows) and returns its result. Calls that raised a
+    RetryableError are repeated up to max_retries times, after the time the
+    server asked for or an increasing delay. If rows is AdaptiveRows the
+    page size is taken from it and it is told how long the call took or
+    that it failed.
+    """
+    adaptive = isinstance(rows, AdaptiveRows)
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            page = fetch(cursor, rows.rows if adaptive else rows)
+        except RetryableError as e:
+            if attempt >= max_retries:
+                raise
+            attempt += 1
+            if stats is not None:
+                stats["retries"] = stats.get("retries", 0) + 1
+            if adaptive and e.retry_after is None:
+                rows.failed()
+            delay = e.retry_after or min(MAX_BACKOFF, 2 ** attempt)
+            logger.warning(f"{e}, retrying in {delay} s")
+            time.sleep(delay)
+            continue
+        if adaptive:
+            rows.succeeded(time.monotonic() - started)
+        return page
+
+
+def get(customClient, headers, url, url_params, limiter=None, timeout=60):
     """
     Calls the given url with given headers and retries three times (with an
     increasing time interval between calls) if the call is unsuccessful
@@ -148,35 +746,203 @@ def get(customClient, headers, url, url_params):
         the url
     - param url_params: dict, optional
         contains url parameters (crossref filter values, rows, cursor)
-    - param attempt: int, optional
-        Counter for the number of attempts, defaults to 1
+    - param limiter: TokenBucket, optional
+        waited for before the call and updated with the rate limit headers
+        of the response
+    - param timeout: float, optional
+        seconds to wait for the response, default 60
 
     Returns
     ------
     - HTTP response
         the response of the call
+
+    Raises a RetryableError if the call failed or timed out or the status
+    is 429 or 5xx, and a ValueError for other failures
     """
 
+    if limiter:
+        limiter.acquire()
     try:
         r = customClient.get(url,
                              headers=headers,
                              params=url_params,
-                             timeout=60)
+                             timeout=timeout)
     except Exception as e:
-        raise ValueError(f"Request Error for {url}: {e}")
+        raise RetryableError(f"Request Error for {url}: {e}")
+    if limiter:
+        limiter.update(r.headers)
+    check_status(customClient, r)
+    try:
+        return r.json()
+    except ValueError:
+        raise ValueError(
+            f"Response body is not JSON for {r.url}: {r.text}"
+            )
+
+
+def check_status(customClient, r):
+    """
+    Raises an error for a response without status OK, the body has to be
+    read already
+    """
     if customClient.checkStatusCodeOK(r.status_code):
-        try:
-            return r.json()
-        except ValueError:
-            raise ValueError(
-                f"Response body is not JSON for {r.url}: {r.text}"
-                )
+        return
+    if r.status_code == 429:
+        raise RetryableError(
+            f"Too many requests for {r.url}",
+            retry_after=retry_after(r.headers),
+        )
     elif 400 <= r.status_code < 500:
         raise ValueError(
             f"Bad status code for {r.url}: {r.status_code}: {r.text}"
             )
     else:
-        raise ValueError(f"Server error for url: {r.url}")
+        raise RetryableError(f"Server error for url: {r.url}")
+
+
+def retry_after(headers):
+    try:
+        return max(1, int(headers["retry-after"]))
+    except (KeyError, ValueError):
+        return None
+
+
+def retrieve_raw(
+    page_path,
+    endpoint="works",
+    filter=None,
+    cursor="*",
+    rows=None,
+    user_agent="",
+    limiter=None,
+    done=0,
+    max_retries=0,
+    timeout=60,
+    stats=None,
+    base_url=BASE_URL,
+    **kwargs
+):
+    """
+    Like retrieve, but the body of every response is streamed to page_path
+    as it is received, without parsing it. Only the total results, next
+    cursor, number of items and latest indexed date-time are read from the
+    bytes. Yields a Page for every response with items, the next request is
+    sent when the page file was moved away.
+
+    Parameters
+    ----------
+    - param page_path: str, required
+        file the response body is written to
+    - further parameters like retrieve
+
+    Returns
+    ------
+    - Generator:
+        yields a Page with the path of the response
+    """
+    if filter is None:
+        filter = {}
+    headers = {"user-agent": user_agent}
+    url = f"{base_url}{endpoint}"
+
+    customClient = httpxClient.httpxClient()
+
+    def fetch(cursor, rows):
+        return stream_page(
+            customClient, headers, url, construct_params(filter, cursor, rows),
+            limiter, page_path, done, timeout
+        )
+
+    try:
+        total_results = None
+        while total_results is None or done < total_results:
+            page = request_page(fetch, cursor, rows, max_retries, stats)
+            if total_results is None:
+                logger.debug(f"Total item count: {page.total}")
+            total_results = page.total
+            if page.item_count == 0 or page.next_cursor is None:
+                # an expired cursor returns no items
+                os.remove(page_path)
+                break
+            done += page.item_count
+            cursor = page.next_cursor
+            logger.debug(f"Items retrieved: {done}")
+            yield page
+    finally:
+        customClient.close()
+
+
+def stream_page(
+    customClient, headers, url, url_params, limiter, page_path, done=0,
+    timeout=60
+):
+    """
+    Writes the body of the response to page_path in chunks and returns a
+    Page with the fields read from the bytes. Raises errors like get.
+
+    The number of items is the number of "indexed" dates, if there are none
+    (e.g. for other endpoints) it is items-per-page, or less on the last
+    page.
+    """
+    if limiter:
+        limiter.acquire()
+    try:
+        with customClient.stream(
+            "GET", url, headers=headers, params=url_params, timeout=timeout
+        ) as r:
+            if limiter:
+                limiter.update(r.headers)
+            if not customClient.checkStatusCodeOK(r.status_code):
+                r.read()
+                check_status(customClient, r)
+            head = b""
+            tail = b""
+            overlap = b""
+            indexed = None
+            indexed_count = 0
+            with open(page_path, "wb") as f:
+                for chunk in r.iter_bytes(CHUNK_SIZE):
+                    f.write(chunk)
+                    buffer = overlap + chunk
+                    for match in INDEXED.finditer(buffer):
+                        # matches within the overlap were counted before
+                        if match.end() > len(overlap):
+                            indexed_count += 1
+                            date = match.group(1).decode("utf-8")
+                            if not indexed or date > indexed:
+                                indexed = date
+                    overlap = buffer[-OVERLAP:]
+                    if len(head) < CHUNK_SIZE:
+                        head += chunk[:CHUNK_SIZE - len(head)]
+                    tail = (tail + chunk)[-CHUNK_SIZE:]
+    except ValueError:
+        raise
+    except Exception as e:
+        raise RetryableError(f"Request Error for {url}: {e}")
+
+    total = find_field(TOTAL_RESULTS, head, tail)
+    if total is None:
+        raise ValueError(f"Response is no crossref item list for {url}")
+    total = int(total)
+    next_cursor = find_field(NEXT_CURSOR, head, tail)
+    if next_cursor is not None:
+        next_cursor = json.loads(b'"' + next_cursor + b'"')
+
+    if indexed_count:
+        item_count = indexed_count
+    elif NO_ITEMS.search(head) or NO_ITEMS.search(tail):
+        item_count = 0
+    else:
+        item_count = int(find_field(ITEMS_PER_PAGE, head, tail) or 0)
+        if 0 < total - done < item_count:
+            item_count = total - done
+    return Page(total, item_count, next_cursor, indexed, None, page_path)
+
+
+def find_field(pattern, head, tail):
+    match = pattern.search(head) or pattern.search(tail)
+    return match.group(1) if match else None
 
 
 def construct_params(filter, cursor, rows):
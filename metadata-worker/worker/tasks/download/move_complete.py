@@ -0,0 +1,90 @@
+"""
+Script to move the completely downloaded filters of the crossref downloader
+to another location.
+
+The crossref downloader writes every filter to a directory of its own in
+the download directory. Only the filter directories whose download is
+complete (every shard of sharded filters) are moved, the others stay in the
+download directory and are continued by the next download.
+
+================== Nightwatch usage ==================
+[
+    {
+        "id": "worker.tasks.download.move_complete",
+        "name": "Move downloaded files to import",
+        "params": {
+            "dst": "<IMPORT_DIR>",
+            "src": "<DOWNLOAD_DIR>"
+      }
+    }
+]
+
+======================================================
+"""
+
+import os
+import shutil
+from pathlib import Path
+from worker.tasks.download.crossref_downloader import is_complete
+from worker.nw.utils import Result
+
+__maintainer__ = "Lena Klaproth <nightwatch@suub.uni-bremen.de>"
+
+
+def run(opts):
+    """
+    This method moves the complete filter directories of a download
+    directory to another location.
+
+    Parameters
+    ----------
+    param opts: dict, required
+        Contains parameters given in the blueprint of the pipeline
+        Parameter keys in opts["params"]:
+        - param src: str, required
+            the download directory of the crossref downloader
+        - param dst: str, required
+            the directory the complete filter directories are moved to, it
+            is created if a filter is moved
+
+    Returns
+    ------
+    - Result:
+        A nightwatch result containing:
+        - metrics: dict
+            moved: the number of filter directories moved, incomplete: the
+            number of filter directories left in the download directory
+        - logs: list[str]
+            the moved and incomplete filter directories
+
+    """
+    src = Path(os.environ["METADATA"]) / Path(opts["params"]["src"])
+    dst = Path(os.environ["METADATA"]) / Path(opts["params"]["dst"])
+    logs = []
+    metrics = {"moved": 0, "incomplete": 0}
+    if not src.is_dir():
+        return Result(
+            logs=[f"nothing was moved, {src} does not exist"], metrics=metrics
+        )
+
+    for filter_dir in sorted(p for p in src.iterdir() if p.is_dir()):
+        if not is_complete(filter_dir):
+            metrics["incomplete"] += 1
+            logs.append(f"{filter_dir} is not complete, it was not moved")
+            continue
+        target = free_path(dst / filter_dir.name)
+        dst.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(filter_dir), str(target))
+        metrics["moved"] += 1
+        logs.append(f"moved {filter_dir} to {target}")
+    return Result(logs=logs, metrics=metrics)
+
+
+def free_path(path):
+    # the same filter can be downloaded twice before it is imported
+    number = 1
+    candidate = path
+    while candidate.exists():
+        candidate = path.with_name(f"{path.name}.{number}")
+        number += 1
+    return candidate
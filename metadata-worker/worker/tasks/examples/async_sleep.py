@@ -0,0 +1,15 @@
+import asyncio
+from worker.nw.log import get_logger
+from worker.nw.utils import Result
+
+logger = get_logger(__name__)
+
+
+async def run(args):
+    """
+    Like sleep, but awaits asyncio.sleep, so many task units of this step
+    wait at the same time on the event loop of the pipeline
+    """
+    seconds = args["params"].get("duration")
+    await asyncio.sleep(seconds)
+    return Result(data=args.get("data"), metrics={"slept": 1})
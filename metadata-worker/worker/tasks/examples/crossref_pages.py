@@ -0,0 +1,60 @@
+import json
+from worker.nw.log import get_logger
+from worker.nw.utils import Result, Many
+
+logger = get_logger(__name__)
+logger.setLevel("DEBUG")
+
+
+def run(args):
+    pages = args["params"].get("pages", 1)
+    items = args["params"].get("items", 20)
+    logger.debug(f"Creating {pages} crossref pages with {items} items each")
+    return Result(
+        data=Many([page(p, items) for p in range(pages)]),
+        metrics={"pages": pages, "records": pages * items},
+    )
+
+
+def page(page_number, items):
+    """
+    A crossref works response as it would be read from a downloaded file,
+    as a json string
+    """
+    return json.dumps({
+        "status": "ok",
+        "message-type": "work-list",
+        "message": {
+            "next-cursor": f"cursor-{page_number + 1}",
+            "total-results": items,
+            "items": [record(page_number, i) for i in range(items)],
+            "items-per-page": items,
+        },
+    })
+
+
+def record(page_number, i):
+    doi = f"10.5555/example.{page_number}.{i}"
+    return {
+        "DOI": doi,
+        "URL": f"https://doi.org/{doi}",
+        "type": "journal-article",
+        "title": [f"Synthetic article {i} on page {page_number}"],
+        "subtitle": ["A record for load tests"],
+        "ISSN": ["1865-7648"],
+        "author": [
+            {
+                "given": f"Given{a}",
+                "family": f"Family{a}",
+                "sequence": "first" if a == 0 else "additional",
+                "affiliation": [{"name": "SuUB Bremen"}],
+            }
+            for a in range(3)
+        ],
+        "license": [{
+            "URL": "http://creativecommons.org/licenses/by/4.0/",
+            "start": {"date-parts": [[2020, 1, 1]]},
+        }],
+        "published-print": {"date-parts": [[2022, 5, 1]]},
+        "issued": {"date-parts": [[2022, 5, 1]]},
+    }
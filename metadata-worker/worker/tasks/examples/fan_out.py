@@ -0,0 +1,18 @@
+from worker.nw.utils import Result, Many
+
+
+def run(args):
+    """
+    Load generator, creates params.items task units. With params.size every
+    item is a payload of that many bytes, a str or bytes if params.binary
+    is set, otherwise items are numbered from 1 (falsy data like 0 is not
+    handed on to the next step).
+    """
+    params = args.get("params", {})
+    items = params.get("items", 1)
+    size = params.get("size", 0)
+    binary = params.get("binary", False)
+    if not size:
+        return Result(data=Many(i for i in range(1, items + 1)))
+    payload = b"x" * size if binary else "x" * size
+    return Result(data=Many(payload for _ in range(items)))
@@ -8,4 +8,6 @@ logger.setLevel("DEBUG")
 def run(args):
     number_of_messages_to_create = args["params"].get("messages")
     logger.debug(f"Creating {number_of_messages_to_create} messages")
-    return Result(data=Many([i for i in range(number_of_messages_to_create)]))
+    # a generator, the next step can start with the first message before
+    # all messages were created
+    return Result(data=Many(i for i in range(number_of_messages_to_create)))
@@ -0,0 +1,5 @@
+from worker.nw.utils import Result
+
+
+def run(args):
+    return Result(data=args.get("data"))
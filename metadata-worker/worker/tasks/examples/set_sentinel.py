@@ -0,0 +1,13 @@
+from worker.nw.utils import Result
+
+
+def run(args):
+    """
+    Sets params.sentinel (default: the data of the task unit) as the
+    sentinel of the pipeline and passes the data on.
+    """
+    params = args.get("params", {})
+    return Result(
+        data=args.get("data"),
+        sentinel=[params.get("sentinel", args.get("data"))],
+    )
@@ -23,6 +23,7 @@ to the next job.
 
 import os
 from worker.nw.utils import Result, Many
+from worker.tasks.utils.compression import JSON_LINES, strip_suffix
 from pathlib import Path
 
 
@@ -37,16 +38,23 @@ def run(opts):
         - opts["data"]: str, required
           a path to the location which files should be retrieved from
         - opts["params"]["ext"]: str or list, required
-          only files with this extensions will be considered
+          only files with this extensions will be considered, compressed
+          files (.gz, .zst) match their extension without the compression
+          suffix, and ".json" matches JSON lines files (.jsonl) as well
         - opts["params"]["single_output"]: bool, optional
           if set to true one list will be returned,
           otherwise the list will be returned with Many
+        - opts["params"]["stream"]: bool, optional
+          if set to true (and single_output is not set) the file paths are
+          returned with a generator in Many while the directory is scanned,
+          so the next step can start with the first file. No file_count
+          metric is returned in this case
 
     Returns
     ------
     Result:
         - A nightwatch Result with the parameters:
-            - data list or Many(list):
+            - data list or Many(list) or Many(generator):
               a list of all file paths as strings or Many lists
               with one file path each
             - metrics dict, metrics about the number of files found
@@ -59,20 +67,28 @@ def run(opts):
     if type(extensions) != list:
         raise ValueError('"extensions" param must be a list or a string')
 
-    import_files = []
+    single_output = opts["params"].get("single_output")
+    if opts["params"].get("stream") and not single_output:
+        return Result(data=Many(find_files(import_dir, extensions)))
+
+    import_files = list(find_files(import_dir, extensions))
+    data = import_files if single_output else Many(import_files)
+    return Result(data=data, metrics={"file_count": len(import_files)})
+
+
+def find_files(import_dir, extensions):
+    """
+    Walks through import_dir and yields the paths, relative to METADATA,
+    of all files with one of the given extensions
+    """
+    extensions = tuple(extensions)
+    if ".json" in extensions:
+        extensions += (JSON_LINES,)
     for path, subdirs, files in os.walk(import_dir):
         for name in files:
-            if name.endswith(tuple(extensions)):
-                import_files.append(
-                    Path(
-                        os.path.join(path, name).replace(
-                            os.environ["METADATA"] + os.sep, ""
-                        )
-                    ).as_posix()
-                )
-    data = (
-        import_files
-        if opts["params"].get("single_output")
-        else Many(import_files)
-    )
-    return Result(data=data, metrics={"file_count": len(import_files)})
+            if strip_suffix(name).endswith(extensions):
+                yield Path(
+                    os.path.join(path, name).replace(
+                        os.environ["METADATA"] + os.sep, ""
+                    )
+                ).as_posix()
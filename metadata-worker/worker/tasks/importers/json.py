@@ -10,6 +10,11 @@ A convert flag can be set, if set to true the file content will be returned
 converted to a dict, if set to false or not set the raw file content will
 be returned.
 
+Files compressed with gzip (.gz) or zstd (.zst, needs the zstandard package)
+are decompressed while they are read. The lines of JSON lines files (.jsonl,
+e.g. written by the crossref downloader) are returned one by one with Many,
+the file is read while the next step runs.
+
 ================== Nightwatch usage ==================
 {
     "id": "pipelines.tasks.importers.json",
@@ -27,10 +32,16 @@ be returned.
 
 import os
 import json
-from worker.nw.utils import Result
+from worker.nw.utils import Result, Many
+from worker.tasks.utils.compression import JSON_LINES, open_file, strip_suffix
 from pathlib import Path
 
 
+def file_path(opts):
+    subpath = opts.get("params", {}).get("path") or opts["data"]
+    return str(Path(os.environ["METADATA"]) / Path(subpath))
+
+
 def run(opts):
     """
     Opens the file in a specified location, if available, and returns
@@ -52,14 +63,22 @@ def run(opts):
     ------
     Result:
         - A nightwatch Result with the parameters:
-            - data dict or str
-              a dict or a str containing the file content
+            - data dict or str or Many(generator)
+              a dict or a str containing the file content, for JSON lines
+              files one dict or str per line
     """
 
-    subpath = opts.get("params", {}).get("path") or opts["data"]
-    path = str(Path(os.environ["METADATA"]) / Path(subpath))
-    with open(path, "r", encoding="utf8") as f:
-        data = f.read()
-        if opts.get("params", {}).get("convert"):
-            data = json.loads(data)
+    path = file_path(opts)
+    convert = opts.get("params", {}).get("convert")
+    if strip_suffix(path).endswith(JSON_LINES):
+        return Result(data=Many(read_lines(path, convert)))
+    with open_file(path, "r") as f:
+        data = json.load(f) if convert else f.read()
         return Result(data=data)
+
+
+def read_lines(path, convert=False):
+    with open_file(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line) if convert else line
@@ -0,0 +1,78 @@
+import gzip
+import io
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+# file name suffix of each compression
+SUFFIXES = {GZIP: ".gz", ZSTD: ".zst"}
+JSON_LINES = ".jsonl"
+
+
+def suffix(compression):
+    """
+    Returns the file name suffix of a compression, "" for None
+
+    Raises a ValueError for unknown compressions and for zstd without the
+    zstandard package
+    """
+    if not compression:
+        return ""
+    if compression not in SUFFIXES:
+        raise ValueError(f"unknown compression {compression}")
+    if compression == ZSTD and zstandard is None:
+        raise ValueError(
+            "zstd compression needs the zstandard package (extra zstd)"
+        )
+    return SUFFIXES[compression]
+
+
+def compression_of(path):
+    for compression, ext in SUFFIXES.items():
+        if str(path).endswith(ext):
+            return compression
+    return None
+
+
+def strip_suffix(name):
+    """
+    The file name without its compression suffix
+    """
+    compression = compression_of(name)
+    if compression:
+        return name[:-len(SUFFIXES[compression])]
+    return name
+
+
+def open_file(path, mode="r"):
+    """
+    Opens a plain, gzip or zstd file, chosen by the file name suffix. Text
+    modes are UTF-8, compressed files are decompressed while they are read.
+    """
+    compression = compression_of(path)
+    if compression == GZIP:
+        if "b" in mode:
+            return gzip.open(path, mode)
+        return gzip.open(path, mode + "t", encoding="utf8")
+    if compression == ZSTD:
+        suffix(ZSTD)
+        raw = open(path, mode.replace("t", "").replace("b", "") + "b")
+        if "r" in mode:
+            # appended pages are separate frames
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                raw, read_across_frames=True, closefd=True
+            )
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(
+                raw, closefd=True
+            )
+        if "b" in mode:
+            return stream
+        return io.TextIOWrapper(stream, encoding="utf8")
+    if "b" in mode:
+        return open(path, mode)
+    return open(path, mode, encoding="utf8")
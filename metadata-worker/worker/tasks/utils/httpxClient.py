@@ -15,16 +15,16 @@ class httpxClient:
     post(url, **params)
         Calls httpx post for given url with custom client and given parameters
         and returns the result
-    stream(method, url)
+    stream(method, url, **params)
         Calls httpx stream for given url with custom client and given method
-        parameter and returns the stream
+        and parameters and returns the stream
     checkStatusCodeOK(statusCode)
         Uses httpx.codes.OK to check if given statusCode is OK
     close(self)
         Closes the httpxClient owned by the instance
     """
 
-    def __init__(self, timeout=30.0):
+    def __init__(self, timeout=30.0, timeout_retries=3):
         """
         Parameters
         ----------
@@ -33,8 +33,13 @@ class httpxClient:
             The timeout set on the client instance, used as the default
             timeout for get and post requests.
             Can be overwritten in individual calls in *params
+        param timeout_retries : int
+            Default value: 3
+            How often get is repeated with a doubled timeout after a read
+            timeout
         """
         self.timeout = timeout
+        self.timeout_retries = timeout_retries
         self.client = httpx.Client(timeout=timeout)
         return None
 
@@ -61,7 +66,7 @@ class httpxClient:
         try:
             r = self.client.get(url, **params)
         except httpx.ReadTimeout as e:
-            if attempt < 3:
+            if attempt < self.timeout_retries:
                 params["attempt"] = attempt + 1
                 if "timeout" in params:
                     params["timeout"] = params["timeout"] * 2
@@ -76,8 +81,8 @@ class httpxClient:
         r = self.client.post(url, **params)
         return r
 
-    def stream(self, method, url):
-        return self.client.stream(method, url)
+    def stream(self, method, url, **params):
+        return self.client.stream(method, url, **params)
 
     def checkStatusCodeOK(self, statusCode: int) -> bool:
         return statusCode == httpx.codes.OK